@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Control de admisión por memoria y autoscale de workers según RSS medida.
+
+La memoria del OCR varía en órdenes de magnitud entre un escaneo de 1 página
+en blanco y negro y uno de 200 páginas en color. Con --concurrency fijo o se
+desaprovecha la máquina o el kernel mata workers, y task_reject_on_worker_lost
+convierte cada muerte en una nueva entrega del mismo documento.
+
+Admisión (tasks.process_pdf, antes de reclamar el nodo):
+  1. Se estima la memoria del documento con el perfil del pre-flight
+     (pdf_pages: DPI y color por página, ver preflight.py) y OCR_JOBS: las
+     páginas que ocrmypdf rasteriza a la vez más una base por proceso. La
+     estimación se corrige con la razón medida/estimada de las últimas
+     ejecuciones del host (ocr_runs.peak_rss_mb / est_mem_mb).
+  2. Presupuesto libre = memoria disponible - OCR_MEM_RESERVE_MB - lo que las
+     tareas en curso del host reservaron y todavía no consumen. Las reservas
+     viven en <OCR_SCRATCH_DIR>/admission/, un archivo por proceso.
+  3. Si cabe (o el host no tiene otra tarea en curso) se ejecuta; si no, la
+     tarea se vuelve a encolar con retraso (OCR_ADMISSION_RETRY segundos).
+     Un documento que no cabría ni con el host vacío se desvía a
+     OCR_LARGE_QUEUE si está definida. Tras OCR_ADMISSION_MAX_DEFER
+     aplazamientos se ejecuta igual, para no dejarlo esperando indefinidamente.
+
+Durante el OCR un hilo mide la RSS del proceso y sus hijos (ocrmypdf,
+Tesseract, Ghostscript); el pico queda en ocr_runs.peak_rss_mb.
+
+Autoscale: con `start_workers.py --autoscale MAX,MIN`, Celery usa
+MemoryAutoscaler (worker_autoscaler en tasks.py), que además del largo de la
+cola limita los procesos a los que caben en memoria según el p90 de RSS
+medido en el host. Con varios workers en el mismo host, cada uno cuenta solo
+sus procesos ocupados y recibe una parte igual de la memoria libre.
+
+Configuración por variables de entorno:
+  OCR_ADMISSION            0 para desactivar la admisión (default: 1)
+  OCR_MEM_RESERVE_MB       memoria reservada para el sistema (default: 2048)
+  OCR_ADMISSION_RETRY      segundos hasta reintentar una tarea aplazada (default: 30)
+  OCR_ADMISSION_MAX_DEFER  aplazamientos antes de forzar la ejecución (default: 20)
+  OCR_LARGE_QUEUE          cola para documentos que no caben en este host (default: ninguna)
+
+Requiere psutil; sin él la admisión siempre ejecuta.
+"""
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pymysql
+
+from ocr_pipeline import scratch_root
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+try:
+    from celery.worker.autoscale import Autoscaler
+except Exception:
+    Autoscaler = None
+
+# Modelo de memoria por documento (MB)
+BASE_MB = 150           # ocrmypdf + pikepdf + Ghostscript sin páginas en vuelo
+RASTER_FACTOR = 6       # copias de cada página rasterizada (unpaper, deskew, Tesseract)
+PER_PAGE_MB = 0.5       # ensamblado del PDF de salida
+DEFAULT_DPI = 300       # páginas sin pre-flight o sin imágenes: ocrmypdf rasteriza a ~300
+A4_IN = (8.27, 11.69)
+
+SAMPLE_S = 0.5          # periodo del muestreo de RSS
+STALE_S = 30            # una reserva sin actualizar en este tiempo se ignora
+CORRECTION_TTL_S = 300  # caché de la corrección medida/estimada
+CORRECTION_RANGE = (0.25, 4.0)
+
+_cache = {}
+
+
+def settings():
+    return {
+        'enabled': os.environ.get('OCR_ADMISSION', '1') != '0' and psutil is not None,
+        'reserve_mb': float(os.environ.get('OCR_MEM_RESERVE_MB', 2048)),
+        'retry_s': int(os.environ.get('OCR_ADMISSION_RETRY', 30)),
+        'max_defer': int(os.environ.get('OCR_ADMISSION_MAX_DEFER', 20)),
+        'large_queue': os.environ.get('OCR_LARGE_QUEUE') or None,
+    }
+
+
+def _jobs():
+    try:
+        return max(1, int(os.environ.get('OCR_JOBS', 1)))
+    except ValueError:
+        return 1
+
+
+def model_mb(pages, dpi=None, color=False, jobs=1):
+    """Memoria estimada (MB) de ocrmypdf para un documento, sin corrección"""
+    pages = max(1, int(pages or 1))
+    dpi = min(int(dpi or DEFAULT_DPI), int(os.environ.get('OCR_MAX_DPI', 400)))
+    raster_mb = (A4_IN[0] * dpi) * (A4_IN[1] * dpi) * (3 if color else 1) / 2**20
+    return BASE_MB + min(jobs, pages) * raster_mb * RASTER_FACTOR + pages * PER_PAGE_MB
+
+
+def estimate_raw_mb(conn, node_id):
+    """Estimación del modelo a partir de pdf_metadata.pages y el pre-flight de pdf_pages"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT p.pages, MAX(pp.image_dpi) as dpi, MAX(pp.is_color) as color
+               FROM pdf_metadata p LEFT JOIN pdf_pages pp ON pp.node_id = p.node_id
+               WHERE p.node_id = %s GROUP BY p.node_id, p.pages""",
+            (node_id,)
+        )
+        row = cur.fetchone() or {}
+    return model_mb(row.get('pages'), row.get('dpi'), bool(row.get('color')), _jobs())
+
+
+def correction(conn, host=None):
+    """Mediana de peak_rss_mb / est_mem_mb de las últimas ejecuciones del host (1.0 sin datos)"""
+    host = host or socket.gethostname()
+    cached = _cache.get(('correction', host))
+    if cached and time.monotonic() - cached[0] < CORRECTION_TTL_S:
+        return cached[1]
+    ratio = 1.0
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT peak_rss_mb / est_mem_mb as r FROM ocr_runs
+                   WHERE (worker = %s OR worker LIKE %s) AND status='done' AND peak_rss_mb > 0 AND est_mem_mb > 0
+                   ORDER BY id DESC LIMIT 200""",
+                (host, '%@' + host)
+            )
+            values = [float(r['r']) for r in cur.fetchall()]
+        if len(values) >= 5:
+            ratio = min(max(statistics.median(values), CORRECTION_RANGE[0]), CORRECTION_RANGE[1])
+    except pymysql.MySQLError:
+        pass
+    _cache[('correction', host)] = (time.monotonic(), ratio)
+    return ratio
+
+
+def typical_task_mb(conn_factory, host=None):
+    """p90 del pico de RSS por tarea medido en el host (None sin datos)"""
+    host = host or socket.gethostname()
+    cached = _cache.get(('p90', host))
+    if cached and time.monotonic() - cached[0] < CORRECTION_TTL_S:
+        return cached[1]
+    p90 = None
+    try:
+        conn = conn_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT peak_rss_mb FROM ocr_runs WHERE (worker = %s OR worker LIKE %s) AND peak_rss_mb > 0
+                       ORDER BY id DESC LIMIT 500""",
+                    (host, '%@' + host)
+                )
+                values = sorted(int(r['peak_rss_mb']) for r in cur.fetchall())
+        finally:
+            conn.close()
+        if len(values) >= 5:
+            p90 = values[int(0.9 * (len(values) - 1))]
+    except pymysql.MySQLError:
+        pass
+    _cache[('p90', host)] = (time.monotonic(), p90)
+    return p90
+
+
+# --- Reservas del host ---------------------------------------------------------
+
+def ledger_dir():
+    path = scratch_root() / 'admission'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _own_file():
+    return ledger_dir() / f"{socket.gethostname()}_{os.getpid()}.json"
+
+
+def _entries(exclude_self=True):
+    """Reservas vigentes del host: procesos vivos con la reserva actualizada hace poco"""
+    host = socket.gethostname()
+    now = time.time()
+    entries = []
+    for f in ledger_dir().glob(f"{host}_*.json"):
+        try:
+            pid = int(f.stem.rsplit('_', 1)[1])
+            if exclude_self and pid == os.getpid():
+                continue
+            if now - f.stat().st_mtime > STALE_S or not psutil.pid_exists(pid):
+                f.unlink(missing_ok=True)
+                continue
+            entries.append(dict(json.loads(f.read_text(encoding='utf-8')), pid=pid))
+        except (ValueError, OSError):
+            continue
+    return entries
+
+
+def outstanding_mb(entries):
+    """Memoria reservada que las tareas en curso todavía no consumen"""
+    return sum(max(0.0, e['reserved_mb'] - e['rss_mb']) for e in entries)
+
+
+def _write(node_id, reserved_mb, rss_mb):
+    f = _own_file()
+    tmp = f.with_suffix('.tmp')
+    tmp.write_text(json.dumps({'node_id': node_id, 'reserved_mb': reserved_mb, 'rss_mb': rss_mb}),
+                   encoding='utf-8')
+    os.replace(tmp, f)
+
+
+@contextmanager
+def _ledger_lock(timeout=10):
+    """Exclusión entre procesos del host (mkdir es atómico en todos los SO)"""
+    lock = ledger_dir() / '.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            lock.mkdir()
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock.stat().st_mtime > timeout:
+                    lock.rmdir()    # dueño muerto a mitad de la sección crítica
+                    continue
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                break   # mejor decidir sin lock que bloquear el worker
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            lock.rmdir()
+        except OSError:
+            pass
+
+
+def admit(conn, node_id, deferrals=0, queue=None):
+    """
+    Decide si el documento entra ahora en este host.
+
+    Returns:
+        SimpleNamespace: action ('run'|'defer'|'reroute'), est_mb, free_mb, reason
+    """
+    s = settings()
+    if not s['enabled']:
+        return SimpleNamespace(action='run', est_mb=None, free_mb=None, reason='admisión desactivada')
+    est = estimate_raw_mb(conn, node_id) * correction(conn)
+    mem = psutil.virtual_memory()
+    ceiling = mem.total / 2**20 - s['reserve_mb']
+
+    if est > ceiling and s['large_queue'] and queue != s['large_queue']:
+        return SimpleNamespace(action='reroute', est_mb=est, free_mb=None,
+                               reason=f"{est:.0f} MB > {ceiling:.0f} MB utilizables en el host")
+    with _ledger_lock():
+        entries = _entries()
+        free = psutil.virtual_memory().available / 2**20 - s['reserve_mb'] - outstanding_mb(entries)
+        if est <= free or not entries or deferrals >= s['max_defer']:
+            _write(node_id, est, 0.0)
+            reason = 'cabe' if est <= free else ('host sin otras tareas' if not entries else 'máximo de aplazamientos')
+            return SimpleNamespace(action='run', est_mb=est, free_mb=free, reason=reason)
+    return SimpleNamespace(action='defer', est_mb=est, free_mb=free,
+                           reason=f"{est:.0f} MB estimados > {free:.0f} MB libres")
+
+
+def release():
+    """Libera la reserva del proceso (idempotente)"""
+    try:
+        _own_file().unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def _tree_rss_mb(proc):
+    total = 0
+    try:
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    for p in procs:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / 2**20
+
+
+@contextmanager
+def measure(node_id=None, reserved_mb=None):
+    """
+    Mide el pico de RSS del proceso y sus hijos mientras dura el bloque y
+    mantiene al día la reserva (si la hay) para que otras admisiones vean lo
+    ya consumido.
+
+    Yields:
+        SimpleNamespace con peak_mb (disponible al salir del bloque)
+    """
+    state = SimpleNamespace(peak_mb=None)
+    if psutil is None:
+        yield state
+        return
+    stop = threading.Event()
+    proc = psutil.Process()
+    state.peak_mb = _tree_rss_mb(proc)
+
+    def loop():
+        while not stop.wait(SAMPLE_S):
+            rss = _tree_rss_mb(proc)
+            state.peak_mb = max(state.peak_mb, rss)
+            if reserved_mb is not None:
+                try:
+                    _write(node_id, reserved_mb, rss)
+                except OSError:
+                    pass
+
+    thread = threading.Thread(target=loop, name='rss-sampler', daemon=True)
+    thread.start()
+    try:
+        yield state
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+        state.peak_mb = max(state.peak_mb, _tree_rss_mb(proc))
+
+
+# --- Autoscale -------------------------------------------------------------------
+
+def memory_slots(busy, conn_factory, workers=1):
+    """
+    Procesos que caben en un worker: los suyos ocupados más su parte (1/workers)
+    de los que entran en la memoria libre del host (descontadas las reservas
+    pendientes) al p90 de RSS medido.
+    """
+    s = settings()
+    if psutil is None:
+        return None
+    per_task = typical_task_mb(conn_factory) or model_mb(2, DEFAULT_DPI, False, _jobs())
+    free = psutil.virtual_memory().available / 2**20 - s['reserve_mb'] - outstanding_mb(_entries(False))
+    return busy + max(0, int(free / max(1, workers) // per_task))
+
+
+def _worker_count():
+    """
+    Workers Celery con autoscale en el host (incluido este): cada uno renueva
+    un marcador en <ledger>/workers/ y se cuentan los vigentes.
+    """
+    wdir = ledger_dir() / 'workers'
+    wdir.mkdir(exist_ok=True)
+    host = socket.gethostname()
+    (wdir / f"{host}_{os.getpid()}").touch()
+    now = time.time()
+    count = 0
+    for f in wdir.glob(f"{host}_*"):
+        try:
+            pid = int(f.name.rsplit('_', 1)[1])
+            if now - f.stat().st_mtime > STALE_S or not psutil.pid_exists(pid):
+                f.unlink(missing_ok=True)
+                continue
+            count += 1
+        except (ValueError, OSError):
+            continue
+    return max(1, count)
+
+
+if Autoscaler is not None:
+    class MemoryAutoscaler(Autoscaler):
+        """Autoscaler de Celery con techo de procesos por memoria medida"""
+
+        def _memory_cap(self):
+            from tasks import DB_CONF   # import diferido: tasks importa este módulo
+            now = time.monotonic()
+            if now - getattr(self, '_cap_at', 0) > 5:
+                if psutil is None:
+                    self._cap = None
+                else:
+                    # Solo cuentan los procesos hijos de este worker; la memoria libre
+                    # se reparte entre los workers del host
+                    children = {p.pid for p in psutil.Process().children(recursive=True)}
+                    busy = sum(1 for e in _entries(False) if e['pid'] in children)
+                    self._cap = memory_slots(busy, lambda: pymysql.connect(**DB_CONF), _worker_count())
+                self._cap_at = now
+            return self._cap
+
+        def _maybe_scale(self, req=None):
+            procs = self.processes
+            cap = self._memory_cap()
+            limit = self.max_concurrency if cap is None else max(self.min_concurrency, min(self.max_concurrency, cap))
+            cur = min(self.qty, limit)
+            if cur > procs:
+                self.scale_up(cur - procs)
+                return True
+            cur = min(max(self.qty, self.min_concurrency), limit)
+            if cur < procs:
+                self.scale_down(procs - cur)
+                return True
+            return False
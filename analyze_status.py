@@ -6,6 +6,9 @@ import os
 from dotenv import load_dotenv
 import pymysql
 
+from status_counts import read_counts
+from timings import stage_report
+
 load_dotenv()
 
 DB_CONF = {
@@ -26,12 +29,10 @@ def main():
         print("="*80)
         
         # Resumen general
-        with conn.cursor() as cur:
-            cur.execute("SELECT ocr_status, COUNT(*) as cnt FROM pdf_metadata GROUP BY ocr_status")
-            rows = cur.fetchall()
-            print("\n📊 RESUMEN GENERAL:")
-            for r in rows:
-                print(f"   {r['ocr_status']:12}: {r['cnt']:6} registros")
+        stats, _ = read_counts(conn)
+        print("\n📊 RESUMEN GENERAL:")
+        for status, cnt in stats.items():
+            print(f"   {status:12}: {cnt:6} registros")
         
         # Primeros 60 registros
         with conn.cursor() as cur:
@@ -68,11 +69,13 @@ def main():
                     print(f"\nID: {r['id']} | {r['path']}")
                     print(f"   Error: {r['last_error'][:200] if r['last_error'] else 'Sin mensaje'}")
         
-        # Registros en processing (posibles atorados)
+        # Registros en processing: vivos si su worker sigue enviando heartbeat
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT n.id, n.path, p.ocr_started_at, 
-                       TIMESTAMPDIFF(MINUTE, p.ocr_started_at, NOW()) as minutos_transcurridos
+                SELECT n.id, n.path, p.ocr_started_at, p.lease_owner,
+                       TIMESTAMPDIFF(MINUTE, p.ocr_started_at, NOW()) as minutos_transcurridos,
+                       TIMESTAMPDIFF(SECOND, p.heartbeat_at, NOW()) as segundos_sin_heartbeat,
+                       (p.lease_expires_at IS NULL OR p.lease_expires_at < NOW()) as vencido
                 FROM nodes n 
                 JOIN pdf_metadata p ON n.id=p.node_id 
                 WHERE p.ocr_status='processing'
@@ -80,10 +83,26 @@ def main():
             rows = cur.fetchall()
             
             if rows:
-                print(f"\n⏳ REGISTROS EN PROCESSING (posibles atorados):")
+                print(f"\n⏳ REGISTROS EN PROCESSING:")
                 print("-"*80)
                 for r in rows:
-                    print(f"ID: {r['id']:4} | {r['path']:45} | Hace {r['minutos_transcurridos']} minutos")
+                    beat = r['segundos_sin_heartbeat']
+                    state = 'ATORADO (sin heartbeat)' if r['vencido'] else f"vivo, heartbeat hace {beat}s"
+                    print(f"ID: {r['id']:4} | {r['path']:45} | Hace {r['minutos_transcurridos']} minutos | {state}")
+        
+        # Tiempos por etapa (ocr_runs)
+        try:
+            report = stage_report(conn)
+        except pymysql.err.ProgrammingError:
+            report = []  # tabla ocr_runs aún no creada
+        if report:
+            print(f"\n⏱️  TIEMPOS POR ETAPA (últimas {report[-1]['runs']} ejecuciones exitosas, segundos):")
+            print("-"*80)
+            print(f"   {'etapa':8} | {'p50':>8} {'p95':>8} {'p99':>8} | {'p50/pág':>8} {'p95/pág':>8} {'p99/pág':>8}")
+            for r in report:
+                cells = [r[k] for k in ('p50', 'p95', 'p99', 'page_p50', 'page_p95', 'page_p99')]
+                cells = [f"{c / 1000:8.2f}" if c is not None else f"{'-':>8}" for c in cells]
+                print(f"   {r['stage']:8} | {' '.join(cells[:3])} | {' '.join(cells[3:])}")
         
         # Explicación sobre comportamiento
         print("\n" + "="*80)
@@ -105,8 +124,9 @@ def main():
    ⚠️  Necesitas cambiarlos manualmente a 'pending' para re-intentar
    
 4️⃣  REGISTROS CON 'processing':
-   ⏭️  Se OMITEN (se asume que otro worker los está procesando)
-   ⚠️  Si están "atorados", necesitas cambiarlos a 'pending' manualmente
+   ⏭️  Se OMITEN mientras su worker envíe heartbeat (lease vigente)
+   🔁 Si el worker muere, el lease vence en OCR_LEASE_SECONDS y el reaper
+      (Celery beat o reset_failed.py --free-stuck) los devuelve a 'pending'
 
 💡 COMANDOS ÚTILES:
 
@@ -114,13 +134,13 @@ def main():
    UPDATE pdf_metadata SET ocr_status='pending', last_error=NULL 
    WHERE ocr_status='failed';
    
-   # Liberar los atorados en processing (más de 30 min)
-   UPDATE pdf_metadata SET ocr_status='pending' 
+   # Liberar los atorados en processing (lease vencido, sin heartbeat)
+   UPDATE pdf_metadata SET ocr_status='pending', lease_owner=NULL, lease_expires_at=NULL
    WHERE ocr_status='processing' 
-   AND TIMESTAMPDIFF(MINUTE, ocr_started_at, NOW()) > 30;
+   AND lease_expires_at < NOW();
    
-   # Ver cuántos hay de cada tipo
-   SELECT ocr_status, COUNT(*) FROM pdf_metadata GROUP BY ocr_status;
+   # Ver cuántos hay de cada tipo (contadores materializados)
+   SELECT ocr_status, SUM(cnt) FROM ocr_status_counts GROUP BY ocr_status;
         """)
         
     finally:
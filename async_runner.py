@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Runner asyncio para process_sync.py (--async): un solo proceso que mantiene N
+documentos en vuelo sin Celery ni Redis.
+
+El modo síncrono procesa un PDF a la vez y en un nodo sin broker deja los
+cores ociosos mientras Tesseract espera E/S. Aquí:
+
+  - un productor lee los pendientes por lotes (orden de scheduling.py) y los
+    pone en una cola acotada (--queue-size, default 2*N): nunca se cargan en
+    memoria más filas de las que se pueden procesar pronto
+  - N slots toman nodos de la cola; cada uno tiene su conexión MariaDB
+    (reclamo, incremental/caché, cierre y ocr_runs), usada desde un hilo
+  - ocrmypdf y pdftotext se lanzan desde el event loop con
+    asyncio.create_subprocess_exec (ocr_pipeline.subprocess_runner); las
+    partes en Python de ocr_document (pikepdf, caché, publicación) corren en
+    el hilo del slot
+  - cada documento tiene un plazo (--job-timeout, default OCR_HARD_TIMEOUT)
+    que acota a sus procesos hijos junto con su timeout propio: al vencer se
+    mata el hijo y el nodo queda 'failed' con TimeoutExpired
+  - un único heartbeat renueva los leases (lease.py) de todos los nodos en
+    vuelo con una conexión propia, en vez de un hilo por documento
+
+Con Ctrl+C se matan los procesos hijos y los nodos en vuelo vuelven a
+'pending' sin esperar al reaper.
+
+Uso:
+    python process_sync.py --async --concurrency 8 --limit 0
+"""
+import asyncio
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+import pymysql
+
+from ocr_pipeline import scratch_workdir, resolve_profile, subprocess_runner
+from scheduling import pending_query
+from lease import new_token, claim_node, complete_node, renew_lease, heartbeat_interval, lease_guard, LeaseLost
+from timings import StageTimer, save_run
+import metrics
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+SOURCE = 'async'
+# Filas pedidas por consulta del productor (además de las que ya están en la cola)
+FETCH_BATCH = 200
+
+
+def default_job_timeout():
+    return int(os.environ.get('OCR_HARD_TIMEOUT', 900))
+
+
+class AsyncRunner:
+    """
+    Procesa los pendientes con `concurrency` documentos simultáneos.
+
+    process_one(conn, node_id, rel_path, workdir, profile, timer, guard) corre en
+    un hilo y devuelve (ocr_pdf_path, ocr_text, snippet, result) como
+    process_sync.do_ocr; guard (lease.lease_guard) se pasa a ocr_document para
+    no publicar nodos cuyo lease se perdió; finish(node_id, rel_path, ocr_text, pages, profile)
+    se llama tras cerrar el nodo como 'done' (indexación).
+    """
+
+    def __init__(self, process_one, concurrency, policy=None, limit=None, queue_size=None,
+                 job_timeout=None, explicit_profile=None, finish=None, log=print):
+        self.process_one = process_one
+        self.concurrency = max(1, int(concurrency))
+        self.policy = policy
+        self.limit = limit or None
+        self.queue_size = queue_size or 2 * self.concurrency
+        self.job_timeout = job_timeout or default_job_timeout()
+        self.explicit_profile = explicit_profile
+        self.finish = finish
+        self.log = log
+        self.inflight = {}      # node_id -> token (nodos reclamados)
+        self.lost = set()       # nodos cuyo lease pasó a otro proceso
+        self.children = set()   # procesos hijos vivos
+        self.stats = {'done': 0, 'failed': 0, 'skipped': 0, 'pages': 0}
+        self.loop = None
+        self.executor = None
+
+    # --- Procesos hijos -----------------------------------------------------
+
+    async def _exec(self, cmd, timeout):
+        """Equivalente async de subprocess.run(check=True, capture_output=True, text=True)"""
+        proc = await asyncio.create_subprocess_exec(
+            *[str(c) for c in cmd], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        self.children.add(proc)
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            self.children.discard(proc)
+        out = out.decode('utf-8', errors='replace')
+        err = err.decode('utf-8', errors='replace')
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+        return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+    def _runner_for(self, deadline):
+        """subprocess_runner de un documento: acota cada hijo al plazo restante del documento"""
+        def run(cmd, timeout=None):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(cmd, self.job_timeout)
+            timeout = min(timeout, remaining) if timeout else remaining
+            return asyncio.run_coroutine_threadsafe(self._exec(cmd, timeout), self.loop).result()
+        return run
+
+    async def _in_thread(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    # --- Productor ----------------------------------------------------------
+
+    def _fetch(self, conn, size):
+        with conn.cursor() as cur:
+            cur.execute(*pending_query(self.policy, size))
+            rows = cur.fetchall()
+        conn.commit()   # cerrar la transacción: la siguiente lectura ve los cambios de otros
+        return rows
+
+    async def producer(self, queue):
+        """Lee pendientes por lotes; cada nodo se encola una sola vez por ejecución"""
+        conn = await self._in_thread(lambda: metrics.connect(**DB_CONF))
+        seen = set()
+        try:
+            while self.limit is None or len(seen) < self.limit:
+                # Los nodos en cola siguen 'pending': se piden además del lote
+                rows = await self._in_thread(self._fetch, conn, FETCH_BATCH + queue.qsize() + self.concurrency)
+                fresh = [r for r in rows if r['node_id'] not in seen]
+                if not fresh:
+                    break
+                for r in fresh:
+                    if self.limit is not None and len(seen) >= self.limit:
+                        break
+                    seen.add(r['node_id'])
+                    await queue.put(r)
+        finally:
+            conn.close()
+        for _ in range(self.concurrency):
+            await queue.put(None)   # fin de la cola, uno por slot
+        return len(seen)
+
+    # --- Slots --------------------------------------------------------------
+
+    def _process(self, conn, node_id, rel, token, deadline, timer):
+        """Cuerpo de un documento (hilo del slot); devuelve (estado, resultado, perfil, error)"""
+        profile = None
+        runner_token = subprocess_runner.set(self._runner_for(deadline))
+        try:
+            # El guard corta antes de publicar si el heartbeat marcó el nodo como perdido
+            guard = lease_guard(conn, node_id, token, lambda: node_id in self.lost)
+            with scratch_workdir(node_id) as td:
+                profile = resolve_profile(rel, self.explicit_profile)
+                ocr_pdf_path, ocr_text, snippet, result = self.process_one(conn, node_id, rel, td, profile, timer,
+                                                                           guard=guard)
+            with timer.stage('db'):
+                accepted = complete_node(conn, node_id, token, 'done', {
+                    'ocr_pdf_path': ocr_pdf_path, 'ocr_text': ocr_text, 'snippet': snippet, 'ocr_profile': profile,
+                })
+            if not accepted:
+                return 'lost', result, profile, None
+            save_run(conn, node_id, SOURCE, timer, 'done', result)
+            metrics.record_run(SOURCE, 'done', timer, result)
+            if self.finish:
+                self.finish(node_id, rel, ocr_text, result.get('pages'), profile)
+            return 'done', result, profile, None
+        except LeaseLost:
+            return 'lost', None, profile, None
+        except Exception as e:
+            try:
+                conn.rollback()
+                if complete_node(conn, node_id, token, 'failed', {'last_error': str(e)}):
+                    save_run(conn, node_id, SOURCE, timer, 'failed', {'profile': profile})
+                    metrics.record_run(SOURCE, 'failed', timer, error=type(e).__name__)
+            except Exception as db_error:
+                print(f'FAILED node={node_id} no se pudo registrar el fallo: {db_error}')
+            return 'failed', None, profile, e
+        finally:
+            subprocess_runner.reset(runner_token)
+
+    async def slot(self, queue):
+        conn = await self._in_thread(lambda: metrics.connect(**DB_CONF))
+        try:
+            while True:
+                row = await queue.get()
+                if row is None:
+                    return
+                node_id, rel = row['node_id'], row['path']
+                token = new_token()
+                if not await self._in_thread(claim_node, conn, node_id, token):
+                    metrics.task_skipped(SOURCE)
+                    self.stats['skipped'] += 1
+                    self.log(f'SKIP node={node_id} path={rel} (reclamado por otro proceso)')
+                    continue
+                metrics.task_started(SOURCE)
+                self.inflight[node_id] = token
+                timer = StageTimer()
+                t0 = time.perf_counter()
+                status, result, profile, error = await self._in_thread(
+                    self._process, conn, node_id, rel, token, time.monotonic() + self.job_timeout, timer)
+                # Si se cancela antes, el nodo sigue en inflight y run() lo devuelve a 'pending'
+                self.inflight.pop(node_id, None)
+                self.lost.discard(node_id)
+                seconds = time.perf_counter() - t0
+                if status == 'done':
+                    self.stats['done'] += 1
+                    self.stats['pages'] += result.get('pages_ocr') or 0
+                    self.log(f"OK node={node_id} path={rel} mode={result.get('mode')} "
+                             f"pages={result.get('pages_ocr') or 0} {seconds:.1f}s")
+                elif status == 'lost':
+                    metrics.task_skipped(SOURCE)
+                    self.stats['skipped'] += 1
+                    self.log(f'SKIP node={node_id} path={rel} (lease perdido, resultado descartado)')
+                else:
+                    self.stats['failed'] += 1
+                    self.log(f'FAILED node={node_id} path={rel} error={error}')
+        finally:
+            conn.close()
+
+    # --- Heartbeat ----------------------------------------------------------
+
+    def _renew_all(self, conn):
+        for node_id, token in list(self.inflight.items()):
+            if not renew_lease(conn, node_id, token):
+                self.lost.add(node_id)
+
+    async def heartbeat(self, interval=None):
+        """Renueva los leases de todos los nodos en vuelo con una sola conexión"""
+        interval = interval or heartbeat_interval()
+        conn = None
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if not self.inflight:
+                    continue
+                try:
+                    if conn is None:
+                        conn = await self._in_thread(lambda: pymysql.connect(**DB_CONF))
+                    await self._in_thread(self._renew_all, conn)
+                except Exception:
+                    # Error transitorio de DB: se reintenta en el siguiente ciclo
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                    conn = None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # --- Ciclo principal ----------------------------------------------------
+
+    def _release_inflight(self):
+        """Devuelve a 'pending' los nodos en vuelo (interrupción)"""
+        if not self.inflight:
+            return 0
+        conn = pymysql.connect(**DB_CONF)
+        released = 0
+        try:
+            for node_id, token in list(self.inflight.items()):
+                released += complete_node(conn, node_id, token, 'pending', {'last_error': 'interrumpido'})
+        finally:
+            conn.close()
+        return released
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        # Un hilo por slot más productor y heartbeat
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency + 2, thread_name_prefix='ocr-slot')
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        beat = asyncio.create_task(self.heartbeat())
+        t0 = time.perf_counter()
+        try:
+            producer = asyncio.create_task(self.producer(queue))
+            await asyncio.gather(producer, *(self.slot(queue) for _ in range(self.concurrency)))
+        finally:
+            beat.cancel()
+            for proc in list(self.children):
+                if proc.returncode is None:
+                    proc.kill()
+            if self.inflight:
+                released = await self._in_thread(self._release_inflight)
+                self.log(f'{released} nodos en vuelo devueltos a pending')
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        seconds = time.perf_counter() - t0
+        self.stats['seconds'] = round(seconds, 1)
+        self.stats['pages_per_s'] = round(self.stats['pages'] / seconds, 3) if seconds else 0.0
+        return self.stats
+
+
+def run(process_one, concurrency, **kwargs):
+    """Ejecuta AsyncRunner hasta vaciar los pendientes (o --limit) y devuelve las estadísticas"""
+    runner = AsyncRunner(process_one, concurrency, **kwargs)
+    try:
+        return asyncio.run(runner.run())
+    except KeyboardInterrupt:
+        print('\nInterrumpido por el usuario')
+        return runner.stats
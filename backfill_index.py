@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Backfill paralelo y reanudable del texto OCR de MariaDB a OpenSearch.
+
+Hay muchos nodos 'done' que nunca se indexaron (el camino de Celery no
+indexaba). Este comando:
+
+  - divide el rango de node_id de los nodos 'done' en --workers tramos y
+    procesa cada uno en un proceso propio (conexión MariaDB y cliente
+    OpenSearch propios)
+  - dentro de cada tramo lee por keyset (node_id > último ORDER BY node_id
+    LIMIT --batch), sin OFFSET ni cursores abiertos, y envía cada lote con
+    _bulk (search_index.send_bulk: reintentos ante contrapresión), partido
+    además por tamaño (OCR_INDEX_BULK_MB) para no superar
+    http.max_content_length con textos largos
+  - marca el estado por nodo (indexed_at / index_error) y guarda tras cada
+    lote un checkpoint del tramo en ocr_state: si se interrumpe, volver a
+    ejecutar con los mismos argumentos continúa donde quedó cada tramo
+  - sube refresh_interval del índice durante la carga (--refresh-interval,
+    default 60s; -1 lo desactiva) y al terminar restaura el valor anterior
+    y refresca
+
+Por defecto solo toma nodos sin indexar o con OCR más nuevo que lo indexado;
+--all reindexa todos y --since 'AAAA-MM-DD HH:MM:SS' limita a los nodos con
+OCR terminado después (ocr_finished_at; modo incremental). updated_at no sirve:
+lo mueven también los heartbeats y la propia marca de indexado.
+
+Uso:
+    python backfill_index.py --workers 4
+    python backfill_index.py --workers 8 --all --refresh-interval -1
+    python backfill_index.py --since '2024-06-01 00:00:00'
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+import pymysql
+
+import search_index
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+
+def _filters(all_docs=False, since=None):
+    """Condiciones y parámetros comunes (alias p = pdf_metadata)"""
+    where = ["p.ocr_status='done'"]
+    params = []
+    if not all_docs:
+        where.append("(p.indexed_at IS NULL OR p.indexed_at < p.ocr_finished_at)")
+    if since:
+        where.append("p.ocr_finished_at >= %s")
+        params.append(since)
+    return where, params
+
+
+def id_range(conn, all_docs=False, since=None):
+    where, params = _filters(all_docs, since)
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT MIN(p.node_id) AS lo, MAX(p.node_id) AS hi, COUNT(*) AS cnt "
+                    f"FROM pdf_metadata p WHERE {' AND '.join(where)}", params)
+        return cur.fetchone()
+
+
+def make_slices(lo, hi, workers):
+    """Tramos [desde, hasta) de igual ancho; el último queda abierto (hasta=None)"""
+    width = max(1, (hi - lo + 1 + workers - 1) // workers)
+    slices = []
+    start = lo
+    for i in range(workers):
+        if start > hi:
+            break
+        end = start + width
+        slices.append({'slice': i, 'lo': start, 'hi': None if end > hi else end})
+        start = end
+    return slices
+
+
+def run_key(index, workers, all_docs, since):
+    """Identifica la ejecución: mismos argumentos = mismos checkpoints"""
+    raw = json.dumps([index, workers, bool(all_docs), since or ''])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def _state_name(key, i):
+    return f"backfill:{key}:{i}"
+
+
+def load_checkpoints(conn, key):
+    with conn.cursor() as cur:
+        cur.execute("SELECT name, value FROM ocr_state WHERE name LIKE %s", (f"backfill:{key}:%",))
+        rows = cur.fetchall()
+    conn.commit()
+    return {int(r['name'].rsplit(':', 1)[1]): json.loads(r['value']) for r in rows}
+
+
+def save_checkpoint(conn, key, state):
+    with conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO ocr_state (name, value) VALUES (%s, %s)
+               ON DUPLICATE KEY UPDATE value=VALUES(value), updated_at=NOW()""",
+            (_state_name(key, state['slice']), json.dumps(state))
+        )
+    conn.commit()
+
+
+def clear_checkpoints(conn, key):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM ocr_state WHERE name LIKE %s", (f"backfill:{key}:%",))
+    conn.commit()
+
+
+def backfill_slice(state, key, batch, all_docs=False, since=None):
+    """
+    Indexa un tramo por keyset desde state['last_id'] (proceso hijo).
+
+    Returns:
+        dict: el checkpoint final del tramo
+    """
+    conn = pymysql.connect(**DB_CONF)
+    client = search_index.get_client()
+    where, params = _filters(all_docs, since)
+    where.append("p.node_id >= %s")
+    if state['hi'] is not None:
+        where.append("p.node_id < %s")
+    sql = f"""
+        SELECT p.node_id, n.path, p.ocr_text, p.pages, p.ocr_profile, p.ocr_finished_at
+        FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+        WHERE {' AND '.join(where)} AND p.node_id > %s
+        ORDER BY p.node_id
+        LIMIT %s
+    """
+    try:
+        while not state['done']:
+            bounds = [state['lo']] + ([state['hi']] if state['hi'] is not None else [])
+            with conn.cursor() as cur:
+                cur.execute(sql, params + bounds + [state['last_id'], batch])
+                rows = cur.fetchall()
+            conn.commit()
+            if not rows:
+                state['done'] = True
+                save_checkpoint(conn, key, state)
+                break
+            for docs in search_index.batches((search_index.row_document(r) for r in rows), max_docs=batch):
+                ok, failed = search_index.send_bulk(docs, client)
+                search_index.mark_indexed(conn, ok)
+                search_index.mark_index_failed(conn, failed)
+                state['indexed'] += len(ok)
+                state['failed'] += len(failed)
+            state['last_id'] = rows[-1]['node_id']
+            save_checkpoint(conn, key, state)
+            print(f"  tramo {state['slice']}: node_id {state['last_id']}, "
+                  f"{state['indexed']} indexados, {state['failed']} fallidos", flush=True)
+    finally:
+        conn.close()
+    return state
+
+
+def set_refresh_interval(client, index, value):
+    """Cambia refresh_interval y devuelve el valor anterior (None = default del índice)"""
+    current = client.indices.get_settings(index=index, name='index.refresh_interval')
+    previous = (current.get(index, {}).get('settings', {}).get('index', {}) or {}).get('refresh_interval')
+    client.indices.put_settings(index=index, body={'index': {'refresh_interval': value}})
+    return previous
+
+
+def main():
+    p = argparse.ArgumentParser(description='Backfill paralelo y reanudable de MariaDB a OpenSearch')
+    p.add_argument('--workers', type=int, default=4, help='procesos en paralelo, un tramo de node_id cada uno (default: 4)')
+    p.add_argument('--batch', type=int, default=None, help='nodos por lote _bulk (default: OCR_INDEX_BULK_DOCS; los lotes se parten además por OCR_INDEX_BULK_MB)')
+    p.add_argument('--since', default=None, metavar='OCR_FINISHED_AT',
+                   help="solo nodos con ocr_finished_at >= 'AAAA-MM-DD HH:MM:SS' (incremental)")
+    p.add_argument('--all', dest='all_docs', action='store_true', help='reindexar también los ya indexados')
+    p.add_argument('--refresh-interval', default='60s',
+                   help='refresh_interval durante la carga (default: 60s; -1 desactiva el refresco)')
+    p.add_argument('--restart', action='store_true', help='descartar los checkpoints y empezar de cero')
+    args = p.parse_args()
+
+    if not search_index.enabled():
+        print('OPENSEARCH_URL no definido o opensearch-py no instalado (pip install opensearch-py)')
+        return
+    s = search_index.settings()
+    index = s['index']
+    batch = args.batch or s['bulk_docs']
+    key = run_key(index, args.workers, args.all_docs, args.since)
+
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        if args.restart:
+            clear_checkpoints(conn, key)
+        states = load_checkpoints(conn, key)
+        if states:
+            pending = [st for st in states.values() if not st['done']]
+            print(f"Reanudando backfill {key}: {len(pending)} de {len(states)} tramos pendientes")
+        else:
+            r = id_range(conn, args.all_docs, args.since)
+            if not r['cnt']:
+                print('No hay nodos para indexar.')
+                return
+            print(f"Backfill {key}: {r['cnt']} nodos, node_id {r['lo']}..{r['hi']} en {args.workers} tramos")
+            for sl in make_slices(r['lo'], r['hi'], args.workers):
+                states[sl['slice']] = dict(sl, last_id=sl['lo'] - 1, indexed=0, failed=0, done=False)
+                save_checkpoint(conn, key, states[sl['slice']])
+            pending = list(states.values())
+    finally:
+        conn.close()
+
+    client = search_index.get_client()
+    created = search_index.ensure_index(client, index)
+    if created:
+        print(f"Índice {index} creado")
+    previous = set_refresh_interval(client, index, args.refresh_interval)
+    t0 = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, len(pending))) as pool:
+            futures = [pool.submit(backfill_slice, st, key, batch, args.all_docs, args.since) for st in pending]
+            for fut in as_completed(futures):
+                st = fut.result()
+                states[st['slice']] = st
+                print(f"Tramo {st['slice']} terminado: {st['indexed']} indexados, {st['failed']} fallidos")
+    finally:
+        client.indices.put_settings(index=index, body={'index': {'refresh_interval': previous}})
+        client.indices.refresh(index=index)
+
+    seconds = time.perf_counter() - t0
+    indexed = sum(st['indexed'] for st in states.values())
+    failed = sum(st['failed'] for st in states.values())
+    print(f"Listo: {indexed} indexados, {failed} fallidos en {seconds:.1f}s "
+          f"({indexed / seconds if seconds else 0:.1f} docs/s)")
+    if failed:
+        print("Los fallidos quedan con index_error; reintentar con: python search_index.py --pending")
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        clear_checkpoints(conn, key)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
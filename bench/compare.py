@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compara dos resultados de bench/run_bench.py (base vs. candidato).
+
+Muestra por fase segundos y páginas/s con la variación porcentual, y avisa si
+los corpus, el motor o --jobs no coinciden (la comparación no sería válida).
+
+Uso:
+    python bench/compare.py bench/results/base.json bench/results/nuevo.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+
+def _delta(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(base, new):
+    lines = []
+    for key, label in (('engine', 'motor'), ('jobs', 'jobs')):
+        if base.get(key) != new.get(key):
+            lines.append(f"⚠ {label} distinto: {base.get(key)} vs {new.get(key)}")
+    if base['corpus'].get('fingerprint') != new['corpus'].get('fingerprint'):
+        lines.append("⚠ corpus distinto (huella): los números no son comparables")
+
+    lines.append(f"base:      {(base.get('commit') or '?')[:10]} {base.get('started_at', '')}")
+    lines.append(f"candidato: {(new.get('commit') or '?')[:10]} {new.get('started_at', '')}"
+                 f"{' (con cambios sin commit)' if new.get('dirty') else ''}")
+    lines.append(f"{'fase':10} {'seg base':>10} {'seg nuevo':>10} {'Δ':>8} {'pág/s base':>11} {'pág/s nuevo':>12} {'Δ':>8}")
+    for phase in base['phases']:
+        a, b = base['phases'][phase], new['phases'].get(phase)
+        if not b or 'skipped' in a or 'skipped' in b:
+            lines.append(f"{phase:10} (omitida)")
+            continue
+        lines.append(f"{phase:10} {a['seconds']:>10.2f} {b['seconds']:>10.2f} {_delta(a['seconds'], b['seconds']):>8} "
+                     f"{a['pages_per_s'] or 0:>11.2f} {b['pages_per_s'] or 0:>12.2f} "
+                     f"{_delta(a['pages_per_s'], b['pages_per_s']):>8}")
+    return '\n'.join(lines)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Comparar dos resultados de benchmark')
+    p.add_argument('base', help='JSON de referencia')
+    p.add_argument('new', help='JSON a comparar')
+    args = p.parse_args()
+    base = json.loads(Path(args.base).read_text(encoding='utf-8'))
+    new = json.loads(Path(args.new).read_text(encoding='utf-8'))
+    print(compare(base, new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Corpus sintético y determinista para los benchmarks (ver bench/run_bench.py).
+
+Genera con pikepdf + Pillow un árbol con la forma de transparencia/
+(<año>/<organismo>/<sección>/<documento>.pdf) con los casos que importan al
+pipeline:
+
+  text    PDFs con capa de texto (Helvetica), 1-5 páginas
+  scan    escaneos solo imagen en escala de grises a 150, 200 y 300 DPI
+  color   escaneos RGB con encabezado en color
+  blank   escaneos con hojas en blanco intercaladas (y uno totalmente en blanco)
+  large   escaneos grandes de muchas páginas
+  dup     copias byte a byte de otros documentos en otra carpeta (caché)
+
+La misma semilla y escala producen los mismos bytes (IDs de PDF deterministas
+y mtime fijo), y corpus.json guarda una huella del conjunto para comparar
+resultados solo entre corridas sobre el mismo corpus.
+
+Uso:
+    python bench/corpus.py --out bench_data --scale 2
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+from pathlib import Path
+
+import pikepdf
+from pikepdf import Dictionary, Name
+from PIL import Image, ImageDraw, ImageFont
+
+CORPUS_VERSION = 1
+A4_PT = (595, 842)
+FIXED_MTIME = 1700000000   # 2023-11-14, para que scan_transparencia vea siempre lo mismo
+
+# Documentos por tipo con scale=1 (las páginas de 'large' también escalan)
+KIND_COUNTS = {'text': 20, 'scan': 24, 'color': 4, 'blank': 4, 'large': 2, 'dup': 6}
+SCAN_DPIS = (150, 200, 300)
+LARGE_PAGES = 40
+
+YEARS = ('2021', '2022', '2023')
+AGENCIES = ('Municipalidad', 'Gobierno_Regional', 'Servicio_Salud', 'Universidad')
+SECTIONS = ('Decretos', 'Resoluciones', 'Contratos', 'Actas')
+WORDS = ('decreto', 'resolucion', 'municipal', 'contrato', 'licitacion', 'presupuesto', 'articulo',
+         'alcaldia', 'concejo', 'transparencia', 'servicio', 'publico', 'region', 'monto', 'pesos',
+         'proveedor', 'fecha', 'numero', 'sesion', 'acuerdo', 'anexo', 'informe', 'obras', 'salud',
+         'educacion', 'personal', 'honorarios', 'adjudicacion', 'vistos', 'considerando')
+
+
+def _sentence(rng, n=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def _font(size):
+    """Fuente escalable de Pillow si está disponible (Pillow >= 10.1), si no la bitmap"""
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def _text_page(pdf, rng, lines=40):
+    page = pdf.add_blank_page(page_size=A4_PT)
+    font = pdf.make_indirect(Dictionary(Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica))
+    page.Resources = Dictionary(Font=Dictionary(F1=font))
+    ops = ['BT', '/F1 11 Tf', '14 TL', '60 780 Td']
+    for _ in range(lines):
+        ops.append(f"({_sentence(rng, 10)}) Tj T*")
+    ops.append('ET')
+    page.Contents = pdf.make_stream('\n'.join(ops).encode('ascii'))
+
+
+def _scan_image(rng, dpi, color=False, blank=False):
+    """Página A4 rasterizada a dpi como JPEG (bytes, ancho, alto, modo)"""
+    w, h = A4_PT[0] * dpi // 72, A4_PT[1] * dpi // 72
+    mode = 'RGB' if color else 'L'
+    img = Image.new(mode, (w, h), 'white' if color else 255)
+    draw = ImageDraw.Draw(img)
+    if not blank:
+        margin = dpi * 3 // 4
+        line_h = dpi // 5
+        font = _font(max(10, dpi // 8))
+        if color:
+            draw.rectangle([margin, margin, w - margin, margin + 2 * line_h], fill=(30, 80, 160))
+            draw.text((margin + line_h // 2, margin + line_h // 2), 'REPUBLICA DE CHILE', fill='white', font=font)
+        y = margin + 3 * line_h
+        ink = (20, 20, 20) if color else 20
+        while y < h - margin - line_h:
+            draw.text((margin, y), _sentence(rng, 9), fill=ink, font=font)
+            y += line_h
+    else:
+        # Hoja "en blanco" de escáner: algo de polvo, bajo el umbral de tinta
+        for _ in range(20):
+            x, y = rng.randrange(w), rng.randrange(h)
+            draw.point((x, y), fill=(90, 90, 90) if color else 90)
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=75)
+    return buf.getvalue(), w, h, mode
+
+
+def _image_page(pdf, rng, dpi, color=False, blank=False):
+    data, w, h, mode = _scan_image(rng, dpi, color, blank)
+    image = pikepdf.Stream(pdf, data)
+    image.Type = Name.XObject
+    image.Subtype = Name.Image
+    image.Width, image.Height = w, h
+    image.ColorSpace = Name.DeviceRGB if mode == 'RGB' else Name.DeviceGray
+    image.BitsPerComponent = 8
+    image.Filter = Name.DCTDecode
+    page = pdf.add_blank_page(page_size=A4_PT)
+    page.Resources = Dictionary(XObject=Dictionary(Im0=image))
+    page.Contents = pdf.make_stream(f"q {A4_PT[0]} 0 0 {A4_PT[1]} 0 0 cm /Im0 Do Q".encode('ascii'))
+
+
+def _save(pdf, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pdf.save(path, deterministic_id=True)
+    os.utime(path, (FIXED_MTIME, FIXED_MTIME))
+
+
+def _rel_path(rng, kind, i):
+    return Path(rng.choice(YEARS), rng.choice(AGENCIES), rng.choice(SECTIONS), f"{kind}_{i:04d}.pdf")
+
+
+def _sha256(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def generate(out_dir, seed=42, scale=1):
+    """
+    Genera el corpus en out_dir/transparencia (borra el anterior).
+
+    Returns:
+        dict: manifiesto {'version', 'seed', 'scale', 'files', 'pages', 'bytes',
+              'kinds': {tipo: {'files', 'pages'}}, 'fingerprint', 'documents': [...]}
+    """
+    out_dir = Path(out_dir)
+    root = out_dir / 'transparencia'
+    if root.exists():
+        shutil.rmtree(root)
+    rng = random.Random(seed)
+    docs = []
+
+    def add(kind, rel, pages, **extra):
+        docs.append({'path': rel.as_posix(), 'kind': kind, 'pages': pages, **extra})
+
+    for i in range(KIND_COUNTS['text'] * scale):
+        rel = _rel_path(rng, 'text', i)
+        pages = rng.randint(1, 5)
+        with pikepdf.new() as pdf:
+            for _ in range(pages):
+                _text_page(pdf, rng)
+            _save(pdf, root / rel)
+        add('text', rel, pages)
+
+    for i in range(KIND_COUNTS['scan'] * scale):
+        rel = _rel_path(rng, 'scan', i)
+        dpi = SCAN_DPIS[i % len(SCAN_DPIS)]
+        pages = rng.randint(1, 4)
+        with pikepdf.new() as pdf:
+            for _ in range(pages):
+                _image_page(pdf, rng, dpi)
+            _save(pdf, root / rel)
+        add('scan', rel, pages, dpi=dpi)
+
+    for i in range(KIND_COUNTS['color'] * scale):
+        rel = _rel_path(rng, 'color', i)
+        pages = rng.randint(1, 3)
+        with pikepdf.new() as pdf:
+            for _ in range(pages):
+                _image_page(pdf, rng, 200, color=True)
+            _save(pdf, root / rel)
+        add('color', rel, pages, dpi=200)
+
+    for i in range(KIND_COUNTS['blank'] * scale):
+        rel = _rel_path(rng, 'blank', i)
+        # El primero es un documento totalmente en blanco; el resto alterna hojas vacías
+        layout = [True] * 3 if i == 0 else [p % 2 == 1 for p in range(rng.randint(3, 6))]
+        with pikepdf.new() as pdf:
+            for is_blank in layout:
+                _image_page(pdf, rng, 200, blank=is_blank)
+            _save(pdf, root / rel)
+        add('blank', rel, len(layout), dpi=200, blank_pages=sum(layout))
+
+    for i in range(KIND_COUNTS['large'] * scale):
+        rel = _rel_path(rng, 'large', i)
+        pages = LARGE_PAGES * scale
+        with pikepdf.new() as pdf:
+            for _ in range(pages):
+                _image_page(pdf, rng, 200)
+            _save(pdf, root / rel)
+        add('large', rel, pages, dpi=200)
+
+    originals = [d for d in docs if d['kind'] in ('text', 'scan')]
+    for i in range(min(KIND_COUNTS['dup'] * scale, len(originals))):
+        src = originals[rng.randrange(len(originals))]
+        rel = Path('duplicados', f"dup_{i:04d}_{Path(src['path']).name}")
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(root / src['path'], root / rel)
+        os.utime(root / rel, (FIXED_MTIME, FIXED_MTIME))
+        add('dup', rel, src['pages'], source=src['path'])
+
+    fp = hashlib.sha256()
+    kinds = {}
+    total_bytes = 0
+    for d in sorted(docs, key=lambda d: d['path']):
+        d['sha256'] = _sha256(root / d['path'])
+        d['bytes'] = (root / d['path']).stat().st_size
+        total_bytes += d['bytes']
+        fp.update(f"{d['path']}\0{d['sha256']}\n".encode('utf-8'))
+        k = kinds.setdefault(d['kind'], {'files': 0, 'pages': 0})
+        k['files'] += 1
+        k['pages'] += d['pages']
+
+    manifest = {
+        'version': CORPUS_VERSION,
+        'seed': seed,
+        'scale': scale,
+        'files': len(docs),
+        'pages': sum(d['pages'] for d in docs),
+        'bytes': total_bytes,
+        'kinds': kinds,
+        'fingerprint': fp.hexdigest(),
+        'documents': docs,
+    }
+    (out_dir / 'corpus.json').write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    return manifest
+
+
+def ensure_corpus(out_dir, seed=42, scale=1, regen=False):
+    """Reutiliza el corpus existente si coincide versión/semilla/escala; si no, lo genera"""
+    manifest_path = Path(out_dir) / 'corpus.json'
+    if not regen and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+        if (manifest.get('version'), manifest.get('seed'), manifest.get('scale')) == (CORPUS_VERSION, seed, scale) \
+                and all((Path(out_dir) / 'transparencia' / d['path']).exists() for d in manifest['documents']):
+            return manifest
+    return generate(out_dir, seed, scale)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Generar el corpus sintético de benchmarks')
+    p.add_argument('--out', default='bench_data', help='directorio de trabajo (se crea <out>/transparencia)')
+    p.add_argument('--seed', type=int, default=42, help='semilla (default: 42)')
+    p.add_argument('--scale', type=int, default=1, help='multiplicador de documentos y páginas (default: 1)')
+    args = p.parse_args()
+    m = generate(args.out, args.seed, args.scale)
+    print(f"Corpus: {m['files']} PDFs, {m['pages']} páginas, {m['bytes'] / 1e6:.1f} MB")
+    for kind, k in sorted(m['kinds'].items()):
+        print(f"  {kind:6} {k['files']:5} PDFs {k['pages']:6} páginas")
+    print(f"Huella: {m['fingerprint']}")
+
+
+if __name__ == '__main__':
+    main()
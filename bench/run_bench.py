@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark de extremo a extremo sobre el corpus sintético (bench/corpus.py).
+
+Mide por separado:
+  scan       scan_transparencia.scan() sobre el corpus, con la base vacía
+  rescan     segunda pasada (archivos sin cambios: solo checksums)
+  enqueue    enqueue_pdfs.enqueue_pending() contra el broker de benchmark
+             (la cola se vacía al terminar; sin broker la fase se omite)
+  process    tasks.process_pdf de todos los pendientes, ejecutado en este
+             host con --jobs procesos (sin workers ni broker)
+  reprocess  todo vuelve a 'pending' y se procesa otra vez (caché/incremental)
+
+Con --engine stub el OCR se reemplaza por una copia del PDF de entrada: mide
+la infraestructura (MariaDB, lease, caché, preparación, publicación) sin
+Tesseract. Con --engine ocrmypdf se usa el motor real (OCR_ENGINE del
+entorno). El resultado se escribe como JSON para comparar entre commits
+(ver bench/compare.py).
+
+El benchmark usa su propia base (BENCH_DB_NAME, default: ocr_bench), que se
+vacía al empezar, y su propio broker (BENCH_REDIS_URL, default: la base 15
+del Redis local). Caché de OCR, scratch y métricas quedan bajo --workdir.
+
+Uso:
+    python bench/run_bench.py --engine stub
+    python bench/run_bench.py --engine ocrmypdf --scale 2 --jobs 4 --output bench/results/base.json
+    python bench/run_bench.py --phases scan,rescan
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import ensure_corpus
+
+PHASES = ('scan', 'rescan', 'enqueue', 'process', 'reprocess')
+
+
+def configure_env(workdir):
+    """
+    Apunta los módulos del repo a la base, broker y directorios del benchmark.
+
+    Debe llamarse antes de importarlos: cada script lee DB_CONF y REDIS_URL al
+    importarse.
+    """
+    db_name = os.environ.get('BENCH_DB_NAME', 'ocr_bench')
+    if 'bench' not in db_name:
+        raise SystemExit(f"BENCH_DB_NAME={db_name!r}: el nombre debe contener 'bench' (la base se vacía)")
+    os.environ['DB_NAME'] = db_name
+    os.environ['REDIS_URL'] = os.environ.get('BENCH_REDIS_URL', 'redis://127.0.0.1:6379/15')
+    os.environ['OCR_CACHE_DIR'] = str(Path(workdir) / 'cache')
+    os.environ['OCR_SCRATCH_DIR'] = str(Path(workdir) / 'scratch')
+    os.environ.pop('OCR_METRICS_DIR', None)
+    os.environ.pop('OCR_METRICS_PORT', None)
+
+
+def reset_database():
+    """Crea la base del benchmark si falta, aplica el esquema y vacía todas las tablas"""
+    import pymysql
+    import schema_sql
+
+    conf = {
+        'host': os.environ.get('DB_HOST', '127.0.0.1'),
+        'port': int(os.environ.get('DB_PORT', 3306)),
+        'user': os.environ.get('DB_USER', 'root'),
+        'password': os.environ.get('DB_PASS', ''),
+    }
+    db_name = os.environ['DB_NAME']
+    conn = pymysql.connect(**conf, autocommit=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}` DEFAULT CHARACTER SET utf8mb4 "
+                        "COLLATE utf8mb4_general_ci")
+            cur.execute(f"USE `{db_name}`")
+            schema_sql.apply_schema(cur, REPO / 'mariadb_schema.sql')
+            cur.execute("SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'")
+            tables = [r[0] for r in cur.fetchall()]
+            cur.execute("SET FOREIGN_KEY_CHECKS=0")
+            for t in tables:
+                cur.execute(f"TRUNCATE TABLE `{t}`")
+            cur.execute("SET FOREIGN_KEY_CHECKS=1")
+    finally:
+        conn.close()
+
+
+# --- Motor de OCR simulado ----------------------------------------------------
+
+def _stub_ocrmypdf(cmd, timeout=None):
+    """Reemplazo de ocr_pipeline.run_ocrmypdf: copia la entrada a la salida"""
+    input_pdf, target = cmd[-2], cmd[-1]
+    if target != '-':
+        shutil.copyfile(input_pdf, target)
+    if '--sidecar' in cmd:
+        Path(cmd[cmd.index('--sidecar') + 1]).write_text('', encoding='utf-8')
+    delay = float(os.environ.get('BENCH_STUB_PAGE_MS', 0))
+    if delay:
+        import pikepdf
+        with pikepdf.open(input_pdf) as pdf:
+            time.sleep(len(pdf.pages) * delay / 1000)
+    return subprocess.CompletedProcess(cmd, 0, '', '')
+
+
+def _stub_inprocess(options, input_pdf, output_pdf, timeout=None):
+    _stub_ocrmypdf([*options, str(input_pdf), str(output_pdf)])
+
+
+def install_engine(engine):
+    """Instala el motor simulado en ocr_pipeline (en este proceso)"""
+    if engine != 'stub':
+        return
+    import ocr_pipeline
+    ocr_pipeline.run_ocrmypdf = _stub_ocrmypdf
+    ocr_pipeline.run_ocrmypdf_inprocess = _stub_inprocess
+
+
+# --- Fases --------------------------------------------------------------------
+
+def _rates(seconds, files, pages):
+    return {
+        'seconds': round(seconds, 3),
+        'files': files,
+        'pages': pages,
+        'files_per_s': round(files / seconds, 3) if seconds else None,
+        'pages_per_s': round(pages / seconds, 3) if seconds else None,
+    }
+
+
+def bench_scan(root, manifest):
+    from scan_transparencia import scan
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        scan(root)
+        seconds = time.perf_counter() - t0
+    return _rates(seconds, manifest['files'], manifest['pages'])
+
+
+def bench_enqueue(root, manifest):
+    from tasks import app
+    from enqueue_pdfs import enqueue_pending
+
+    try:
+        with app.connection_for_write() as c:
+            c.ensure_connection(max_retries=1)
+    except Exception as e:
+        return {'skipped': f"broker no disponible ({os.environ['REDIS_URL']}): {e}"}
+    app.control.purge()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            enqueue_pending(root)
+            seconds = time.perf_counter() - t0
+    finally:
+        app.control.purge()
+    return _rates(seconds, manifest['files'], manifest['pages'])
+
+
+def _child_init(engine):
+    install_engine(engine)
+
+
+def _process_one(args):
+    """Ejecuta process_pdf localmente (apply: sin broker) y devuelve el resultado"""
+    node_id, pdf_path = args
+    from tasks import process_pdf
+
+    t0 = time.perf_counter()
+    try:
+        result = process_pdf.apply(args=(node_id, pdf_path)).get(propagate=False)
+    except Exception as e:
+        result = {'status': 'failed', 'error': str(e)}
+    if not isinstance(result, dict):
+        result = {'status': 'failed', 'error': repr(result)}
+    result['wall_ms'] = (time.perf_counter() - t0) * 1000
+    return result
+
+
+def bench_process(root, engine, jobs):
+    import pymysql
+    from tasks import DB_CONF
+    from scheduling import pending_query
+    from timings import STAGES, _percentile
+
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(*pending_query('path', None))
+            rows = cur.fetchall()
+            cur.execute("SELECT COALESCE(SUM(pages), 0) as pages FROM pdf_metadata WHERE ocr_status='pending'")
+            pages = int(cur.fetchone()['pages'])
+    finally:
+        conn.close()
+    work = [(r['node_id'], str(Path(root) / r['path'])) for r in rows]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        if jobs > 1:
+            with ProcessPoolExecutor(jobs, initializer=_child_init, initargs=(engine,)) as pool:
+                results = list(pool.map(_process_one, work))
+        else:
+            results = [_process_one(w) for w in work]
+        seconds = time.perf_counter() - t0
+
+    out = _rates(seconds, len(work), pages)
+    statuses, modes = {}, {}
+    stage_ms = {s: 0 for s in STAGES}
+    for r in results:
+        statuses[r['status']] = statuses.get(r['status'], 0) + 1
+        if r['status'] == 'done':
+            modes[r['mode']] = modes.get(r['mode'], 0) + 1
+            for s, ms in (r.get('timings_ms') or {}).items():
+                stage_ms[s] = stage_ms.get(s, 0) + ms
+    wall = sorted(r['wall_ms'] for r in results)
+    out.update({
+        'jobs': jobs,
+        'status': statuses,
+        'modes': modes,
+        'doc_ms': {f"p{q}": round(_percentile(wall, q / 100), 1) if wall else None for q in (50, 95, 99)},
+        'stage_ms_total': stage_ms,
+        'errors': sorted({r.get('error', '')[:200] for r in results if r['status'] != 'done'})[:10],
+    })
+    return out
+
+
+def reset_pending():
+    import pymysql
+    from tasks import DB_CONF
+
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE pdf_metadata SET ocr_status='pending', lease_owner=NULL, lease_expires_at=NULL")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    workdir = Path(args.workdir).resolve()
+    configure_env(workdir)
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        raise SystemExit(f"Fases desconocidas: {', '.join(sorted(unknown))}")
+
+    print(f"Corpus en {workdir} (semilla {args.seed}, escala {args.scale})...")
+    manifest = ensure_corpus(workdir, args.seed, args.scale, args.regen)
+    root = workdir / 'transparencia'
+    for d in ('cache', 'scratch', 'transparencia_ocr'):
+        shutil.rmtree(workdir / d, ignore_errors=True)
+    reset_database()
+    install_engine(args.engine)
+
+    results = {}
+    for phase in phases:
+        print(f"  {phase}...", end=' ', flush=True)
+        if phase == 'scan':
+            results[phase] = bench_scan(root, manifest)
+        elif phase == 'rescan':
+            results[phase] = bench_scan(root, manifest)
+        elif phase == 'enqueue':
+            results[phase] = bench_enqueue(root, manifest)
+        elif phase == 'process':
+            results[phase] = bench_process(root, args.engine, args.jobs)
+        elif phase == 'reprocess':
+            reset_pending()
+            results[phase] = bench_process(root, args.engine, args.jobs)
+        r = results[phase]
+        print(r['skipped'] if 'skipped' in r else f"{r['seconds']:.2f}s, {r['pages_per_s']} páginas/s")
+
+    return {
+        'bench_version': 1,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'engine': args.engine if args.engine == 'stub' else os.environ.get('OCR_ENGINE', 'tesseract'),
+        'jobs': args.jobs,
+        'corpus': {k: v for k, v in manifest.items() if k != 'documents'},
+        'phases': results,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description='Benchmark de scan, encolado y OCR sobre un corpus sintético')
+    p.add_argument('--workdir', default=str(REPO / 'bench_data'), help='directorio del corpus y salidas')
+    p.add_argument('--seed', type=int, default=42, help='semilla del corpus (default: 42)')
+    p.add_argument('--scale', type=int, default=1, help='escala del corpus (default: 1)')
+    p.add_argument('--regen', action='store_true', help='regenerar el corpus aunque exista')
+    p.add_argument('--engine', choices=['stub', 'ocrmypdf'], default='stub',
+                   help='stub: sin OCR, solo infraestructura; ocrmypdf: OCR real (default: stub)')
+    p.add_argument('--jobs', type=int, default=1, help='procesos para la fase process (default: 1)')
+    p.add_argument('--phases', default=','.join(PHASES), help=f"fases separadas por coma (default: {','.join(PHASES)})")
+    p.add_argument('--output', default=None, help='archivo JSON de resultados (default: stdout)')
+    args = p.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+        print(f"Resultados en {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
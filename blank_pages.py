@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Detección de páginas en blanco o casi en blanco antes del OCR.
+
+Los documentos escaneados traen hojas separadoras y reversos vacíos que igual
+pasan por unpaper + deskew + Tesseract. Se renderiza el documento a baja
+resolución con pdftoppm (poppler, ya requerido por pdftotext) y se mide la
+tinta de cada página, descartando los márgenes donde suelen aparecer sombras
+del escáner. Una página es blanca solo si la cobertura total queda bajo el
+umbral y además ninguna fila concentra tinta: una línea de texto pequeño
+ocupa poca superficie pero llena una fila, el polvo del escáner no. Las
+páginas que ya tienen capa de texto nunca se consideran blancas. Las blancas
+se excluyen del OCR con `--pages` de ocrmypdf, pero se conservan en el PDF de
+salida.
+
+Configuración por variables de entorno:
+  OCR_BLANK_DETECT     0 para desactivar (default: 1)
+  OCR_BLANK_INK        fracción máxima de píxeles con tinta (default: 0.002)
+  OCR_BLANK_DPI        resolución del render de control (default: 50, mínimo 50:
+                       por debajo el texto pequeño se pierde en el render)
+"""
+import os
+import subprocess
+from pathlib import Path
+
+import pikepdf
+from PIL import Image
+
+INK_LEVEL = 160     # gris por debajo del cual un píxel se considera tinta
+MARGIN = 0.05       # fracción de cada borde que se ignora
+ROW_INK = 0.03      # fracción de una fila con tinta a partir de la cual hay texto
+MIN_DPI = 50
+
+
+def blank_settings():
+    """Política vigente; forma parte de la firma de opciones de la caché"""
+    return {
+        'enabled': os.environ.get('OCR_BLANK_DETECT', '1') != '0',
+        'ink': float(os.environ.get('OCR_BLANK_INK', 0.002)),
+        'row_ink': ROW_INK,
+        'dpi': max(MIN_DPI, int(os.environ.get('OCR_BLANK_DPI', MIN_DPI))),
+    }
+
+
+def ink_stats(image_path):
+    """
+    Tinta en la zona útil de la página.
+
+    Returns:
+        tuple: (fracción de píxeles con tinta, fracción de tinta de la fila más cargada)
+    """
+    with Image.open(image_path) as img:
+        img = img.convert('L')
+        w, h = img.size
+        dx, dy = int(w * MARGIN), int(h * MARGIN)
+        if w - 2 * dx > 0 and h - 2 * dy > 0:
+            img = img.crop((dx, dy, w - dx, h - dy))
+        hist = img.histogram()
+        # Máscara de tinta promediada por fila (BOX a 1 px de ancho)
+        mask = img.point(lambda p: 255 if p < INK_LEVEL else 0)
+        rows = mask.resize((1, mask.size[1]), Image.BOX).getdata()
+    total = sum(hist)
+    coverage = sum(hist[:INK_LEVEL]) / total if total else 0.0
+    return coverage, max(rows, default=0) / 255
+
+
+def has_text_layer(page):
+    """True si la página (pikepdf) dibuja texto: capa de OCR previa o texto nativo"""
+    try:
+        return bool(pikepdf.parse_content_stream(page, "Tj TJ ' \""))
+    except Exception:
+        return False
+
+
+def _text_pages(pdf_path):
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            return {i for i, page in enumerate(pdf.pages, start=1) if has_text_layer(page)}
+    except Exception:
+        return set()
+
+
+def detect_blank_pages(pdf_path: Path, workdir: Path, settings=None):
+    """
+    Páginas (1-based) sin contenido apreciable ni capa de texto.
+
+    Devuelve None si la detección está desactivada o pdftoppm falla, en cuyo
+    caso se procesan todas las páginas.
+    """
+    settings = settings or blank_settings()
+    if not settings['enabled']:
+        return None
+    render_dir = Path(workdir) / 'blank_check'
+    render_dir.mkdir(exist_ok=True)
+    try:
+        subprocess.run(
+            ['pdftoppm', '-r', str(settings['dpi']), '-gray', str(pdf_path), str(render_dir / 'p')],
+            check=True, capture_output=True, timeout=120
+        )
+    except Exception:
+        return None
+    # pdftoppm numera p-1.pgm, p-01.pgm... según la cantidad de páginas
+    renders = sorted(render_dir.glob('p-*.pgm'), key=lambda p: int(p.stem.split('-')[-1]))
+    blank = []
+    for p in renders:
+        coverage, row = ink_stats(p)
+        if coverage < settings['ink'] and row < settings['row_ink']:
+            blank.append(int(p.stem.split('-')[-1]))
+        p.unlink(missing_ok=True)
+    if blank:
+        with_text = _text_pages(pdf_path)
+        blank = [page for page in blank if page not in with_text]
+    return blank
+
+
+def pages_arg(pages):
+    """Lista de páginas 1-based como rango compacto para --pages ('1,3,5-9')"""
+    ranges = []
+    for page in sorted(pages):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ','.join(f"{a}-{b}" if a != b else str(a) for a, b in ranges)
+
+
+def save_blank_pages(conn, node_id, blank, total_pages, first_page=1):
+    """
+    Marca las páginas en blanco en pdf_pages y actualiza el conteo del documento.
+
+    first_page permite registrar solo un tramo (OCR incremental): las páginas
+    anteriores conservan su marca.
+    """
+    if blank is None:
+        return
+    blank_set = {first_page + p - 1 for p in blank}
+    rows = [(node_id, page, 1 if page in blank_set else 0)
+            for page in range(first_page, first_page + total_pages)]
+    with conn.cursor() as cur:
+        cur.executemany(
+            """INSERT INTO pdf_pages (node_id, page_no, is_blank) VALUES (%s,%s,%s)
+               ON DUPLICATE KEY UPDATE is_blank=VALUES(is_blank)""",
+            rows
+        )
+        cur.execute(
+            """UPDATE pdf_metadata SET blank_pages=(
+                   SELECT COALESCE(SUM(is_blank), 0) FROM pdf_pages WHERE node_id=%s)
+               WHERE node_id=%s""",
+            (node_id, node_id)
+        )
+    conn.commit()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Calibración empírica de capacidad: cuántos slots de OCR y cuántos --jobs de
+ocrmypdf rinden más en este host.
+
+check_system.py estimaba 0.5 GB por worker y "cores menos uno". La calibración
+toma una muestra de documentos reales pendientes y la procesa con ocrmypdf a
+concurrencia creciente (1, 2, 4... slots, repartiendo los cores utilizables
+entre ellos con el modelo de cpu_budget.py). Por cada nivel mide:
+
+  - páginas/s de la muestra completa
+  - pico de RSS por slot (ocrmypdf + Tesseract + Ghostscript, vía psutil)
+  - lectura/escritura de disco (MB/s, contadores del sistema)
+
+Se recomienda el nivel con más páginas/s que además cabe en la RAM disponible,
+y se guarda en un perfil JSON (OCR_CAPACITY_PROFILE, default:
+capacity_profile.json junto a este archivo) que start_workers.py carga con
+--from-profile.
+
+La calibración no toca la base más que para leer la muestra: el OCR se hace
+en OCR_SCRATCH_DIR, sin caché ni publicación.
+
+Uso:
+    python check_system.py --calibrate --root /ruta/a/transparencia
+    python start_workers.py --from-profile
+"""
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+import pymysql
+
+from cpu_budget import compute_budget, usable_cores
+from ocr_pipeline import ocrmypdf_options, scratch_root
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+PROFILE_VERSION = 1
+RSS_POLL_S = 0.25
+RAM_RESERVE_GB = 2.0        # mismo margen que check_system.recommend_workers
+# Un nivel con menos de este porcentaje del mejor resultado detiene la escalada
+STOP_BELOW = 0.85
+
+
+def profile_path():
+    return Path(os.environ.get('OCR_CAPACITY_PROFILE') or Path(__file__).with_name('capacity_profile.json'))
+
+
+def load_profile(path=None):
+    """Perfil guardado por calibrate(), o None si no existe"""
+    path = Path(path) if path else profile_path()
+    if not path.exists():
+        return None
+    profile = json.loads(path.read_text(encoding='utf-8'))
+    if profile.get('version') != PROFILE_VERSION:
+        return None
+    return profile
+
+
+def save_profile(profile, path=None):
+    path = Path(path) if path else profile_path()
+    path.write_text(json.dumps(profile, indent=2, ensure_ascii=False), encoding='utf-8')
+    return path
+
+
+def sample_documents(conn, root, size, seed=None):
+    """
+    Muestra de PDFs reales: pendientes si hay suficientes, completada con
+    cualquier otro documento con páginas.
+    """
+    rng_seed = seed if seed is not None else random.randrange(1 << 30)
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT p.node_id, n.path, p.pages FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+               WHERE p.pages > 0 ORDER BY p.ocr_status = 'pending' DESC, RAND(%s) LIMIT %s""",
+            (rng_seed, size * 2)
+        )
+        rows = cur.fetchall()
+    docs = []
+    for r in rows:
+        path = Path(root) / r['path']
+        if path.exists():
+            docs.append({'node_id': r['node_id'], 'path': path, 'pages': r['pages'], 'bytes': path.stat().st_size})
+        if len(docs) >= size:
+            break
+    return docs
+
+
+def slot_levels(cores, max_slots=None, max_docs=None):
+    """1, 2, 4... hasta los cores utilizables (incluidos), acotado por max_slots y la muestra"""
+    top = min(cores, max_slots or cores, max_docs or cores)
+    levels = []
+    n = 1
+    while n < top:
+        levels.append(n)
+        n *= 2
+    levels.append(top)
+    return levels
+
+
+def _tree_rss(proc):
+    """RSS del proceso y sus descendientes (bytes)"""
+    try:
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return 0
+    total = 0
+    for p in procs:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def _run_ocr(doc, options, jobs, omp, workdir, timeout):
+    """ocrmypdf de un documento; devuelve (ok, pico de RSS del árbol de procesos)"""
+    env = dict(os.environ, OMP_THREAD_LIMIT=str(omp))
+    out = Path(workdir) / f"{doc['node_id']}.pdf"
+    cmd = ['ocrmypdf', *options, '--jobs', str(jobs), str(doc['path']), str(out)]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    peak = 0
+    deadline = time.monotonic() + timeout
+    ps = psutil.Process(proc.pid)
+    while proc.poll() is None:
+        peak = max(peak, _tree_rss(ps))
+        if time.monotonic() > deadline:
+            proc.kill()
+            proc.wait()
+            return False, peak
+        time.sleep(RSS_POLL_S)
+    out.unlink(missing_ok=True)
+    return proc.returncode == 0, peak
+
+
+def run_level(docs, slots, jobs, omp, options, timeout):
+    """Procesa toda la muestra con `slots` procesos simultáneos"""
+    pending = list(docs)
+    lock = threading.Lock()
+    peaks = []
+    failed = []
+    workdir = Path(tempfile.mkdtemp(prefix='calibrate-', dir=scratch_root()))
+
+    def slot():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                doc = pending.pop(0)
+            ok, peak = _run_ocr(doc, options, jobs, omp, workdir, timeout)
+            with lock:
+                peaks.append(peak)
+                if not ok:
+                    failed.append(doc['node_id'])
+
+    io0 = psutil.disk_io_counters()
+    psutil.cpu_percent(None)
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=slot, daemon=True) for _ in range(slots)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - t0
+    cpu = psutil.cpu_percent(None)
+    io1 = psutil.disk_io_counters()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    pages = sum(d['pages'] for d in docs if d['node_id'] not in failed)
+    level = {
+        'slots': slots,
+        'jobs_per_slot': jobs,
+        'omp_thread_limit': omp,
+        'seconds': round(seconds, 2),
+        'docs': len(docs) - len(failed),
+        'failed': len(failed),
+        'pages': pages,
+        'pages_per_s': round(pages / seconds, 3) if seconds else 0.0,
+        'peak_rss_mb': round(max(peaks, default=0) / 2**20, 1),
+        'cpu_percent': cpu,
+    }
+    if io0 and io1:
+        level['disk_read_mb_s'] = round((io1.read_bytes - io0.read_bytes) / 2**20 / seconds, 2)
+        level['disk_write_mb_s'] = round((io1.write_bytes - io0.write_bytes) / 2**20 / seconds, 2)
+    return level
+
+
+def calibrate(root, sample=16, max_slots=None, total_cores=None, reserve=1, lang='spa', profile='archive',
+              seed=None, log=print):
+    """
+    Mide páginas/s, RSS y disco a concurrencia creciente y arma el perfil de capacidad.
+
+    Returns:
+        dict: perfil {'version', 'host', 'created_at', 'cores', 'sample', 'levels': [...],
+              'recommended': {'workers', 'concurrency', 'jobs_per_slot', 'omp_thread_limit',
+              'pages_per_s', 'peak_rss_mb', 'limited_by'}}
+    """
+    if psutil is None:
+        raise RuntimeError('La calibración requiere psutil (pip install psutil)')
+    if not shutil.which('ocrmypdf'):
+        raise RuntimeError('ocrmypdf no está en PATH')
+
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        docs = sample_documents(conn, root, sample, seed)
+    finally:
+        conn.close()
+    if not docs:
+        raise RuntimeError(f"No hay PDFs en la base que existan bajo {root}")
+
+    cores = usable_cores(total_cores, reserve)
+    options = ocrmypdf_options(lang, profile)
+    timeout = int(os.environ.get('OCR_TIMEOUT', 600))
+    ram_available = psutil.virtual_memory().available
+    pages = sum(d['pages'] for d in docs)
+    log(f"Muestra: {len(docs)} PDFs, {pages} páginas; {cores} cores utilizables")
+
+    levels = []
+    best = None
+    for slots in slot_levels(cores, max_slots, len(docs)):
+        budget = compute_budget(slots, 1, total_cores, reserve)
+        log(f"  {slots:>3} slots x --jobs {budget['jobs_per_slot']}...", end=' ', flush=True)
+        level = run_level(docs, slots, budget['jobs_per_slot'], budget['omp_thread_limit'], options, timeout)
+        levels.append(level)
+        log(f"{level['pages_per_s']:.2f} páginas/s, RSS pico {level['peak_rss_mb']:.0f} MB/slot"
+            f"{', ' + str(level['failed']) + ' fallidos' if level['failed'] else ''}")
+        if best is None or level['pages_per_s'] > best['pages_per_s']:
+            best = level
+        elif level['pages_per_s'] < best['pages_per_s'] * STOP_BELOW:
+            break   # pasado el máximo: más slots solo compiten por CPU/disco
+        if level['peak_rss_mb'] * 2**20 * slots * 2 > ram_available:
+            break   # el siguiente nivel (doble de slots) no cabría en memoria
+
+    # El mejor nivel que cabe en la RAM disponible dejando la reserva del sistema
+    budget_bytes = ram_available - RAM_RESERVE_GB * 2**30
+    fitting = [lv for lv in levels if lv['failed'] == 0 and lv['peak_rss_mb'] * 2**20 * lv['slots'] <= budget_bytes]
+    chosen = max(fitting or levels, key=lambda lv: lv['pages_per_s'])
+    limited_by = 'throughput' if chosen is best else 'memory'
+
+    return {
+        'version': PROFILE_VERSION,
+        'host': socket.gethostname(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'cores': cores,
+        'reserve_cores': reserve,
+        'ram_available_gb': round(ram_available / 2**30, 2),
+        'profile': profile,
+        'sample': {'docs': len(docs), 'pages': pages, 'bytes': sum(d['bytes'] for d in docs)},
+        'levels': levels,
+        'recommended': {
+            # Una tarea por worker (ver check_system.py): slots = workers
+            'workers': chosen['slots'],
+            'concurrency': 1,
+            'jobs_per_slot': chosen['jobs_per_slot'],
+            'omp_thread_limit': chosen['omp_thread_limit'],
+            'pages_per_s': chosen['pages_per_s'],
+            'peak_rss_mb': chosen['peak_rss_mb'],
+            'limited_by': limited_by,
+        },
+    }
@@ -4,6 +4,8 @@ import os
 from dotenv import load_dotenv
 import pymysql
 
+from status_counts import read_counts
+
 load_dotenv()
 
 DB_CONF = {
@@ -21,13 +23,11 @@ def main():
     try:
         with conn.cursor() as cur:
             print("\n=== ESTADO DE REGISTROS EN LA BASE DE DATOS ===\n")
-            cur.execute("SELECT p.ocr_status, COUNT(*) as cnt FROM pdf_metadata p GROUP BY p.ocr_status")
-            rows = cur.fetchall()
-            for row in rows:
-                print(f"{row['ocr_status']}: {row['cnt']}")
+            stats, _ = read_counts(conn)
+            for status, cnt in stats.items():
+                print(f"{status}: {cnt}")
             
-            cur.execute("SELECT COUNT(*) as cnt FROM pdf_metadata WHERE ocr_status='pending'")
-            pending = cur.fetchone()['cnt']
+            pending = stats.get('pending', 0)
             print(f"\nRegistros pendientes disponibles: {pending}")
             
             # Mostrar algunos ejemplos
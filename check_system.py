@@ -7,15 +7,23 @@ Analiza:
 - Memoria RAM
 - Espacio en disco
 - Recomienda número de workers
+
+Las recomendaciones son estimaciones estáticas. Para medirlas en este host
+con documentos reales (ver capacity.py):
+    python check_system.py --calibrate --root /ruta/a/transparencia
 """
+import argparse
 import os
 import sys
 import platform
 import psutil
 from pathlib import Path
 
-def get_system_info():
-    """Obtiene información del sistema"""
+from cpu_budget import compute_budget, recommend_slots
+from capacity import calibrate, load_profile, save_profile
+
+def get_system_info(disk_path=None):
+    """Obtiene información del sistema (disco: el de disk_path, o el de este script)"""
     info = {}
     
     # CPU
@@ -31,7 +39,8 @@ def get_system_info():
     info['ram_percent'] = mem.percent
     
     # Disco
-    disk = psutil.disk_usage('C:\\')
+    info['disk_path'] = str(disk_path or Path(__file__).resolve().anchor)
+    disk = psutil.disk_usage(info['disk_path'])
     info['disk_total_gb'] = disk.total / (1024**3)
     info['disk_free_gb'] = disk.free / (1024**3)
     info['disk_percent'] = disk.percent
@@ -50,15 +59,17 @@ def recommend_workers(info):
     Recomienda número de workers basado en recursos del sistema.
     
     Criterios:
-    1. CPU: 1 worker por core físico (deja 1-2 cores libres)
+    1. CPU: modelo de presupuesto de cpu_budget.py (slots x jobs de ocrmypdf
+       <= cores utilizables, dejando 1 core libre)
     2. RAM: Suficiente para workers + sistema (mínimo 2GB libres)
     3. I/O: No saturar disco
     """
     recommendations = {}
     
-    # Recomendación basada en CPU
-    cpu_physical = info['cpu_count_physical'] or info['cpu_count_logical'] // 2
-    cpu_recommendation = max(1, cpu_physical - 1)  # Dejar 1 core libre
+    # Recomendación basada en CPU: mismo modelo y mismos cores lógicos (os.cpu_count)
+    # que start_workers.py y compute_budget, para que las cifras coincidan
+    cpu_budget = recommend_slots()
+    cpu_recommendation = cpu_budget['slots']
     
     # Recomendación basada en RAM
     ram_available = info['ram_available_gb']
@@ -79,7 +90,14 @@ def recommend_workers(info):
     recommendations['ram_based'] = ram_recommendation
     recommendations['recommended'] = recommended
     recommendations['conservative'] = max(1, recommended // 2)
-    recommendations['aggressive'] = min(16, recommended * 2)
+    # Más slots que cores utilizables solo genera cambios de contexto
+    recommendations['aggressive'] = min(16, cpu_budget['cores'], recommended * 2)
+    
+    # --jobs/OMP_THREAD_LIMIT que start_workers.py asignará con la recomendación
+    budget = compute_budget(recommended, 1)
+    recommendations['cores'] = budget['cores']
+    recommendations['jobs_per_slot'] = budget['jobs_per_slot']
+    recommendations['omp_thread_limit'] = budget['omp_thread_limit']
     
     return recommendations
 
@@ -101,7 +119,7 @@ def print_system_info(info):
     print(f"   Disponible:        {info['ram_available_gb']:.2f} GB")
     print(f"   Uso:               {info['ram_percent']:.1f}%")
     
-    print(f"\n💿  DISCO (C:):")
+    print(f"\n💿  DISCO ({info['disk_path']}):")
     print(f"   Total:             {info['disk_total_gb']:.2f} GB")
     print(f"   Libre:             {info['disk_free_gb']:.2f} GB")
     print(f"   Uso:               {info['disk_percent']:.1f}%")
@@ -119,6 +137,7 @@ def print_recommendations(rec, info):
     print(f"\n📈  Análisis de recursos:")
     print(f"   Límite por CPU:    {rec['cpu_based']} workers")
     print(f"   Límite por RAM:    {rec['ram_based']} workers")
+    print(f"   Cores para OCR:    {rec['cores']} (ocrmypdf --jobs {rec['jobs_per_slot']}, OMP_THREAD_LIMIT={rec['omp_thread_limit']} por worker)")
     
     print(f"\n✅  RECOMENDACIÓN PRINCIPAL: {rec['recommended']} workers")
     print(f"   (Balance óptimo entre CPU, RAM y estabilidad)")
@@ -128,6 +147,16 @@ def print_recommendations(rec, info):
     print(f"   Recomendada:       {rec['recommended']} workers  ⭐ USAR ESTA")
     print(f"   Agresiva:          {rec['aggressive']} workers  (más rápido, más riesgo)")
     
+    profile = load_profile()
+    if profile:
+        r = profile['recommended']
+        print(f"\n📏  Perfil calibrado ({profile['host']}, {profile['created_at']}):")
+        print(f"   {r['workers']} workers x --jobs {r['jobs_per_slot']}: {r['pages_per_s']:.2f} páginas/s medidas, "
+              f"{r['peak_rss_mb']:.0f} MB/slot")
+        print(f"   Usar: python start_workers.py --from-profile")
+    else:
+        print(f"\n📏  Sin perfil calibrado: python check_system.py --calibrate --root <transparencia>")
+    
     # Estimaciones de rendimiento
     print(f"\n⏱️  Estimación de tiempo (7,883 PDFs de ~2 páginas):")
     pdfs_per_hour_per_worker = 50
@@ -188,14 +217,57 @@ def print_warnings(info, rec):
     
     print()
 
+def print_calibration(profile, path):
+    """Imprime los niveles medidos y la recomendación calibrada"""
+    print("\n" + "="*70)
+    print("  CALIBRACIÓN DE CAPACIDAD")
+    print("="*70)
+    sample = profile['sample']
+    print(f"\n   Muestra: {sample['docs']} PDFs, {sample['pages']} páginas ({sample['bytes'] / 2**20:.1f} MB)")
+    print(f"\n   {'slots':>5} {'jobs':>5} {'pág/s':>8} {'RSS/slot':>9} {'CPU %':>6} {'lect MB/s':>10} {'escr MB/s':>10}")
+    for lv in profile['levels']:
+        print(f"   {lv['slots']:>5} {lv['jobs_per_slot']:>5} {lv['pages_per_s']:>8.2f} {lv['peak_rss_mb']:>7.0f}MB "
+              f"{lv['cpu_percent']:>6.1f} {lv.get('disk_read_mb_s', 0):>10.2f} {lv.get('disk_write_mb_s', 0):>10.2f}")
+    r = profile['recommended']
+    reason = 'máximo rendimiento' if r['limited_by'] == 'throughput' else 'limitado por RAM'
+    print(f"\n✅  RECOMENDACIÓN MEDIDA: {r['workers']} workers x --jobs {r['jobs_per_slot']} ({reason})")
+    print(f"   Perfil guardado en {path}")
+    print(f"   python start_workers.py --from-profile")
+
 def main():
+    parser = argparse.ArgumentParser(description='Analizar el sistema y recomendar workers')
+    parser.add_argument('--disk', default=None, help='Ruta cuyo disco analizar (default: el de este script)')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Medir páginas/s con una muestra real a concurrencia creciente (ver capacity.py)')
+    parser.add_argument('--root', default='transparencia', help='Carpeta transparencia (para --calibrate)')
+    parser.add_argument('--sample', type=int, default=16, help='PDFs de la muestra de calibración (default: 16)')
+    parser.add_argument('--max-slots', type=int, default=None, help='Máximo de slots a probar (default: cores)')
+    parser.add_argument('--profile-out', default=None,
+                        help='Archivo del perfil (default: OCR_CAPACITY_PROFILE o capacity_profile.json)')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        root = Path(args.root).resolve()
+        if not root.exists():
+            print(f"❌ Error: La ruta {root} no existe")
+            sys.exit(1)
+        print("\n📏 Calibrando capacidad de OCR (puede tardar varios minutos)...\n")
+        try:
+            profile = calibrate(root, args.sample, args.max_slots)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        path = save_profile(profile, args.profile_out)
+        print_calibration(profile, path)
+        return
+
     print("\n" + "="*70)
     print("  ANÁLISIS DE SISTEMA PARA PROCESAMIENTO OCR MASIVO")
     print("="*70)
     
     try:
         # Obtener información del sistema
-        info = get_system_info()
+        info = get_system_info(args.disk)
         
         # Calcular recomendaciones
         rec = recommend_workers(info)
@@ -215,6 +287,8 @@ def main():
    3. Si los workers se quedan sin memoria, reduce el número
    4. Para PDFs muy grandes, reduce workers o aumenta timeout
    5. Usa --concurrency 1 (una tarea por worker es más estable)
+   6. start_workers.py reparte los cores entre slots (--jobs de ocrmypdf);
+      subir workers más allá de los cores solo añade cambios de contexto
         """)
         
     except Exception as e:
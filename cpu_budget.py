@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Modelo de presupuesto de CPU compartido por start_workers.py, check_system.py
+y los procesos de OCR.
+
+Cada slot de Celery (workers x concurrency) ejecuta un ocrmypdf, y cada
+ocrmypdf lanza por defecto tantos procesos como cores tenga la máquina (--jobs),
+y Tesseract además puede abrir hilos OpenMP. Sin coordinación, 4 workers x 2
+de concurrencia en 16 cores producen cientos de hilos ejecutables.
+
+El modelo reparte los cores utilizables entre los slots:
+  - jobs por slot   = cores utilizables // slots  (mínimo 1)
+  - OMP_THREAD_LIMIT = cores sobrantes por job   (normalmente 1)
+  - afinidad (opcional): cada worker recibe un bloque contiguo de cores
+
+Variables de entorno que consumen los procesos de OCR:
+  OCR_JOBS          valor de --jobs para ocrmypdf
+  OMP_THREAD_LIMIT  hilos OpenMP de Tesseract
+"""
+import os
+
+# Páginas promedio por documento del archivo (ver check_system.py); más jobs
+# por slot que páginas no aporta, ocrmypdf paraleliza por página.
+DEFAULT_AVG_PAGES = 2
+
+
+def usable_cores(total_cores=None, reserve=1):
+    """Cores disponibles para OCR tras reservar `reserve` para el sistema"""
+    total = total_cores or os.cpu_count() or 1
+    return max(1, total - reserve)
+
+
+def compute_budget(workers, concurrency, total_cores=None, reserve=1, affinity=False):
+    """
+    Calcula el reparto de CPU para `workers` procesos con `concurrency` slots cada uno.
+
+    Returns:
+        dict: {'cores', 'slots', 'jobs_per_slot', 'omp_thread_limit',
+               'oversubscribed', 'affinity': [lista de cores por worker] | None}
+    """
+    cores = usable_cores(total_cores, reserve)
+    slots = max(1, workers * concurrency)
+    jobs = max(1, cores // slots)
+    omp = max(1, cores // (slots * jobs))
+
+    cpu_sets = None
+    if affinity:
+        # Bloques contiguos de cores por worker, empezando tras los reservados
+        first = (total_cores or os.cpu_count() or 1) - cores
+        cpus = list(range(first, first + cores))
+        per_worker = max(1, cores // max(1, workers))
+        cpu_sets = []
+        for i in range(workers):
+            start = (i * per_worker) % cores
+            cpu_sets.append([cpus[(start + k) % cores] for k in range(per_worker)])
+
+    return {
+        'cores': cores,
+        'slots': slots,
+        'jobs_per_slot': jobs,
+        'omp_thread_limit': omp,
+        'oversubscribed': slots > cores,
+        'affinity': cpu_sets,
+    }
+
+
+def recommend_slots(total_cores=None, reserve=1, avg_pages=DEFAULT_AVG_PAGES):
+    """
+    Recomienda concurrencia total y jobs por slot según el mismo modelo.
+
+    Con documentos de pocas páginas, --jobs mayor que el número de páginas deja
+    cores ociosos, así que conviene más slots con pocos jobs cada uno.
+    """
+    cores = usable_cores(total_cores, reserve)
+    jobs = max(1, min(avg_pages, cores))
+    slots = max(1, cores // jobs)
+    return {'cores': cores, 'slots': slots, 'jobs_per_slot': jobs, 'omp_thread_limit': 1}
+
+
+def budget_env(budget, base_env=None):
+    """Entorno para un worker con los límites del presupuesto aplicados"""
+    env = dict(base_env if base_env is not None else os.environ)
+    env['OCR_JOBS'] = str(budget['jobs_per_slot'])
+    env['OMP_THREAD_LIMIT'] = str(budget['omp_thread_limit'])
+    return env
+
+
+def ocrmypdf_jobs_args():
+    """Argumentos --jobs para ocrmypdf según OCR_JOBS (vacío si no está definido)"""
+    jobs = os.environ.get('OCR_JOBS')
+    if jobs and int(jobs) > 0:
+        return ['--jobs', str(int(jobs))]
+    return []
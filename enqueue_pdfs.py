@@ -9,11 +9,18 @@ Uso:
     # Encolar solo 100 PDFs
     python enqueue_pdfs.py --limit 100
     
+    # Perfil de salida rápido (sin PDF/A)
+    python enqueue_pdfs.py --profile fast
+    
+    # Trabajos más cortos primero (sjf), más largos (ljf) o round-robin por carpeta (fair)
+    python enqueue_pdfs.py --policy fair
+    
     # Especificar ruta raíz
     python enqueue_pdfs.py --root C:\xampp_php8\htdocs\OCR\transparencia --limit 500
 """
 import argparse
 import os
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 import pymysql
@@ -22,6 +29,9 @@ load_dotenv()
 
 # Importar la tarea de Celery
 from tasks import process_pdf
+from scheduling import POLICIES, POLICY_LABELS, default_policy, pending_query, record_policy
+from status_counts import read_counts
+import metrics
 
 DB_CONF = {
     'host': os.environ.get('DB_HOST', '127.0.0.1'),
@@ -33,23 +43,15 @@ DB_CONF = {
     'cursorclass': pymysql.cursors.DictCursor,
 }
 
-def enqueue_pending(root, limit=None):
-    """Encola PDFs pendientes en Celery"""
-    conn = pymysql.connect(**DB_CONF)
+def enqueue_pending(root, limit=None, profile=None, policy=None):
+    """Encola PDFs pendientes en Celery, en el orden de la política (ver scheduling.py)"""
+    policy = policy or default_policy()
+    metrics.init('enqueue')
+    conn = metrics.connect(**DB_CONF)
     try:
         with conn.cursor() as cur:
             # Consultar PDFs pendientes
-            query = """
-                SELECT n.id as node_id, n.path 
-                FROM nodes n 
-                JOIN pdf_metadata p ON n.id = p.node_id 
-                WHERE p.ocr_status='pending' 
-                ORDER BY n.path ASC
-            """
-            if limit:
-                query += f" LIMIT {limit}"
-            
-            cur.execute(query)
+            cur.execute(*pending_query(policy, limit))
             rows = cur.fetchall()
             
             print(f"\n📊 Encontrados {len(rows)} PDFs pendientes")
@@ -58,7 +60,7 @@ def enqueue_pending(root, limit=None):
                 print("✅ No hay PDFs pendientes para procesar")
                 return
             
-            print(f"🚀 Encolando {len(rows)} tareas en Celery...\n")
+            print(f"🚀 Encolando {len(rows)} tareas en Celery ({POLICY_LABELS[policy]})...\n")
             
             enqueued = 0
             skipped = 0
@@ -70,14 +72,19 @@ def enqueue_pending(root, limit=None):
                 
                 if pdf_path.exists():
                     # Encolar tarea en Celery
-                    task = process_pdf.delay(node_id, str(pdf_path))
+                    task = process_pdf.delay(node_id, str(pdf_path), profile=profile, enqueued_at=time.time())
                     enqueued += 1
+                    metrics.inc('ocr_enqueued_total', policy=policy)
                     if i % 50 == 0:
                         print(f"  ✓ Encoladas {i}/{len(rows)} tareas...")
                 else:
                     skipped += 1
                     print(f"  ⚠ Archivo no encontrado: {pdf_path}")
             
+            record_policy(conn, policy, 'enqueue')
+            if metrics.enabled():
+                metrics.set_backlog(read_counts(conn)[0])
+            
             print(f"\n{'='*60}")
             print(f"✅ Resumen:")
             print(f"   - Total procesados:  {len(rows)}")
@@ -99,6 +106,10 @@ def main():
                         help='Ruta a la carpeta transparencia')
     parser.add_argument('--limit', type=int, default=None, 
                         help='Límite de PDFs a encolar (default: todos)')
+    parser.add_argument('--profile', choices=['archive', 'fast', 'text-only'], default=None,
+                        help='Perfil de salida (default: el del worker / OCR_PROFILE_RULES)')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default=default_policy(),
+                        help='Orden de encolado: path, sjf, ljf, fair (default: OCR_SCHEDULE o path)')
     args = parser.parse_args()
     
     root = Path(args.root).resolve()
@@ -112,11 +123,12 @@ def main():
 ╠═══════════════════════════════════════════════════════════╣
 ║  Root:          {str(root)[:40]:<40}  ║
 ║  Límite:        {str(args.limit or 'Sin límite'):<40}  ║
+║  Política:      {args.policy:<40}  ║
 ╚═══════════════════════════════════════════════════════════╝
     """)
     
     try:
-        enqueue_pending(root, args.limit)
+        enqueue_pending(root, args.limit, args.profile, args.policy)
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Etapa previa al OCR: resolución de las imágenes de cada página.
+
+Muchos escaneos del archivo están a 600+ DPI en color. ocrmypdf/Tesseract los
+procesan a resolución nativa, lo que multiplica memoria y tiempo sin ganar
+precisión respecto a ~300 DPI. Antes del OCR se inspeccionan las imágenes con
+pikepdf y se decide:
+  - si alguna imagen supera OCR_MAX_DPI, se reescribe una copia del PDF con
+    esas imágenes remuestreadas a OCR_TARGET_DPI (y, opcionalmente, en gris)
+  - si la resolución es menor que OCR_MIN_DPI, se pide --oversample a ocrmypdf
+
+El DPI se calcula con el tamaño dibujado de cada imagen (matriz cm del
+contenido de la página); si no se puede determinar, se asume a página completa.
+
+La copia remuestreada (JPEG, quizá en gris) es la entrada de ocrmypdf y por
+tanto el PDF que se publica. El perfil archive conserva las imágenes
+originales en la salida: en lugar de reescribir el PDF se limita solo lo que
+ve Tesseract (--tesseract-downsample-large-images/--tesseract-downsample-above
+de ocrmypdf, en píxeles: OCR_TARGET_DPI por el lado mayor de la página más
+grande). Tesseract, el grueso del tiempo y la memoria por página, trabaja a
+~OCR_TARGET_DPI; el rasterizado y la limpieza siguen a resolución nativa.
+
+Configuración por variables de entorno:
+  OCR_MAX_DPI     umbral para remuestrear (default: 400, 0 = desactivado);
+                  con el perfil archive solo se remuestrea la entrada de Tesseract
+  OCR_TARGET_DPI  resolución objetivo (default: 300)
+  OCR_MIN_DPI     por debajo se usa --oversample OCR_TARGET_DPI (default: 150)
+  OCR_GRAYSCALE   1 para pasar a gris las imágenes en color remuestreadas
+                  (siempre activo con el perfil text-only)
+"""
+import io
+import math
+import os
+import zlib
+from pathlib import Path
+
+import pikepdf
+from pikepdf import Name, PdfImage
+
+
+def prep_settings(profile=None):
+    """Política vigente; forma parte de la firma de opciones de la caché"""
+    return {
+        'max_dpi': int(os.environ.get('OCR_MAX_DPI', 400)),
+        # archive publica las imágenes originales: solo se limita la entrada de Tesseract
+        'raster_only': profile == 'archive',
+        'target_dpi': int(os.environ.get('OCR_TARGET_DPI', 300)),
+        'min_dpi': int(os.environ.get('OCR_MIN_DPI', 150)),
+        'grayscale': os.environ.get('OCR_GRAYSCALE', '0') == '1' or profile == 'text-only',
+    }
+
+
+def _multiply(m, ctm):
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = ctm
+    return [a*A + b*C, a*B + b*D, c*A + d*C, c*B + d*D, e*A + f*C + E, e*B + f*D + F]
+
+
+def _draw_sizes(page):
+    """Tamaño dibujado (pt) de cada imagen según la matriz de transformación"""
+    sizes = {}
+    ctm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    try:
+        ops = pikepdf.parse_content_stream(page, 'q Q cm Do')
+    except Exception:
+        return sizes
+    for operands, operator in ops:
+        op = str(operator)
+        if op == 'q':
+            stack.append(ctm)
+        elif op == 'Q':
+            ctm = stack.pop() if stack else ctm
+        elif op == 'cm' and len(operands) == 6:
+            ctm = _multiply([float(x) for x in operands], ctm)
+        elif op == 'Do' and operands:
+            sizes[str(operands[0])] = (math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3]))
+    return sizes
+
+
+def _image_dpi(page, pim, name=None, sizes=None):
+    """
+    DPI efectivo y fracción del ancho de página que ocupa la imagen.
+
+    Sin matriz conocida se asume la imagen a página completa.
+    """
+    box = page.mediabox
+    page_w = abs(float(box[2]) - float(box[0]))
+    page_h = abs(float(box[3]) - float(box[1]))
+    if sizes and name in sizes and min(sizes[name]) > 0:
+        width_pt, height_pt = sizes[name]
+    else:
+        width_pt, height_pt = page_w, page_h
+    if width_pt <= 0 or height_pt <= 0 or page_w <= 0:
+        return 0, 0
+    dpi = max(pim.width / (width_pt / 72.0), pim.height / (height_pt / 72.0))
+    return dpi, min(1.0, width_pt / page_w)
+
+
+def page_image_stats(pdf):
+    """
+    Imágenes por página de un pikepdf.Pdf abierto.
+
+    Returns:
+        list: por página, {'images': n, 'max_dpi': int, 'min_dpi': int|None
+                           (imágenes de al menos media página), 'color': bool,
+                           'pixels': int}
+    """
+    stats = []
+    for page in pdf.pages:
+        info = {'images': 0, 'max_dpi': 0, 'min_dpi': None, 'color': False, 'pixels': 0}
+        sizes = _draw_sizes(page)
+        for name, raw in page.images.items():
+            try:
+                pim = PdfImage(raw)
+            except Exception:
+                continue
+            if pim.image_mask:
+                continue
+            dpi, coverage = _image_dpi(page, pim, name, sizes)
+            dpi = int(dpi)
+            info['images'] += 1
+            info['max_dpi'] = max(info['max_dpi'], dpi)
+            # Solo las imágenes grandes (escaneos) cuentan para la resolución mínima;
+            # un logo pequeño a baja resolución no justifica --oversample
+            if coverage >= 0.5:
+                info['min_dpi'] = dpi if info['min_dpi'] is None else min(info['min_dpi'], dpi)
+            info['color'] = info['color'] or pim.mode not in ('1', 'L', 'P')
+            info['pixels'] += pim.width * pim.height
+        stats.append(info)
+    return stats
+
+
+def plan_resolution(stats, settings):
+    """
+    Decide qué hacer con un documento según sus estadísticas de imagen.
+
+    Returns:
+        dict: {'downsample': bool, 'oversample': int|None, 'max_dpi', 'min_dpi'}
+    """
+    dpis = [s['max_dpi'] for s in stats if s['images']]
+    mins = [s['min_dpi'] for s in stats if s['images'] and s['min_dpi']]
+    max_dpi = max(dpis) if dpis else 0
+    min_dpi = min(mins) if mins else None
+    downsample = bool(settings['max_dpi']) and max_dpi > settings['max_dpi']
+    oversample = None
+    if min_dpi is not None and min_dpi < settings['min_dpi']:
+        oversample = settings['target_dpi']
+    return {'downsample': downsample, 'oversample': oversample, 'max_dpi': max_dpi, 'min_dpi': min_dpi}
+
+
+def _resample(raw, pim, scale, grayscale):
+    """Reemplaza el stream de la imagen por una versión remuestreada"""
+    img = pim.as_pil_image()
+    size = (max(1, int(pim.width * scale)), max(1, int(pim.height * scale)))
+    if img.mode == '1':
+        img = img.convert('L').resize(size).point(lambda p: 255 if p > 127 else 0).convert('1')
+        raw.write(zlib.compress(img.tobytes()), filter=Name.FlateDecode)
+        raw.BitsPerComponent = 1
+        raw.ColorSpace = Name.DeviceGray
+    else:
+        # Las paletas ('P') pueden ser de color: se expanden a RGB salvo en modo gris
+        img = img.convert('L' if grayscale or img.mode == 'L' else 'RGB').resize(size)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=85)
+        raw.write(buf.getvalue(), filter=Name.DCTDecode)
+        raw.BitsPerComponent = 8
+        raw.ColorSpace = Name.DeviceGray if img.mode == 'L' else Name.DeviceRGB
+    raw.Width, raw.Height = size
+    for key in ('/DecodeParms', '/Decode'):
+        if key in raw:
+            del raw[key]
+
+
+def downsample_pdf(src: Path, dest: Path, settings):
+    """
+    Escribe en dest una copia de src con las imágenes sobre OCR_MAX_DPI
+    remuestreadas a OCR_TARGET_DPI.
+
+    Se omiten máscaras e imágenes con /Decode, cuya conversión no es segura.
+
+    Returns:
+        int: número de imágenes remuestreadas
+    """
+    changed = 0
+    with pikepdf.open(src) as pdf:
+        seen = set()
+        for page in pdf.pages:
+            sizes = _draw_sizes(page)
+            for name, raw in page.images.items():
+                if raw.objgen in seen:
+                    continue
+                seen.add(raw.objgen)
+                try:
+                    pim = PdfImage(raw)
+                    if pim.image_mask or '/Decode' in raw:
+                        continue
+                    dpi, _ = _image_dpi(page, pim, name, sizes)
+                    if dpi <= settings['max_dpi']:
+                        continue
+                    _resample(raw, pim, settings['target_dpi'] / dpi, settings['grayscale'])
+                    changed += 1
+                except Exception:
+                    continue  # imagen en formato no soportado: se deja tal cual
+        pdf.save(dest)
+    return changed
+
+
+def prepare_input(src: Path, workdir: Path, profile=None):
+    """
+    Aplica la política de resolución a src.
+
+    Returns:
+        tuple: (pdf a pasar a ocrmypdf, opciones extra de ocrmypdf, info)
+    """
+    settings = prep_settings(profile)
+    try:
+        with pikepdf.open(src) as pdf:
+            plan = plan_resolution(page_image_stats(pdf), settings)
+            long_side_in = max((max(abs(float(p.mediabox[2]) - float(p.mediabox[0])),
+                                    abs(float(p.mediabox[3]) - float(p.mediabox[1]))) / 72.0
+                                for p in pdf.pages), default=0)
+    except Exception:
+        return src, [], {'downsampled': 0, 'oversample': None}
+
+    extra = ['--oversample', str(plan['oversample'])] if plan['oversample'] else []
+    info = {'max_dpi': plan['max_dpi'], 'min_dpi': plan['min_dpi'], 'downsampled': 0,
+            'oversample': plan['oversample']}
+    if not plan['downsample']:
+        return src, extra, info
+    if settings['raster_only']:
+        if long_side_in:
+            info['tesseract_max_px'] = math.ceil(settings['target_dpi'] * long_side_in)
+            extra += ['--tesseract-downsample-large-images',
+                      '--tesseract-downsample-above', str(info['tesseract_max_px'])]
+        return src, extra, info
+
+    dest = Path(workdir) / f"prep_{Path(src).name}"
+    info['downsampled'] = downsample_pdf(src, dest, settings)
+    if not info['downsampled']:
+        return src, extra, info
+    return dest, extra, info
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+OCR incremental para documentos a los que se les agregan páginas.
+
+Tras cada OCR se guardan hashes de contenido por página en pdf_pages junto con
+la firma de opciones usada (pdf_metadata.ocr_settings). Cuando el checksum del
+archivo cambia, se comparan los hashes nuevos con los guardados: si las
+primeras k páginas no cambiaron y el PDF OCR anterior sigue disponible, solo
+se procesan las páginas k+1..N y se empalman con las k primeras del resultado
+anterior (PDF y texto). Un anexo mensual de 5 páginas sobre un documento de 300
+pasa a ser un trabajo de 5 páginas.
+
+El texto se empalma por página usando el salto de página (\\f) que pdftotext
+emite al final de cada página.
+"""
+import hashlib
+from pathlib import Path
+
+import pikepdf
+
+PAGE_BREAK = '\f'
+
+
+def _stream_bytes(obj):
+    try:
+        return obj.read_raw_bytes()
+    except Exception:
+        return b''
+
+
+def _hash_xobjects(h, resources, depth=0):
+    """Incluye en el hash las imágenes y formularios referenciados por la página"""
+    if resources is None or depth > 2:
+        return
+    xobjects = resources.get('/XObject')
+    if xobjects is None:
+        return
+    for name in sorted(xobjects.keys()):
+        xobj = xobjects[name]
+        h.update(name.encode('utf-8'))
+        h.update(_stream_bytes(xobj))
+        if xobj.get('/Subtype') == '/Form':
+            _hash_xobjects(h, xobj.get('/Resources'), depth + 1)
+
+
+def _page_hash(page):
+    h = hashlib.sha256()
+    h.update(repr([float(x) for x in page.mediabox]).encode('utf-8'))
+    h.update(str(page.obj.get('/Rotate', 0)).encode('utf-8'))
+    contents = page.obj.get('/Contents')
+    if isinstance(contents, pikepdf.Array):
+        for stream in contents:
+            h.update(_stream_bytes(stream))
+    elif contents is not None:
+        h.update(_stream_bytes(contents))
+    _hash_xobjects(h, page.obj.get('/Resources'))
+    return h.hexdigest()
+
+
+def page_hashes(pdf_path: Path):
+    """Lista de hashes de contenido, uno por página (None si no se puede abrir)"""
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            return [_page_hash(page) for page in pdf.pages]
+    except Exception:
+        return None
+
+
+def load_previous(conn, node_id):
+    """Hashes, firma de opciones, PDF y texto del último OCR del nodo"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT ocr_settings, ocr_pdf_path, ocr_text FROM pdf_metadata WHERE node_id=%s",
+            (node_id,)
+        )
+        meta = cur.fetchone()
+        cur.execute(
+            "SELECT content_hash FROM pdf_pages WHERE node_id=%s ORDER BY page_no ASC",
+            (node_id,)
+        )
+        hashes = [r['content_hash'] for r in cur.fetchall()]
+    if not meta:
+        return None
+    return {
+        'hashes': hashes,
+        'settings': meta['ocr_settings'],
+        'ocr_pdf_path': meta['ocr_pdf_path'],
+        'ocr_text': meta['ocr_text'],
+    }
+
+
+def reusable_prefix(previous, new_hashes, settings):
+    """
+    Número de páginas iniciales que se pueden reutilizar del OCR anterior.
+
+    Devuelve 0 (OCR completo) si no hay OCR previo con las mismas opciones, si
+    el PDF anterior ya no existe o si su número de páginas/texto no coincide
+    con los hashes guardados.
+    """
+    if not previous or not new_hashes or not previous['hashes']:
+        return 0
+    if previous['settings'] != settings or previous['ocr_text'] is None:
+        return 0
+    prev_pdf = previous['ocr_pdf_path']
+    if not prev_pdf or not Path(prev_pdf).exists():
+        return 0
+
+    old_hashes = previous['hashes']
+    k = 0
+    for old, new in zip(old_hashes, new_hashes):
+        if old is None or old != new:
+            break
+        k += 1
+    if k == 0:
+        return 0
+
+    try:
+        with pikepdf.open(prev_pdf) as pdf:
+            if len(pdf.pages) != len(old_hashes):
+                return 0
+    except Exception:
+        return 0
+    if len(previous['ocr_text'].split(PAGE_BREAK)) < k:
+        return 0
+    return k
+
+
+def split_tail(src: Path, k, dest: Path):
+    """Escribe en dest las páginas k+1..N de src"""
+    with pikepdf.open(src) as pdf, pikepdf.new() as tail:
+        tail.pages.extend(pdf.pages[k:])
+        tail.save(dest)
+    return dest
+
+
+def splice_pdf(prev_pdf: Path, k, tail_pdf, dest: Path):
+    """Primeras k páginas del OCR anterior + páginas OCR nuevas (tail_pdf puede ser None)"""
+    with pikepdf.open(prev_pdf) as prev:
+        while len(prev.pages) > k:
+            del prev.pages[-1]
+        if tail_pdf is not None:
+            with pikepdf.open(tail_pdf) as tail:
+                prev.pages.extend(tail.pages)
+                prev.save(dest)
+        else:
+            prev.save(dest)
+    return dest
+
+
+def splice_text(prev_text, k, tail_text):
+    """Texto de las primeras k páginas anteriores + texto de las nuevas"""
+    if k == 0:
+        return tail_text
+    head = PAGE_BREAK.join(prev_text.split(PAGE_BREAK)[:k]) + PAGE_BREAK
+    return head + (tail_text or '')
+
+
+def save_page_hashes(conn, node_id, hashes, settings):
+    """
+    Guarda los hashes por página y la firma de opciones del OCR realizado.
+
+    Con hashes=None se invalidan los hashes guardados (el siguiente cambio
+    del archivo implicará OCR completo).
+    """
+    with conn.cursor() as cur:
+        if hashes:
+            cur.executemany(
+                """INSERT INTO pdf_pages (node_id, page_no, content_hash) VALUES (%s,%s,%s)
+                   ON DUPLICATE KEY UPDATE content_hash=VALUES(content_hash)""",
+                [(node_id, i, h) for i, h in enumerate(hashes, 1)]
+            )
+            cur.execute("DELETE FROM pdf_pages WHERE node_id=%s AND page_no>%s", (node_id, len(hashes)))
+        else:
+            cur.execute("UPDATE pdf_pages SET content_hash=NULL WHERE node_id=%s", (node_id,))
+            settings = None
+        cur.execute("UPDATE pdf_metadata SET ocr_settings=%s WHERE node_id=%s", (settings, node_id))
+    conn.commit()
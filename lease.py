@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Reclamo de nodos con lease y heartbeat para evitar OCR duplicado y recuperar
+rápido el trabajo de workers caídos.
+
+Con task_acks_late=True un mensaje reentregado puede iniciar process_pdf sobre
+un nodo que otro worker sigue procesando. Antes de procesar, cada ejecución
+reclama el nodo con un UPDATE condicional atómico que escribe un token propio
+(lease_owner) y un vencimiento corto (lease_expires_at):
+
+  - se puede reclamar un nodo 'pending' o 'failed', o uno 'processing' cuyo
+    lease venció (o que no tiene lease: filas anteriores a este cambio)
+  - si el UPDATE no afecta filas, otro proceso tiene el nodo: se abandona
+  - el cierre (done/failed) solo se acepta si lease_owner sigue siendo el
+    token propio; si el lease se perdió, el resultado se descarta
+  - antes de publicar (PDF en transparencia_ocr, pdf_pages, ocr_cache) se
+    comprueba el lease con lease_guard: un worker que lo perdió no
+    sobrescribe la salida del nuevo dueño
+
+Mientras el OCR corre, un hilo de heartbeat renueva el lease y registra
+heartbeat_at cada OCR_HEARTBEAT_INTERVAL segundos. Si el worker muere, el
+lease vence en OCR_LEASE_SECONDS y el reaper (tarea periódica de Celery beat
+tasks.reap_stale_leases o reset_failed.py --free-stuck) devuelve el nodo a la cola.
+Un documento largo no se considera atorado mientras su worker siga latiendo.
+
+Cota de recuperación: un worker muerto se detecta como mucho en
+OCR_LEASE_SECONDS + OCR_REAPER_INTERVAL segundos (con los defaults 30 + 15 =
+45 s, bajo el minuto). El lease debe cubrir varios heartbeats (30 / 10 = 3)
+para que un ciclo perdido por un error transitorio de la base no lo venza.
+
+Configuración por variables de entorno:
+  OCR_LEASE_SECONDS        vencimiento sin heartbeat (default: 30)
+  OCR_HEARTBEAT_INTERVAL   segundos entre heartbeats (default: 10)
+"""
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pymysql
+
+# Filas 'processing' sin lease (de código anterior): se recuperan con la
+# heurística de antigüedad previa
+LEGACY_STUCK_MINUTES = 30
+
+
+class LeaseLost(Exception):
+    """El lease del nodo pasó a otro proceso: el resultado no se publica"""
+
+
+def lease_seconds():
+    return int(os.environ.get('OCR_LEASE_SECONDS', 30))
+
+
+def heartbeat_interval():
+    return float(os.environ.get('OCR_HEARTBEAT_INTERVAL', 10))
+
+
+def new_token(run_id=None):
+    """Token único de la ejecución: host:pid:id (id de tarea Celery si existe)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{run_id or uuid.uuid4().hex[:12]}"[:100]
+
+
+def claim_node(conn, node_id, token, seconds=None):
+    """
+    Reclama el nodo para procesarlo.
+
+    Returns:
+        bool: True si el nodo quedó a nombre de token
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """UPDATE pdf_metadata
+               SET ocr_status='processing', lease_owner=%s,
+                   lease_expires_at=NOW() + INTERVAL %s SECOND, heartbeat_at=NOW(),
+                   ocr_started_at=NOW(), updated_at=NOW()
+               WHERE node_id=%s
+                 AND (ocr_status IN ('pending','failed')
+                      OR (ocr_status='processing'
+                          AND (lease_expires_at IS NULL OR lease_expires_at < NOW())))""",
+            (token, seconds or lease_seconds(), node_id)
+        )
+        claimed = cur.rowcount == 1
+    conn.commit()
+    return claimed
+
+
+def complete_node(conn, node_id, token, status, fields=None):
+    """
+    Cierra el nodo con status ('done'|'failed') y los campos dados, solo si
+    token sigue siendo el dueño del lease. Con 'done' se fija ocr_finished_at y
+    se reinician los intentos de indexación: el texto nuevo merece sus propios
+    reintentos (ver search_index.py).
+
+    Returns:
+        bool: False si el lease lo tiene otro proceso (resultado descartado)
+    """
+    fields = fields or {}
+    assignments = ''.join(f", {col}=%s" for col in fields)
+    if status == 'done':
+        assignments += ", ocr_finished_at=NOW(), index_attempts=0, index_error=NULL"
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""UPDATE pdf_metadata
+                SET ocr_status=%s, lease_owner=NULL, lease_expires_at=NULL{assignments},
+                    updated_at=NOW()
+                WHERE node_id=%s AND lease_owner=%s""",
+            (status, *fields.values(), node_id, token)
+        )
+        accepted = cur.rowcount == 1
+    conn.commit()
+    return accepted
+
+
+def renew_lease(conn, node_id, token, seconds=None):
+    """Heartbeat: extiende el lease si token sigue siendo el dueño"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """UPDATE pdf_metadata
+               SET heartbeat_at=NOW(), lease_expires_at=NOW() + INTERVAL %s SECOND
+               WHERE node_id=%s AND lease_owner=%s""",
+            (seconds or lease_seconds(), node_id, token)
+        )
+        renewed = cur.rowcount == 1
+    conn.commit()
+    return renewed
+
+
+def lease_guard(conn, node_id, token, lost=None):
+    """
+    Comprobación previa a publicar: lanza LeaseLost si el heartbeat ya vio el
+    lease perdido (lost() verdadero) o si el UPDATE condicional de renovación
+    no encuentra el token propio. La renovación además da un plazo completo
+    para terminar la publicación.
+    """
+    def check():
+        if (lost is not None and lost()) or not renew_lease(conn, node_id, token):
+            raise LeaseLost(f"lease del nodo {node_id} perdido")
+    return check
+
+
+@contextmanager
+def heartbeat(db_conf, node_id, token, interval=None):
+    """
+    Renueva el lease en un hilo con conexión propia mientras dura el bloque.
+
+    El objeto entregado tiene .lost = True si el lease pasó a otro proceso.
+    """
+    interval = interval or heartbeat_interval()
+    stop = threading.Event()
+    state = SimpleNamespace(lost=False)
+
+    def beat():
+        conn = None
+        while not stop.wait(interval):
+            try:
+                if conn is None:
+                    conn = pymysql.connect(**db_conf)
+                if not renew_lease(conn, node_id, token):
+                    state.lost = True
+                    break
+            except Exception:
+                # Error transitorio de DB: se reintenta en el siguiente ciclo
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    thread = threading.Thread(target=beat, name=f'heartbeat-{node_id}', daemon=True)
+    thread.start()
+    try:
+        yield state
+    finally:
+        stop.set()
+        thread.join(timeout=interval + 5)
+
+
+def _stale_where(legacy_minutes=LEGACY_STUCK_MINUTES):
+    return f"""ocr_status='processing'
+        AND (lease_expires_at < NOW()
+             OR (lease_expires_at IS NULL
+                 AND ocr_started_at < NOW() - INTERVAL {int(legacy_minutes)} MINUTE))"""
+
+
+def stale_count(conn, legacy_minutes=LEGACY_STUCK_MINUTES):
+    """Cantidad de nodos en 'processing' sin heartbeat"""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) as cnt FROM pdf_metadata WHERE {_stale_where(legacy_minutes)}")
+        return cur.fetchone()['cnt']
+
+
+def stale_nodes(conn, limit=None, legacy_minutes=LEGACY_STUCK_MINUTES):
+    """Nodos en 'processing' cuyo dueño dejó de enviar heartbeat"""
+    with conn.cursor() as cur:
+        query = f"""
+            SELECT n.id as node_id, n.path, p.lease_owner, p.heartbeat_at
+            FROM nodes n
+            JOIN pdf_metadata p ON n.id = p.node_id
+            WHERE {_stale_where(legacy_minutes)}
+            ORDER BY p.lease_expires_at ASC
+        """
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cur.execute(query)
+        return cur.fetchall()
+
+
+def reap_stale(conn, limit=None, legacy_minutes=LEGACY_STUCK_MINUTES):
+    """
+    Devuelve a 'pending' los nodos sin heartbeat. Cada fila se libera con un
+    UPDATE condicional, así que un heartbeat tardío o un reclamo concurrente
+    gana la carrera.
+
+    Returns:
+        list: filas liberadas ({'node_id', 'path', 'lease_owner', 'heartbeat_at'})
+    """
+    reaped = []
+    for row in stale_nodes(conn, limit, legacy_minutes):
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""UPDATE pdf_metadata
+                    SET ocr_status='pending', lease_owner=NULL, lease_expires_at=NULL,
+                        last_error=%s, updated_at=NOW()
+                    WHERE node_id=%s AND {_stale_where(legacy_minutes)}""",
+                (f"Liberado por reaper (sin heartbeat de {row['lease_owner'] or 'worker desconocido'})",
+                 row['node_id'])
+            )
+            if cur.rowcount == 1:
+                reaped.append(row)
+        conn.commit()
+    return reaped
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Búsqueda de texto completo embebida (SQLite FTS5) para instalaciones sin
+OpenSearch.
+
+OpenSearch es opcional y pesado (512 MB de heap en docker-compose.yml) y el
+FULLTEXT de MariaDB está comentado en el esquema. Este módulo mantiene un
+índice invertido FTS5 en un archivo local (OCR_SEARCH_DB) con:
+
+  docs      node_id, ruta, páginas, perfil y fecha de OCR (índice por ruta
+            para filtrar por subárbol de carpetas con un rango)
+  docs_fts  texto OCR tokenizado con unicode61 sin acentos, rowid = node_id;
+            ranking bm25 y fragmentos con snippet()
+  meta      marca de agua de la sincronización y generación del índice
+
+Se alimenta de forma incremental desde MariaDB: sync() lee los nodos 'done'
+con ocr_finished_at posterior a la última marca (con un margen de
+SYNC_OVERLAP_S para no perder filas confirmadas fuera de orden) y reemplaza
+solo los que cambiaron. Un solo proceso escribe, en el host que sirve las
+búsquedas: `--sync --follow N` como servicio, o bien process_sync.py
+--sync-local-search en ese mismo host cuando no hay servicio (process_sync.py
+no escribe en el índice sin esa opción). Las búsquedas leen en paralelo
+gracias a WAL. No hay tarea de Celery beat: correría en cualquier worker y no
+en el host del índice.
+
+Configuración por variables de entorno:
+  OCR_SEARCH_DB               archivo SQLite; sin él el módulo está desactivado
+
+Uso:
+    python local_search.py --sync                      # alimentar desde MariaDB
+    python local_search.py --sync --follow 60          # servicio del host de búsqueda
+    python local_search.py "licitación pública" --folder 2009/obras --page 2
+    python local_search.py '"acta de entrega" puente*'
+"""
+import argparse
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+import pymysql
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+SYNC_BATCH = 500
+# Filas con ocr_finished_at dentro de este margen se vuelven a leer en cada
+# sincronización (transacciones confirmadas después de otras más nuevas)
+SYNC_OVERLAP_S = 120
+SNIPPET_TOKENS = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+  node_id INTEGER PRIMARY KEY,
+  path TEXT NOT NULL,
+  pages INTEGER,
+  profile TEXT,
+  ocr_finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_docs_path ON docs (path);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(text, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def db_path():
+    value = os.environ.get('OCR_SEARCH_DB')
+    return Path(value) if value else None
+
+
+def enabled():
+    return db_path() is not None
+
+
+def connect(path=None):
+    """Conexión SQLite con el esquema creado y ajustes de lectura rápida"""
+    path = Path(path) if path else db_path()
+    if path is None:
+        raise RuntimeError('OCR_SEARCH_DB no definido')
+    conn = sqlite3.connect(str(path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA mmap_size=1073741824')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _meta(conn, name, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE name=?', (name,)).fetchone()
+    return row['value'] if row else default
+
+
+def _set_meta(conn, name, value):
+    conn.execute('INSERT INTO meta (name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value=excluded.value', (name, str(value)))
+
+
+def _fmt(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else value
+
+
+# --- Escritura -----------------------------------------------------------------
+
+def upsert(conn, node_id, path, text, pages=None, profile=None, ocr_finished_at=None):
+    """Reemplaza el documento del nodo (sin commit)"""
+    conn.execute('DELETE FROM docs_fts WHERE rowid=?', (node_id,))
+    conn.execute('INSERT INTO docs_fts (rowid, text) VALUES (?, ?)', (node_id, text or ''))
+    conn.execute(
+        """INSERT INTO docs (node_id, path, pages, profile, ocr_finished_at) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(node_id) DO UPDATE SET path=excluded.path, pages=excluded.pages,
+             profile=excluded.profile, ocr_finished_at=excluded.ocr_finished_at""",
+        (node_id, str(path).replace('\\', '/'), pages, profile, _fmt(ocr_finished_at))
+    )
+
+
+def delete(conn, node_ids):
+    """Quita nodos del índice (sin commit)"""
+    for node_id in node_ids:
+        conn.execute('DELETE FROM docs_fts WHERE rowid=?', (node_id,))
+        conn.execute('DELETE FROM docs WHERE node_id=?', (node_id,))
+
+
+def sync(conn, db_conf, log=None):
+    """
+    Trae de MariaDB los nodos 'done' nuevos o reprocesados desde la última marca.
+
+    Returns:
+        dict: {'read': filas leídas, 'updated': documentos reemplazados}
+    """
+    mark = _meta(conn, 'sync_finished_at', '1970-01-01 00:00:00')
+    since = datetime.strptime(mark, '%Y-%m-%d %H:%M:%S') - timedelta(seconds=SYNC_OVERLAP_S)
+    last = (since, 0)
+    totals = {'read': 0, 'updated': 0}
+    my = pymysql.connect(**db_conf)
+    try:
+        while True:
+            # Keyset por (ocr_finished_at, node_id): sin OFFSET ni cursor abierto
+            with my.cursor() as cur:
+                cur.execute(
+                    """SELECT p.node_id, n.path, p.ocr_text, p.pages, p.ocr_profile, p.ocr_finished_at
+                       FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+                       WHERE p.ocr_status='done' AND p.ocr_finished_at IS NOT NULL
+                         AND (p.ocr_finished_at > %s OR (p.ocr_finished_at = %s AND p.node_id > %s))
+                       ORDER BY p.ocr_finished_at, p.node_id
+                       LIMIT %s""",
+                    (last[0], last[0], last[1], SYNC_BATCH)
+                )
+                rows = cur.fetchall()
+            my.commit()
+            if not rows:
+                break
+            known = {r['node_id']: r['ocr_finished_at'] for r in conn.execute(
+                f"SELECT node_id, ocr_finished_at FROM docs WHERE node_id IN ({','.join('?' * len(rows))})",
+                [r['node_id'] for r in rows])}
+            updated = totals['updated']
+            for r in rows:
+                if known.get(r['node_id']) == _fmt(r['ocr_finished_at']):
+                    continue    # ya indexado en esta versión (margen de solapamiento)
+                upsert(conn, r['node_id'], r['path'], r['ocr_text'], r['pages'], r['ocr_profile'],
+                       r['ocr_finished_at'])
+                totals['updated'] += 1
+            last = (rows[-1]['ocr_finished_at'], rows[-1]['node_id'])
+            if totals['updated'] > updated:
+                _bump_generation(conn)
+            totals['read'] += len(rows)
+            if _fmt(last[0]) > mark:
+                mark = _fmt(last[0])
+            _set_meta(conn, 'sync_finished_at', mark)
+            conn.commit()
+            if log:
+                log(f"  {totals['read']} leídos, {totals['updated']} actualizados (hasta {mark})")
+    finally:
+        my.close()
+    if totals['updated'] > 10000:
+        # Tras una carga grande, fusionar los segmentos del índice acelera las consultas
+        conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('optimize')")
+        conn.commit()
+    return totals
+
+
+def prune(conn, db_conf):
+    """Quita del índice los nodos que ya no están 'done' en MariaDB (borrados o reencolados)"""
+    my = pymysql.connect(**db_conf)
+    try:
+        with my.cursor() as cur:
+            cur.execute("SELECT node_id FROM pdf_metadata WHERE ocr_status='done'")
+            done = {r['node_id'] for r in cur.fetchall()}
+    finally:
+        my.close()
+    stale = [r['node_id'] for r in conn.execute('SELECT node_id FROM docs') if r['node_id'] not in done]
+    delete(conn, stale)
+    if stale:
+        _bump_generation(conn)
+    conn.commit()
+    return len(stale)
+
+
+# --- Consulta ------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def query_terms(text):
+    """
+    Términos de la consulta del usuario: [(texto, es_prefijo)]. Las frases van
+    entre comillas; una palabra con * final es un prefijo.
+    """
+    terms = []
+    for phrase, word in _TOKEN_RE.findall(text or ''):
+        if phrase:
+            phrase = ' '.join(phrase.split())
+            if phrase:
+                terms.append((phrase, False))
+            continue
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '')
+        if word:
+            terms.append((word, prefix))
+    return terms
+
+
+def fts_query(text):
+    """
+    Convierte la consulta del usuario en una expresión FTS5 segura (todos los
+    términos obligatorios). Sin esto, caracteres como - : ( rompen la
+    sintaxis de MATCH.
+    """
+    return ' '.join(f'"{t}"' + ('*' if prefix else '') for t, prefix in query_terms(text))
+
+
+def folder_range(folder):
+    """Rango [desde, hasta) de rutas bajo la carpeta ('/' + 1 = '0')"""
+    folder = folder.replace('\\', '/').strip('/')
+    return folder + '/', folder + '0'
+
+
+def search(conn, query, folder=None, limit=20, page=1, after=None, with_text=False):
+    """
+    Documentos que contienen todos los términos, ordenados por bm25 y node_id.
+
+    after=(score, node_id) del último resultado pagina por keyset (ignora
+    page): la página siguiente no depende de cuántas filas haya antes. El
+    snippet y el texto se piden solo para los resultados de la página.
+
+    Returns:
+        dict: {'hits': [{'node_id', 'path', 'pages', 'score', 'snippet'[, 'text']}],
+               'page', 'has_more', 'ms'}
+    """
+    match = fts_query(query)
+    if not match:
+        return {'hits': [], 'page': page, 'has_more': False, 'ms': 0.0}
+    where = ['docs_fts MATCH ?']
+    params = [match]
+    if folder:
+        where.append('d.path >= ? AND d.path < ?')
+        params.extend(folder_range(folder))
+    outer = ''
+    offset = (max(1, page) - 1) * limit
+    if after is not None:
+        outer = 'WHERE score > ? OR (score = ? AND node_id > ?)'
+        params.extend([after[0], after[0], after[1]])
+        offset = 0
+    t0 = time.perf_counter()
+    rows = conn.execute(
+        f"""SELECT * FROM (
+                SELECT d.node_id, d.path, d.pages, bm25(docs_fts) AS score
+                FROM docs_fts JOIN docs d ON d.node_id = docs_fts.rowid
+                WHERE {' AND '.join(where)}
+            ) {outer}
+            ORDER BY score, node_id
+            LIMIT ? OFFSET ?""",
+        params + [limit + 1, offset]
+    ).fetchall()
+    hits = [dict(r) for r in rows[:limit]]
+    if hits:
+        ids = [h['node_id'] for h in hits]
+        extra = ', text' if with_text else ''
+        found = {r['rowid']: r for r in conn.execute(
+            f"""SELECT rowid, snippet(docs_fts, 0, '[', ']', '…', {SNIPPET_TOKENS}) AS snippet{extra}
+                FROM docs_fts WHERE docs_fts MATCH ? AND rowid IN ({','.join('?' * len(ids))})""",
+            [match] + ids)}
+        for h in hits:
+            r = found.get(h['node_id'])
+            h['snippet'] = r['snippet'] if r else ''
+            if with_text:
+                h['text'] = r['text'] if r else ''
+    return {'hits': hits, 'page': page, 'has_more': len(rows) > limit,
+            'ms': round((time.perf_counter() - t0) * 1000, 1)}
+
+
+def generation(conn):
+    """Contador que cambia con cada escritura al índice (invalida cachés de resultados)"""
+    return int(_meta(conn, 'generation', 0))
+
+
+def _bump_generation(conn):
+    _set_meta(conn, 'generation', generation(conn) + 1)
+
+
+def stats(conn):
+    row = conn.execute('SELECT COUNT(*) AS docs, COALESCE(SUM(pages), 0) AS pages FROM docs').fetchone()
+    return {'docs': row['docs'], 'pages': row['pages'], 'synced_until': _meta(conn, 'sync_finished_at')}
+
+
+def main():
+    p = argparse.ArgumentParser(description='Búsqueda de texto completo local (SQLite FTS5)')
+    p.add_argument('query', nargs='?', help='términos, "frases" y prefijos*')
+    p.add_argument('--folder', default=None, help='limitar a una carpeta (subárbol), p. ej. 2009/obras')
+    p.add_argument('--limit', type=int, default=20, help='resultados por página (default: 20)')
+    p.add_argument('--page', type=int, default=1, help='página de resultados (default: 1)')
+    p.add_argument('--sync', action='store_true', help='traer de MariaDB los documentos nuevos o reprocesados')
+    p.add_argument('--follow', type=float, default=None, metavar='SEGUNDOS', help='con --sync: repetir cada N segundos')
+    p.add_argument('--prune', action='store_true', help='quitar del índice los nodos que ya no están done')
+    p.add_argument('--db', default=None, help='archivo SQLite (default: OCR_SEARCH_DB)')
+    args = p.parse_args()
+
+    if not (args.db or enabled()):
+        print('Definir OCR_SEARCH_DB (o --db) con la ruta del índice SQLite')
+        return
+    conn = connect(args.db)
+    try:
+        if args.prune:
+            print(f"{prune(conn, DB_CONF)} nodos quitados del índice")
+        if args.sync:
+            while True:
+                totals = sync(conn, DB_CONF, log=print)
+                print(f"Sincronizado: {totals['updated']} documentos actualizados")
+                if not args.follow:
+                    break
+                time.sleep(args.follow)
+        if args.query:
+            result = search(conn, args.query, args.folder, args.limit, args.page)
+            for h in result['hits']:
+                print(f"{h['score']:8.2f}  node={h['node_id']}  {h['path']}")
+                print(f"          {' '.join(h['snippet'].split())}")
+            more = ', hay más (--page {})'.format(args.page + 1) if result['has_more'] else ''
+            print(f"\n{len(result['hits'])} resultados en {result['ms']} ms (página {args.page}{more})")
+        elif not (args.sync or args.prune):
+            s = stats(conn)
+            print(f"{s['docs']} documentos, {s['pages']} páginas; sincronizado hasta {s['synced_until']}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -34,19 +34,177 @@ CREATE TABLE IF NOT EXISTS pdf_metadata (
   text_found TINYINT(1) DEFAULT 0,
   ocr_status ENUM('pending','processing','done','failed') DEFAULT 'pending',
   ocr_provider VARCHAR(100) NULL,
+  ocr_settings CHAR(64) NULL,
+  ocr_profile VARCHAR(20) NULL,
+  blank_pages INT NULL,
+  encrypted TINYINT(1) NULL,
+  est_ocr_cost FLOAT NULL,
+  preflight_at DATETIME NULL,
+  lease_owner VARCHAR(100) NULL,
+  lease_expires_at DATETIME NULL,
+  heartbeat_at DATETIME NULL,
   ocr_pdf_path VARCHAR(2000) NULL,
   ocr_text LONGTEXT NULL,
   snippet VARCHAR(1000) NULL,
   last_error TEXT NULL,
   ocr_started_at DATETIME NULL,
   ocr_finished_at DATETIME NULL,
+  indexed_at DATETIME NULL,
+  index_error VARCHAR(500) NULL,
+  index_attempts SMALLINT NOT NULL DEFAULT 0,
   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
   updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   UNIQUE KEY uq_pdf_node (node_id),
   KEY idx_pdf_status (ocr_status),
+  KEY idx_pdf_lease (ocr_status, lease_expires_at),
+  KEY idx_pdf_finished (ocr_finished_at),
+  KEY idx_pdf_indexed (ocr_status, indexed_at),
   CONSTRAINT fk_pdf_node FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE,
   CONSTRAINT fk_pdf_content FOREIGN KEY (content_id) REFERENCES contents(id) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- Columnas agregadas después del esquema inicial (bases existentes)
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS ocr_settings CHAR(64) NULL AFTER ocr_provider;
+-- Perfil de salida usado (archive/fast/text-only), ver ocr_pipeline.OUTPUT_PROFILES
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS ocr_profile VARCHAR(20) NULL AFTER ocr_settings;
+-- Páginas en blanco excluidas del OCR (blank_pages.py)
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS blank_pages INT NULL AFTER ocr_profile;
+-- Pre-flight (preflight.py): cifrado, costo estimado de OCR en segundos y fecha del perfil
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS encrypted TINYINT(1) NULL AFTER blank_pages;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS est_ocr_cost FLOAT NULL AFTER encrypted;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS preflight_at DATETIME NULL AFTER est_ocr_cost;
+-- Lease del proceso que tiene el nodo en 'processing' (lease.py)
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100) NULL AFTER preflight_at;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS lease_expires_at DATETIME NULL AFTER lease_owner;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS heartbeat_at DATETIME NULL AFTER lease_expires_at;
+CREATE INDEX IF NOT EXISTS idx_pdf_lease ON pdf_metadata (ocr_status, lease_expires_at);
+-- Throughput en ventana móvil (monitor_progress.py)
+CREATE INDEX IF NOT EXISTS idx_pdf_finished ON pdf_metadata (ocr_finished_at);
+-- Estado de indexación en OpenSearch (search_index.py): falta indexar si
+-- indexed_at es NULL o anterior a ocr_finished_at
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS indexed_at DATETIME NULL AFTER ocr_finished_at;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS index_error VARCHAR(500) NULL AFTER indexed_at;
+ALTER TABLE pdf_metadata ADD COLUMN IF NOT EXISTS index_attempts SMALLINT NOT NULL DEFAULT 0 AFTER index_error;
+CREATE INDEX IF NOT EXISTS idx_pdf_indexed ON pdf_metadata (ocr_status, indexed_at);
+
+-- Datos por página. content_hash se guarda tras cada OCR para el OCR incremental,
+-- is_blank marca páginas excluidas del OCR por estar en blanco, el resto lo
+-- completa el pre-flight (preflight.py), est_cost en segundos estimados de OCR
+CREATE TABLE IF NOT EXISTS pdf_pages (
+  node_id BIGINT NOT NULL,
+  page_no INT NOT NULL,
+  content_hash CHAR(64) NULL,
+  is_blank TINYINT(1) NULL,
+  has_text TINYINT(1) NULL,
+  image_count SMALLINT NULL,
+  image_dpi SMALLINT NULL,
+  is_color TINYINT(1) NULL,
+  est_cost FLOAT NULL,
+  PRIMARY KEY (node_id, page_no),
+  CONSTRAINT fk_pages_node FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Columnas del pre-flight (bases existentes)
+ALTER TABLE pdf_pages ADD COLUMN IF NOT EXISTS has_text TINYINT(1) NULL AFTER is_blank;
+ALTER TABLE pdf_pages ADD COLUMN IF NOT EXISTS image_count SMALLINT NULL AFTER has_text;
+ALTER TABLE pdf_pages ADD COLUMN IF NOT EXISTS image_dpi SMALLINT NULL AFTER image_count;
+ALTER TABLE pdf_pages ADD COLUMN IF NOT EXISTS is_color TINYINT(1) NULL AFTER image_dpi;
+ALTER TABLE pdf_pages ADD COLUMN IF NOT EXISTS est_cost FLOAT NULL AFTER is_color;
+
+-- Caché de resultados OCR por (checksum, opciones de ocrmypdf, versión del motor).
+-- Los artefactos viven en OCR_CACHE_DIR (ver ocr_cache.py)
+CREATE TABLE IF NOT EXISTS ocr_cache (
+  cache_key CHAR(64) NOT NULL PRIMARY KEY,
+  checksum CHAR(64) NOT NULL,
+  settings JSON NULL,
+  pdf_path VARCHAR(2000) NOT NULL,
+  text_path VARCHAR(2000) NULL,
+  size_bytes BIGINT NOT NULL DEFAULT 0,
+  hits INT NOT NULL DEFAULT 0,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  KEY idx_cache_checksum (checksum),
+  KEY idx_cache_last_used (last_used_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Contadores por estado y carpeta de primer nivel (documentos y páginas), mantenidos
+-- por triggers en la misma transacción que cada cambio de estado (ver status_counts.py).
+-- Los triggers no se disparan con ON DELETE CASCADE: tras crear la tabla en una base
+-- existente, o para corregir deriva, ejecutar `python status_counts.py --rebuild`.
+-- El esquema se aplica en cada escaneo: los triggers se crean solo si faltan (sin
+-- DROP, que dejaría una ventana sin contar cambios de estado). Para cambiar el
+-- cuerpo de un trigger, crearlo con otro nombre y borrar el anterior a mano.
+CREATE TABLE IF NOT EXISTS ocr_status_counts (
+  top_folder VARCHAR(255) NOT NULL,
+  ocr_status VARCHAR(20) NOT NULL,
+  cnt BIGINT NOT NULL DEFAULT 0,
+  pages BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (top_folder, ocr_status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+ALTER TABLE ocr_status_counts ADD COLUMN IF NOT EXISTS pages BIGINT NOT NULL DEFAULT 0 AFTER cnt;
+
+CREATE TRIGGER IF NOT EXISTS trg_pdf_counts_ins AFTER INSERT ON pdf_metadata FOR EACH ROW
+  INSERT INTO ocr_status_counts (top_folder, ocr_status, cnt, pages)
+  SELECT IF(LOCATE('/', n.path) > 0, SUBSTRING_INDEX(n.path, '/', 1), ''), COALESCE(NEW.ocr_status, ''), 1, COALESCE(NEW.pages, 0)
+  FROM nodes n WHERE n.id = NEW.node_id
+  ON DUPLICATE KEY UPDATE cnt = cnt + 1, pages = pages + VALUES(pages);
+
+CREATE TRIGGER IF NOT EXISTS trg_pdf_counts_upd AFTER UPDATE ON pdf_metadata FOR EACH ROW
+  INSERT INTO ocr_status_counts (top_folder, ocr_status, cnt, pages)
+  SELECT f.top_folder, s.ocr_status, s.delta, s.pages
+  FROM (SELECT IF(LOCATE('/', n.path) > 0, SUBSTRING_INDEX(n.path, '/', 1), '') AS top_folder FROM nodes n WHERE n.id = NEW.node_id) f
+  JOIN (SELECT COALESCE(OLD.ocr_status, '') AS ocr_status, -1 AS delta, -COALESCE(OLD.pages, 0) AS pages
+        UNION ALL SELECT COALESCE(NEW.ocr_status, ''), 1, COALESCE(NEW.pages, 0)) s
+  WHERE NOT (OLD.ocr_status <=> NEW.ocr_status) OR NOT (OLD.pages <=> NEW.pages)
+  ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt), pages = pages + VALUES(pages);
+
+CREATE TRIGGER IF NOT EXISTS trg_pdf_counts_del AFTER DELETE ON pdf_metadata FOR EACH ROW
+  INSERT INTO ocr_status_counts (top_folder, ocr_status, cnt, pages)
+  SELECT IF(LOCATE('/', n.path) > 0, SUBSTRING_INDEX(n.path, '/', 1), ''), COALESCE(OLD.ocr_status, ''), -1, -COALESCE(OLD.pages, 0)
+  FROM nodes n WHERE n.id = OLD.node_id
+  ON DUPLICATE KEY UPDATE cnt = cnt - 1, pages = pages + VALUES(pages);
+
+-- Tiempos por etapa de cada ejecución de OCR (ms), ver timings.py
+CREATE TABLE IF NOT EXISTS ocr_runs (
+  id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  node_id BIGINT NOT NULL,
+  source VARCHAR(10) NOT NULL,
+  worker VARCHAR(100) NULL,
+  status VARCHAR(10) NOT NULL,
+  mode VARCHAR(12) NULL,
+  profile VARCHAR(20) NULL,
+  pages INT NULL,
+  pages_ocr INT NULL,
+  output_bytes BIGINT NULL,
+  est_mem_mb INT NULL,
+  peak_rss_mb INT NULL,
+  queue_ms INT NULL,
+  read_ms INT NULL,
+  prep_ms INT NULL,
+  ocr_ms INT NULL,
+  text_ms INT NULL,
+  publish_ms INT NULL,
+  db_ms INT NULL,
+  total_ms INT NULL,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  KEY idx_runs_node (node_id),
+  KEY idx_runs_status (status, id),
+  KEY idx_runs_created (created_at),
+  CONSTRAINT fk_runs_node FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+ALTER TABLE ocr_runs ADD COLUMN IF NOT EXISTS worker VARCHAR(100) NULL AFTER source;
+CREATE INDEX IF NOT EXISTS idx_runs_created ON ocr_runs (created_at);
+-- Memoria estimada por la admisión y pico de RSS medido (ver admission.py)
+ALTER TABLE ocr_runs ADD COLUMN IF NOT EXISTS est_mem_mb INT NULL AFTER output_bytes;
+ALTER TABLE ocr_runs ADD COLUMN IF NOT EXISTS peak_rss_mb INT NULL AFTER est_mem_mb;
+
+-- Estado global clave/valor (p. ej. política de cola activa, ver scheduling.py)
+CREATE TABLE IF NOT EXISTS ocr_state (
+  name VARCHAR(64) NOT NULL PRIMARY KEY,
+  value VARCHAR(255) NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- Opcional: FULLTEXT index si solo MariaDB se va a usar para búsqueda
 -- ALTER TABLE pdf_metadata ADD FULLTEXT KEY ft_ocr (ocr_text);
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Métricas en formato de texto de Prometheus para workers y herramientas.
+
+Cada proceso (hijo de Celery, process_sync, scanner, encolador) mantiene sus
+métricas en memoria y las escribe periódicamente en OCR_METRICS_DIR como
+`<grupo>_<rol>_<host>_<pid>.prom`, el formato del textfile collector de
+node_exporter. Con OCR_METRICS_PORT, el proceso principal (el worker de
+Celery o la herramienta) sirve además en http://127.0.0.1:<puerto>/metrics
+la unión de los archivos de su grupo (OCR_METRICS_GROUP, start_workers.py
+usa el nombre del worker): así los hijos del pool prefork, que no pueden
+compartir un puerto, quedan expuestos en un solo endpoint. Todas las series
+llevan las etiquetas role y worker (host:pid).
+
+Métricas principales:
+  ocr_tasks_started_total / ocr_tasks_succeeded_total{mode} /
+  ocr_tasks_failed_total{error}     tareas por resultado y clase de error
+  ocr_pages_total                   páginas OCR (rate() = páginas/s)
+  ocr_stage_seconds{stage}          histograma por etapa (ver timings.py)
+  ocr_backlog_documents{status}     documentos por estado (ocr_status_counts)
+  ocr_db_connections_open           conexiones MariaDB abiertas del proceso
+  ocr_process_rss_bytes             memoria residente del proceso
+
+Se activa definiendo OCR_METRICS_DIR y/o OCR_METRICS_PORT; sin ellas todas
+las funciones son no-ops baratas. OCR_METRICS_PORT es por proceso (un puerto
+distinto por worker, ver start_workers.py --metrics-port): no debe ir en .env,
+porque cada herramienta intentaría abrir el mismo puerto. Los hijos prefork
+salen sin atexit, así que tasks.py vuelca sus métricas en
+worker_process_shutdown. Sin dependencias externas (psutil opcional
+para la RSS).
+"""
+import atexit
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pymysql
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+FAMILIES = {
+    'ocr_tasks_started_total': ('counter', 'Tareas de OCR iniciadas', None),
+    'ocr_tasks_succeeded_total': ('counter', 'Tareas de OCR terminadas con éxito', None),
+    'ocr_tasks_failed_total': ('counter', 'Tareas de OCR fallidas por clase de error', None),
+    'ocr_tasks_skipped_total': ('counter', 'Tareas abandonadas (nodo reclamado por otro proceso)', None),
+    'ocr_admission_total': ('counter', 'Decisiones de admisión por memoria (run, defer, reroute)', None),
+    'ocr_pages_total': ('counter', 'Páginas procesadas por ocrmypdf', None),
+    'ocr_output_bytes_total': ('counter', 'Bytes de PDF OCR publicados', None),
+    'ocr_stage_seconds': ('histogram', 'Duración por etapa del pipeline OCR', STAGE_BUCKETS),
+    'ocr_backlog_documents': ('gauge', 'Documentos por estado de OCR', None),
+    'ocr_enqueued_total': ('counter', 'Documentos encolados en Celery', None),
+    'ocr_index_documents_total': ('counter', 'Documentos enviados a OpenSearch por resultado (indexed, failed)', None),
+    'ocr_index_retries_total': ('counter', 'Documentos reenviados a OpenSearch por contrapresión', None),
+    'ocr_scan_files_total': ('counter', 'PDFs recorridos por el scanner', None),
+    'ocr_db_connections_open': ('gauge', 'Conexiones MariaDB abiertas en el proceso', None),
+    'ocr_db_connections_opened_total': ('counter', 'Conexiones MariaDB abiertas desde el inicio', None),
+    'ocr_process_rss_bytes': ('gauge', 'Memoria residente del proceso', None),
+    'ocr_process_start_time_seconds': ('gauge', 'Inicio del proceso (epoch)', None),
+}
+
+_lock = threading.Lock()
+_values = {}        # (familia, etiquetas) -> valor | [buckets..., suma, cuenta]
+_state = {'role': None, 'started': time.time(), 'flusher': None}
+
+
+def enabled():
+    return bool(os.environ.get('OCR_METRICS_DIR') or os.environ.get('OCR_METRICS_PORT'))
+
+
+def metrics_dir():
+    return Path(os.environ.get('OCR_METRICS_DIR') or Path(tempfile.gettempdir()) / 'ocr_metrics')
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not enabled():
+        return
+    with _lock:
+        k = _key(name, labels)
+        _values[k] = _values.get(k, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not enabled():
+        return
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    if not enabled():
+        return
+    buckets = FAMILIES[name][2]
+    with _lock:
+        k = _key(name, labels)
+        h = _values.setdefault(k, [0] * len(buckets) + [0.0, 0])
+        for i, le in enumerate(buckets):
+            if value <= le:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+# --- Eventos del pipeline ---------------------------------------------------
+
+def task_started(source):
+    inc('ocr_tasks_started_total', source=source)
+
+
+def task_skipped(source):
+    inc('ocr_tasks_skipped_total', source=source)
+
+
+def record_run(source, status, timer=None, result=None, error=None):
+    """Registra el resultado de una ejecución y sus tiempos por etapa (timings.StageTimer)"""
+    result = result or {}
+    if status == 'done':
+        inc('ocr_tasks_succeeded_total', source=source, mode=result.get('mode') or 'unknown')
+        inc('ocr_pages_total', result.get('pages_ocr') or 0, source=source)
+        inc('ocr_output_bytes_total', result.get('output_bytes') or 0, source=source)
+    else:
+        inc('ocr_tasks_failed_total', source=source, error=error or 'unknown')
+    if timer is not None:
+        for stage, ms in timer.ms.items():
+            observe('ocr_stage_seconds', ms / 1000.0, stage=stage)
+        observe('ocr_stage_seconds', timer.total_ms() / 1000.0, stage='total')
+
+
+def set_backlog(stats):
+    """stats: {estado: cantidad} (status_counts.read_counts)"""
+    for status, cnt in stats.items():
+        set_gauge('ocr_backlog_documents', cnt, status=status)
+
+
+class _TrackedConnection(pymysql.connections.Connection):
+    """Conexión pymysql que lleva la cuenta de conexiones abiertas del proceso"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        inc('ocr_db_connections_opened_total')
+        inc('ocr_db_connections_open')
+
+    def close(self):
+        was_open = self.open
+        super().close()
+        if was_open:
+            inc('ocr_db_connections_open', -1)
+
+
+def connect(**conf):
+    """pymysql.connect con conteo de conexiones (métricas activas) o sin él"""
+    if not enabled():
+        return pymysql.connect(**conf)
+    return _TrackedConnection(**conf)
+
+
+# --- Formato de texto --------------------------------------------------------
+
+def _fmt_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _rss_bytes():
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            pass
+    if resource is not None:
+        # Sin psutil: pico de RSS (KiB en Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def render():
+    """Métricas del proceso en formato de texto de Prometheus"""
+    rss = _rss_bytes()
+    if rss is not None:
+        set_gauge('ocr_process_rss_bytes', rss)
+    set_gauge('ocr_process_start_time_seconds', _state['started'])
+
+    const = (('role', _state['role'] or 'tool'), ('worker', f"{socket.gethostname()}:{os.getpid()}"))
+    with _lock:
+        items = sorted(_values.items())
+    lines = []
+    for name, (kind, help_text, buckets) in FAMILIES.items():
+        samples = [(labels, v) for (n, labels), v in items if n == name]
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, v in samples:
+            labels = const + labels
+            if kind != 'histogram':
+                lines.append(f"{name}{_fmt_labels(labels)} {v}")
+                continue
+            for le, count in zip(buckets, v):
+                lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', str(le)),))} {count}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {v[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {v[-2]}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {v[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+    return True
+
+
+def _group():
+    return os.environ.get('OCR_METRICS_GROUP', 'default').replace('_', '-')
+
+
+def _own_file():
+    return metrics_dir() / f"{_group()}_{_state['role'] or 'tool'}_{socket.gethostname()}_{os.getpid()}.prom"
+
+
+def flush():
+    """Escribe el archivo .prom del proceso (rename atómico) y borra los de procesos muertos"""
+    if not enabled():
+        return
+    d = metrics_dir()
+    try:
+        d.mkdir(parents=True, exist_ok=True)
+        target = _own_file()
+        tmp = target.with_suffix('.tmp')
+        tmp.write_text(render(), encoding='utf-8')
+        os.replace(tmp, target)
+        host = socket.gethostname()
+        for f in d.glob(f'*_{host}_*.prom'):
+            try:
+                pid = int(f.stem.rsplit('_', 1)[1])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                f.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def merged_text():
+    """Unión de los .prom del grupo, con HELP/TYPE una vez por familia"""
+    flush()
+    families = {}
+    for f in sorted(metrics_dir().glob(f'{_group()}_*.prom')):
+        try:
+            text = f.read_text(encoding='utf-8')
+        except OSError:
+            continue
+        current = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                current = line.split()[2]
+                fam = families.setdefault(current, {'meta': [], 'samples': []})
+                if line not in fam['meta']:
+                    fam['meta'].append(line)
+            elif line and current:
+                families[current]['samples'].append(line)
+    out = []
+    for fam in families.values():
+        out.extend(fam['meta'])
+        out.extend(fam['samples'])
+    return '\n'.join(out) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = merged_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=None):
+    """Endpoint HTTP en 127.0.0.1 (OCR_METRICS_PORT); devuelve el servidor o None"""
+    port = port or os.environ.get('OCR_METRICS_PORT')
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', int(port)), _Handler)
+    except OSError as e:
+        print(f"Métricas: no se pudo abrir el puerto {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def init(role, interval=None):
+    """
+    Activa el volcado periódico del proceso actual (llamar tras el fork en
+    los hijos de Celery).
+    """
+    _state['role'] = role
+    _state['started'] = time.time()
+    with _lock:
+        _values.clear()     # no heredar contadores del proceso padre
+    if not enabled():
+        return
+    interval = interval or float(os.environ.get('OCR_METRICS_INTERVAL', 15))
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    _state['flusher'] = threading.Thread(target=loop, name='metrics-flush', daemon=True)
+    _state['flusher'].start()
+    atexit.register(flush)
+    flush()
@@ -7,6 +7,13 @@ Uso:
     
     # Actualizar cada 30 segundos
     python monitor_progress.py --interval 30
+    
+    # Velocidad medida sobre los últimos 60 minutos
+    python monitor_progress.py --window 60
+
+La velocidad se mide en páginas/s sobre una ventana móvil de ocr_finished_at
+(no desde que arrancó el monitor), y la ETA divide las páginas pendientes
+(pending + processing) por esa velocidad.
 """
 import argparse
 import os
@@ -15,6 +22,9 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import pymysql
 
+from scheduling import active_policy
+from status_counts import read_counts, read_pages
+
 load_dotenv()
 
 DB_CONF = {
@@ -32,33 +42,68 @@ def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 def get_stats(conn):
-    """Obtiene estadísticas actuales"""
-    with conn.cursor() as cur:
-        cur.execute("SELECT ocr_status, COUNT(*) as cnt FROM pdf_metadata GROUP BY ocr_status")
-        rows = cur.fetchall()
-        stats = {r['ocr_status']: r['cnt'] for r in rows}
-        
-        # Obtener total
-        cur.execute("SELECT COUNT(*) as total FROM pdf_metadata")
-        total = cur.fetchone()['total']
-        
-        return stats, total
+    """Obtiene estadísticas actuales (contadores materializados, ver status_counts.py)"""
+    # Cada refresco es una lectura nueva: cerrar la instantánea de la transacción anterior
+    conn.commit()
+    return read_counts(conn)
 
-def calculate_eta(done, total, start_time, elapsed_seconds):
-    """Calcula tiempo estimado de finalización"""
-    if done == 0:
-        return None, None
+def get_throughput(conn, window_minutes):
+    """
+    Documentos y páginas terminados en la ventana móvil.
     
-    rate = done / elapsed_seconds if elapsed_seconds > 0 else 0  # PDFs por segundo
-    remaining = total - done
+    Si el procesamiento empezó dentro de la ventana, se mide desde el primer
+    documento terminado para no subestimar la velocidad.
     
-    if rate == 0:
+    Returns:
+        dict: {'docs', 'pages', 'seconds', 'pages_per_s', 'docs_per_h'}
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*) as docs, COALESCE(SUM(pages), 0) as pages,
+                   TIMESTAMPDIFF(SECOND, MIN(ocr_finished_at), NOW()) as span
+            FROM pdf_metadata
+            WHERE ocr_status='done' AND ocr_finished_at >= NOW() - INTERVAL %s MINUTE
+        """, (window_minutes,))
+        r = cur.fetchone()
+    seconds = min(window_minutes * 60, max(r['span'] or 0, 60))
+    docs, pages = int(r['docs']), int(r['pages'])
+    return {
+        'docs': docs,
+        'pages': pages,
+        'seconds': seconds,
+        'pages_per_s': pages / seconds if docs else 0.0,
+        'docs_per_h': docs / seconds * 3600 if docs else 0.0,
+    }
+
+def get_worker_rates(conn, window_minutes):
+    """Páginas/s por cola (origen) y worker en la ventana, desde ocr_runs"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT source, COALESCE(worker, '-') as worker, COUNT(*) as docs,
+                       COALESCE(SUM(pages), 0) as pages
+                FROM ocr_runs
+                WHERE status='done' AND created_at >= NOW() - INTERVAL %s MINUTE
+                GROUP BY source, worker
+                ORDER BY pages DESC
+            """, (window_minutes,))
+            rows = cur.fetchall()
+    except pymysql.err.ProgrammingError:
+        return []  # tabla ocr_runs aún no creada
+    seconds = window_minutes * 60
+    for r in rows:
+        r['pages_per_s'] = int(r['pages']) / seconds
+    return rows
+
+def calculate_eta(remaining_pages, pages_per_s):
+    """Calcula tiempo estimado de finalización a partir de páginas restantes y páginas/s"""
+    if not remaining_pages or pages_per_s <= 0:
         return None, None
     
-    eta_seconds = remaining / rate
+    eta_seconds = remaining_pages / pages_per_s
     eta_time = datetime.now() + timedelta(seconds=eta_seconds)
     
-    return eta_time, rate * 3600  # PDFs por hora
+    return eta_time, eta_seconds
 
 def format_time(seconds):
     """Formatea segundos a HH:MM:SS"""
@@ -67,11 +112,10 @@ def format_time(seconds):
     secs = int(seconds % 60)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}"
 
-def monitor(interval=10):
+def monitor(interval=10, window=15):
     """Monitorea el progreso continuamente"""
     conn = pymysql.connect(**DB_CONF)
     start_time = time.time()
-    last_done = 0
     
     try:
         print("\n🚀 Iniciando monitoreo del procesamiento OCR...")
@@ -90,12 +134,11 @@ def monitor(interval=10):
             elapsed = time.time() - start_time
             progress_pct = (done / total * 100) if total > 0 else 0
             
-            # Calcular velocidad instantánea
-            instant_rate = (done - last_done) / interval if interval > 0 else 0
-            instant_rate_hour = instant_rate * 3600
-            
-            # Calcular ETA
-            eta_time, avg_rate = calculate_eta(done, total, start_time, elapsed)
+            # Velocidad en la ventana móvil y páginas restantes
+            rate = get_throughput(conn, window)
+            pages = read_pages(conn)
+            remaining_pages = pages.get('pending', 0) + pages.get('processing', 0)
+            eta_time, eta_seconds = calculate_eta(remaining_pages, rate['pages_per_s'])
             
             print("="*80)
             print(f"  MONITOR DE PROCESAMIENTO OCR - {datetime.now().strftime('%H:%M:%S')}")
@@ -107,6 +150,11 @@ def monitor(interval=10):
             print(f"   Pendientes:        {pending:,}")
             print(f"   En proceso:        {processing}")
             print(f"   Fallidos:          {failed}")
+            print(f"   Páginas restantes: {remaining_pages:,}")
+            policy = active_policy(conn)
+            if policy:
+                print(f"   Política de cola:  {policy['policy']} ({policy['label']}, {policy['source']}, "
+                      f"desde {policy['since']:%Y-%m-%d %H:%M})")
             
             # Barra de progreso
             bar_width = 50
@@ -117,14 +165,22 @@ def monitor(interval=10):
             print(f"\n⏱️  TIEMPO:")
             print(f"   Transcurrido:      {format_time(elapsed)}")
             if eta_time:
-                remaining_seconds = (eta_time - datetime.now()).total_seconds()
-                print(f"   Restante (est):    {format_time(remaining_seconds)}")
+                print(f"   Restante (est):    {format_time(eta_seconds)}")
                 print(f"   ETA:               {eta_time.strftime('%Y-%m-%d %H:%M:%S')}")
+            else:
+                print(f"   ETA:               sin datos en los últimos {window} min")
+            
+            print(f"\n⚡ VELOCIDAD (últimos {window} min):")
+            print(f"   Páginas/s:         {rate['pages_per_s']:.2f}")
+            print(f"   PDFs/hora:         {rate['docs_per_h']:.1f}")
+            print(f"   Terminados:        {rate['docs']:,} PDFs, {rate['pages']:,} páginas")
             
-            print(f"\n⚡ VELOCIDAD:")
-            if avg_rate:
-                print(f"   Promedio:          {avg_rate:.1f} PDFs/hora")
-            print(f"   Actual:            {instant_rate_hour:.1f} PDFs/hora")
+            workers = get_worker_rates(conn, window)
+            if workers:
+                print(f"\n👷 POR COLA / WORKER:")
+                for w in workers:
+                    print(f"   {w['source']:10} {w['worker'][:40]:40} {w['docs']:>6} PDFs "
+                          f"{w['pages_per_s']:>7.2f} pág/s")
             
             if failed > 0:
                 print(f"\n⚠️  ADVERTENCIA: {failed} PDFs fallaron")
@@ -134,8 +190,6 @@ def monitor(interval=10):
             print(f"  Actualizando en {interval} segundos... (Ctrl+C para detener)")
             print("="*80)
             
-            last_done = done
-            
             # Verificar si terminó
             if pending == 0 and processing == 0:
                 print("\n\n🎉 ¡PROCESAMIENTO COMPLETADO!")
@@ -160,9 +214,11 @@ def main():
     parser = argparse.ArgumentParser(description='Monitorear progreso de OCR')
     parser.add_argument('--interval', type=int, default=10,
                         help='Intervalo de actualización en segundos (default: 10)')
+    parser.add_argument('--window', type=int, default=15,
+                        help='Ventana móvil para medir la velocidad, en minutos (default: 15)')
     args = parser.parse_args()
     
-    monitor(args.interval)
+    monitor(args.interval, args.window)
 
 if __name__ == '__main__':
     main()
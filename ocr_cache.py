@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Caché de resultados OCR por contenido y configuración.
+
+La clave es sha256 de (nodes.checksum, opciones de ocrmypdf —incluye el
+idioma y el preprocesado—, versión de ocrmypdf y de tesseract, política de
+DPI de image_prep.py y motor OCR_ENGINE, tesseract o tesserocr). Si cambia
+cualquiera de ellos, la clave cambia y el documento se vuelve a procesar;
+si solo cambia el mtime o se resetea un 'done' a 'pending', el resultado se
+reutiliza sin ejecutar ocrmypdf.
+
+Los artefactos (PDF + texto) se guardan en OCR_CACHE_DIR y se indexan en la
+tabla ocr_cache; al superar OCR_CACHE_MAX_GB se eliminan los menos usados
+recientemente (LRU por last_used_at).
+
+Configuración por variables de entorno:
+  OCR_CACHE           0 para desactivar la caché (default: 1)
+  OCR_CACHE_DIR       directorio de artefactos (default: <tmp>/ocr_cache)
+  OCR_CACHE_MAX_GB    tamaño máximo de la caché en GB (default: 10)
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import pymysql
+
+from scan_transparencia import sha256_of_file
+
+
+def cache_enabled():
+    return os.environ.get('OCR_CACHE', '1') not in ('0', 'false', 'no')
+
+
+def cache_dir():
+    base = os.environ.get('OCR_CACHE_DIR') or str(Path(tempfile.gettempdir()) / 'ocr_cache')
+    path = Path(base)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _tool_version(cmd):
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        return (out.stdout or out.stderr).strip().splitlines()[0]
+    except Exception:
+        return 'unknown'
+
+
+@lru_cache(maxsize=1)
+def engine_version():
+    """Versiones de ocrmypdf y tesseract (se calculan una vez por proceso)"""
+    return f"ocrmypdf {_tool_version(['ocrmypdf', '--version'])}; {_tool_version(['tesseract', '--version'])}"
+
+
+def settings_key(options, extra=None):
+    """
+    Firma de las opciones de ocrmypdf, de la versión del motor y de cualquier
+    otra política que altere el resultado (extra, p.ej. el preprocesado de DPI)
+    """
+    payload = json.dumps({'options': list(options), 'engine': engine_version(), 'extra': extra},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(checksum, options, extra=None):
+    """Clave de caché para un contenido y unas opciones de ocrmypdf"""
+    payload = f"{checksum}:{settings_key(options, extra)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def content_checksum(conn, node_id, src: Path):
+    """
+    Checksum del contenido actual del PDF.
+
+    Usa nodes.checksum si tamaño y mtime coinciden con el archivo en disco;
+    si no (el archivo cambió desde el último escaneo), lo recalcula. Si el
+    contenido resulta igual (archivo solo tocado), se guarda el mtime nuevo
+    para no volver a calcularlo en cada OCR; el escáner solo actualiza mtime
+    cuando cambia el checksum.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT checksum, size, mtime FROM nodes WHERE id=%s", (node_id,))
+        row = cur.fetchone()
+    stat = src.stat()
+    mtime = datetime.fromtimestamp(stat.st_mtime).replace(microsecond=0)
+    if row and row['checksum'] and row['size'] == stat.st_size and row['mtime'] == mtime:
+        return row['checksum']
+    checksum = sha256_of_file(src)
+    if row and row['checksum'] == checksum:
+        # updated_at=updated_at: un simple touch no debe pasar por cambio (pre-flight, etc.)
+        with conn.cursor() as cur:
+            cur.execute("UPDATE nodes SET mtime=%s, size=%s, updated_at=updated_at WHERE id=%s",
+                        (mtime, stat.st_size, node_id))
+        conn.commit()
+    return checksum
+
+
+def _artefact_paths(key):
+    base = cache_dir() / key[:2]
+    return base / f"{key}.pdf", base / f"{key}.txt"
+
+
+def _atomic_write(dest: Path, write):
+    """
+    Escribe con write(ruta temporal) junto a dest y renombra: otro worker que
+    lea la caché a la vez ve el artefacto completo o ninguno
+    (igual que ocr_pipeline.publish)
+    """
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def cache_lookup(conn, key, dest_pdf: Path):
+    """
+    Busca la clave en la caché.
+
+    En un acierto copia el PDF cacheado a dest_pdf (salvo perfiles sin PDF,
+    dest_pdf=None) y devuelve el texto; devuelve None si no hay entrada o sus
+    artefactos ya no existen. Sin la tabla ocr_cache (esquema sin aplicar)
+    se comporta como un fallo de caché.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pdf_path, text_path FROM ocr_cache WHERE cache_key=%s", (key,))
+            row = cur.fetchone()
+    except pymysql.err.ProgrammingError:
+        return None  # tabla aún no creada
+    if not row:
+        return None
+    pdf_path = Path(row['pdf_path']) if row['pdf_path'] else None
+    text_path = Path(row['text_path']) if row['text_path'] else None
+    if text_path and not text_path.exists():
+        return None
+    if dest_pdf is not None:
+        if pdf_path is None or not pdf_path.exists():
+            return None
+        shutil.copyfile(pdf_path, dest_pdf)
+    text = text_path.read_text(encoding='utf-8', errors='ignore') if text_path else ''
+    with conn.cursor() as cur:
+        cur.execute("UPDATE ocr_cache SET hits=hits+1, last_used_at=NOW() WHERE cache_key=%s", (key,))
+    conn.commit()
+    return text
+
+
+def cache_store(conn, key, checksum, options, pdf: Path, text):
+    """
+    Guarda el PDF (None en perfiles sin PDF) y el texto resultantes y aplica
+    la política de tamaño.
+
+    Un fallo de la caché (disco lleno, permisos) no debe hacer fallar el OCR,
+    así que se informa con el valor de retorno en lugar de lanzar.
+    """
+    pdf_dest, text_dest = _artefact_paths(key)
+    try:
+        text_dest.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(text_dest, lambda tmp: tmp.write_text(text or '', encoding='utf-8'))
+        size = text_dest.stat().st_size
+        if pdf is not None:
+            _atomic_write(pdf_dest, lambda tmp: shutil.copyfile(pdf, tmp))
+            size += pdf_dest.stat().st_size
+        else:
+            pdf_dest = ''  # perfil sin PDF de salida (text-only)
+        settings = {'options': list(options), 'engine': engine_version()}  # resumen legible
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO ocr_cache (cache_key, checksum, settings, pdf_path, text_path, size_bytes, hits, created_at, last_used_at)
+                   VALUES (%s,%s,%s,%s,%s,%s,0,NOW(),NOW())
+                   ON DUPLICATE KEY UPDATE pdf_path=VALUES(pdf_path), text_path=VALUES(text_path),
+                       size_bytes=VALUES(size_bytes), last_used_at=NOW()""",
+                (key, checksum, json.dumps(settings), str(pdf_dest), str(text_dest), size)
+            )
+        conn.commit()
+        evict(conn)
+        return True
+    except pymysql.err.ProgrammingError:
+        # tabla ocr_cache aún no creada: sin caché, sin dejar artefactos huérfanos
+        conn.rollback()
+        for p in (pdf_dest, text_dest):
+            if p:
+                Path(p).unlink(missing_ok=True)
+        return False
+    except Exception as e:
+        conn.rollback()
+        print(f"Caché OCR: no se pudo guardar {key[:12]}: {e}")
+        return False
+
+
+def evict(conn, max_bytes=None):
+    """
+    Elimina entradas LRU hasta que la caché quede bajo max_bytes.
+
+    Returns:
+        int: número de entradas eliminadas
+    """
+    if max_bytes is None:
+        max_bytes = float(os.environ.get('OCR_CACHE_MAX_GB', 10)) * (1024**3)
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(SUM(size_bytes), 0) as total FROM ocr_cache")
+        total = int(cur.fetchone()['total'])
+        if total <= max_bytes:
+            return 0
+        cur.execute("SELECT cache_key, pdf_path, text_path, size_bytes FROM ocr_cache ORDER BY last_used_at ASC LIMIT 1000")
+        removed = 0
+        for row in cur.fetchall():
+            if total <= max_bytes:
+                break
+            for p in (row['pdf_path'], row['text_path']):
+                if p:
+                    Path(p).unlink(missing_ok=True)
+            cur.execute("DELETE FROM ocr_cache WHERE cache_key=%s", (row['cache_key'],))
+            total -= row['size_bytes']
+            removed += 1
+    conn.commit()
+    return removed
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Piezas comunes del pipeline OCR usadas por tasks.py y process_sync.py.
+
+ocr_document() encadena las etapas: caché por contenido (ocr_cache.py),
+OCR incremental de páginas agregadas (incremental.py) u OCR completo, con
+páginas en blanco excluidas (blank_pages.py) y ajuste previo de resolución
+(image_prep.py), extracción de texto y publicación atómica.
+
+El OCR se ejecuta en un directorio de trabajo local (scratch, idealmente
+tmpfs o SSD) y el PDF resultante se publica en transparencia_ocr/ con una
+sola copia + rename atómico. Así:
+  - los escritos intermedios de ocrmypdf y el .txt de pdftotext no cruzan la red
+  - un crash nunca deja un PDF a medio escribir en la ruta final
+
+Configuración por variables de entorno:
+  OCR_SCRATCH_DIR          directorio local de trabajo (default: <tmp>/ocr_scratch)
+  OCR_SCRATCH_MAX_AGE_H    horas tras las cuales un directorio huérfano de otro
+                           host se considera abandonado (default: 24)
+"""
+import contextvars
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from cpu_budget import ocrmypdf_jobs_args
+from ocr_cache import cache_enabled, content_checksum, make_cache_key, settings_key, cache_lookup, cache_store
+import incremental
+from blank_pages import blank_settings, detect_blank_pages, pages_arg, save_blank_pages
+from image_prep import prep_settings, prepare_input
+from timings import StageTimer
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+WORKDIR_PREFIX = 'ocr-'
+# Marca que ocrmypdf deja en el sidecar para páginas excluidas con --pages
+_SKIPPED_MARK = re.compile(r'\[OCR skipped on page\(s\) [^\]]*\]\n?')
+PARTIAL_MARKER = '.ocrtmp-'
+
+
+def scratch_root():
+    """Directorio local donde se crean los directorios de trabajo"""
+    base = os.environ.get('OCR_SCRATCH_DIR') or str(Path(tempfile.gettempdir()) / 'ocr_scratch')
+    path = Path(base)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def relative_path(src: Path):
+    """Ruta relativa (posix) de un PDF dentro de transparencia/"""
+    parts = src.parts
+    if 'transparencia' not in parts:
+        raise ValueError(f"No se encontró 'transparencia' en la ruta: {src}")
+    return Path(*parts[parts.index('transparencia')+1:]).as_posix()
+
+
+def mirror_target(src: Path):
+    """Ruta espejo en transparencia_ocr/ para un PDF bajo transparencia/"""
+    parts = src.parts
+    if 'transparencia' not in parts:
+        raise ValueError(f"No se encontró 'transparencia' en la ruta: {src}")
+    idx = parts.index('transparencia')
+    root_parent = Path(*parts[:idx]) if parts[:idx] else Path(src.anchor)
+    rel = Path(*parts[idx+1:])  # ruta relativa dentro de transparencia
+    return root_parent / 'transparencia_ocr' / rel
+
+
+@contextmanager
+def scratch_workdir(node_id=None):
+    """
+    Directorio de trabajo temporal para un documento.
+
+    El nombre incluye host y pid para que cleanup_orphans() pueda distinguir
+    directorios de procesos muertos de los de workers vivos.
+    """
+    host = socket.gethostname().replace('-', '_')
+    prefix = f"{WORKDIR_PREFIX}{host}-{os.getpid()}-{node_id or 'x'}-"
+    workdir = Path(tempfile.mkdtemp(prefix=prefix, dir=scratch_root()))
+    try:
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def publish(tmp_file: Path, final_path: Path):
+    """
+    Publica tmp_file en final_path de forma atómica.
+
+    Si scratch y destino están en el mismo sistema de archivos basta un rename;
+    si no, se copia a un archivo oculto junto al destino y luego se renombra,
+    de modo que los lectores solo ven el archivo completo o nada.
+    """
+    final_path = Path(final_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(tmp_file, final_path)
+        return final_path
+    except OSError:
+        pass  # distinto dispositivo (p.ej. recurso de red): copiar + rename
+
+    partial = final_path.with_name(f".{final_path.name}{PARTIAL_MARKER}{os.getpid()}")
+    try:
+        shutil.copyfile(tmp_file, partial)
+        os.replace(partial, final_path)
+    finally:
+        if partial.exists():
+            partial.unlink(missing_ok=True)
+    return final_path
+
+
+def _pid_alive(pid):
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+    return True
+
+
+def cleanup_orphans(mirror_root=None):
+    """
+    Elimina restos de ejecuciones interrumpidas.
+
+    - Directorios de trabajo en scratch cuyo proceso ya no existe (mismo host)
+      o más antiguos que OCR_SCRATCH_MAX_AGE_H (otros hosts).
+    - Si se indica mirror_root, archivos parciales '.<nombre>.ocrtmp-<pid>'
+      dejados por una copia interrumpida dentro de transparencia_ocr/.
+
+    Returns:
+        int: número de elementos eliminados
+    """
+    host = socket.gethostname().replace('-', '_')
+    max_age = float(os.environ.get('OCR_SCRATCH_MAX_AGE_H', 24)) * 3600
+    now = time.time()
+    removed = 0
+
+    for entry in scratch_root().iterdir():
+        if not entry.name.startswith(WORKDIR_PREFIX):
+            continue
+        fields = entry.name[len(WORKDIR_PREFIX):].split('-')
+        try:
+            owner_host, pid = fields[0], int(fields[1])
+        except (IndexError, ValueError):
+            continue
+        if owner_host == host:
+            orphan = not _pid_alive(pid)
+        else:
+            orphan = now - entry.stat().st_mtime > max_age
+        if orphan:
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+
+    if mirror_root and Path(mirror_root).exists():
+        for partial in Path(mirror_root).rglob(f'.*{PARTIAL_MARKER}*'):
+            try:
+                partial.unlink()
+                removed += 1
+            except OSError:
+                pass
+
+    return removed
+
+
+# Perfiles de salida: cuánto se invierte en el PDF resultante.
+#   archive   = PDF/A + optimización (comportamiento histórico, pasa por Ghostscript)
+#   fast      = PDF normal, sin conversión PDF/A ni optimización
+#   text-only = solo texto (sidecar), sin PDF de salida
+OUTPUT_PROFILES = {
+    'archive': {'options': ['--output-type', 'pdfa', '--optimize', '1'], 'pdf': True},
+    'fast': {'options': ['--output-type', 'pdf', '--optimize', '0'], 'pdf': True},
+    'text-only': {'options': ['--output-type', 'none'], 'pdf': False},
+}
+DEFAULT_PROFILE = 'archive'
+
+
+def resolve_profile(rel_path=None, explicit=None):
+    """
+    Perfil de salida para un documento.
+
+    Prioridad: perfil explícito (argumento de la tarea / CLI) > regla por
+    carpeta en OCR_PROFILE_RULES ('2009/=fast;contratos/=archive', gana el
+    prefijo más largo) > OCR_PROFILE del worker (perfil por cola) > 'archive'.
+    """
+    if explicit:
+        profile = explicit
+    else:
+        profile = os.environ.get('OCR_PROFILE') or DEFAULT_PROFILE
+        rules = os.environ.get('OCR_PROFILE_RULES', '')
+        best = -1
+        for rule in rules.split(';'):
+            if '=' not in rule:
+                continue
+            prefix, rule_profile = (x.strip() for x in rule.split('=', 1))
+            if rel_path and rel_path.startswith(prefix) and len(prefix) > best:
+                profile, best = rule_profile, len(prefix)
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Perfil de salida desconocido: {profile}")
+    return profile
+
+
+def ocrmypdf_options(lang='spa', profile=DEFAULT_PROFILE):
+    """
+    Opciones de ocrmypdf que determinan el resultado (sin --jobs ni rutas).
+
+    Son también parte de la clave de la caché de OCR (ver ocr_cache.py).
+    """
+    return [
+        '--clean',
+        '--remove-background',
+        '--deskew',
+        '-l', lang,
+        *OUTPUT_PROFILES[profile]['options'],
+    ]
+
+
+# Ejecutor alternativo de ocrmypdf/pdftotext para el contexto actual (async_runner.py
+# los lanza desde el event loop): recibe (cmd, timeout) y se comporta como
+# subprocess.run(check=True, capture_output=True, text=True)
+subprocess_runner = contextvars.ContextVar('ocr_subprocess_runner', default=None)
+
+
+def _run(cmd, timeout=None):
+    runner = subprocess_runner.get()
+    if runner is not None:
+        return runner(cmd, timeout)
+    return subprocess.run(cmd, check=True, timeout=timeout, capture_output=True, text=True)
+
+
+def run_ocrmypdf(cmd, timeout=None):
+    """Ejecuta ocrmypdf capturando salida (lanza TimeoutExpired/CalledProcessError)"""
+    return _run(cmd, timeout)
+
+
+ENGINE_PLUGIN = Path(__file__).with_name('tesserocr_engine.py')
+
+# Opciones de ocrmypdf que reciben un valor (para traducirlas a la API Python)
+_VALUE_OPTIONS = {'-l', '--language', '--output-type', '--optimize', '--oversample', '--sidecar',
+                  '--pdf-renderer', '--pages', '--tesseract-timeout', '--skip-big',
+                  '--jpeg-quality', '--png-quality', '--jbig2-threshold', '--tesseract-downsample-above'}
+
+
+def _options_to_kwargs(options):
+    """Traduce la lista de opciones CLI de ocrmypdf a kwargs de ocrmypdf.ocr()"""
+    kwargs = {}
+    it = iter(options)
+    for opt in it:
+        if opt in _VALUE_OPTIONS:
+            value = next(it)
+            name = 'language' if opt in ('-l', '--language') else opt.lstrip('-').replace('-', '_')
+            if name == 'language':
+                value = value.split('+')
+            elif name != 'pages':   # --pages admite rangos ('1-3,5'): se pasa tal cual
+                for cast in (int, float):
+                    try:
+                        value = cast(value)
+                        break
+                    except ValueError:
+                        pass
+            kwargs[name] = value
+        else:
+            kwargs[opt.lstrip('-').replace('-', '_')] = True
+    return kwargs
+
+
+def run_ocrmypdf_inprocess(options, input_pdf, output_pdf, timeout=None):
+    """
+    Ejecuta ocrmypdf en este proceso con el motor persistente (tesserocr_engine.py).
+
+    Las páginas se reparten en hilos (use_threads) para que el pool de
+    instancias de Tesseract sobreviva entre documentos. Los errores de ocrmypdf
+    se convierten en CalledProcessError para que el manejo de errores sea el
+    mismo que con el CLI.
+
+    timeout (OCR_TIMEOUT) se aplica como con el CLI: ocrmypdf corre en un hilo
+    aparte y si no termina a tiempo se lanza TimeoutExpired. Un hilo no se
+    puede matar, así que además se acota cada página a timeout segundos
+    (--tesseract-timeout) para que el hilo abandonado termine pronto.
+    """
+    import ocrmypdf
+
+    kwargs = _options_to_kwargs(options)
+    kwargs.setdefault('pdf_renderer', 'hocr')
+    jobs = ocrmypdf_jobs_args()
+    if jobs:
+        kwargs['jobs'] = int(jobs[1])
+    if timeout:
+        page_timeout = kwargs.get('tesseract_timeout')
+        kwargs['tesseract_timeout'] = timeout if page_timeout is None else min(page_timeout, timeout)
+    cmd = ['ocrmypdf', '--plugin', str(ENGINE_PLUGIN), *options, str(input_pdf), str(output_pdf)]
+    outcome = {}
+
+    def target():
+        try:
+            ocrmypdf.ocr(str(input_pdf), str(output_pdf), plugins=[str(ENGINE_PLUGIN)],
+                         use_threads=True, progress_bar=False, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, name='ocrmypdf-inprocess', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    e = outcome.get('error')
+    if isinstance(e, ocrmypdf.exceptions.ExitCodeException):
+        raise subprocess.CalledProcessError(int(e.exit_code), cmd, stderr=f"{type(e).__name__}: {e}")
+    if e is not None:
+        raise e
+
+
+def extract_text(pdf_path: Path, workdir: Path):
+    """Extrae el texto con pdftotext dentro del directorio de trabajo"""
+    txt_file = Path(workdir) / 'ocr.txt'
+    _run(['pdftotext', str(pdf_path), str(txt_file)])
+    return txt_file.read_text(encoding='utf-8', errors='ignore')
+
+
+def _safe_extract_text(pdf_path, workdir):
+    try:
+        return extract_text(pdf_path, workdir)
+    except Exception:
+        # Si falla pdftotext, continuar sin texto (mejor tener el PDF que nada)
+        return None
+
+
+def ocr_document(conn, node_id, src: Path, out_pdf: Path, workdir: Path, lang='spa', timeout=None,
+                 engine='tesseract', profile=DEFAULT_PROFILE, timer=None, guard=None):
+    """
+    Produce el PDF OCR de src, lo publica en out_pdf y devuelve el resultado.
+
+    engine='tesserocr' usa el plugin de Tesseract persistente en este proceso
+    (ver tesserocr_engine.py); 'tesseract' lanza el CLI de ocrmypdf.
+    profile elige el perfil de salida (OUTPUT_PROFILES); con 'text-only' no se
+    genera ni publica PDF y ocr_pdf_path es None.
+    timer (timings.StageTimer) acumula el tiempo de cada etapa.
+    guard (lease.lease_guard) se llama antes de escribir cualquier resultado
+    (ocr_cache, transparencia_ocr, pdf_pages) y lanza lease.LeaseLost si el
+    nodo ya no es de este proceso.
+
+    Las excepciones de ocrmypdf (TimeoutExpired, CalledProcessError) se propagan
+    para que el llamador registre el fallo.
+
+    Returns:
+        dict: {'ocr_pdf_path', 'ocr_text', 'mode': 'cache'|'incremental'|'full',
+               'pages_ocr': páginas procesadas por ocrmypdf, 'profile',
+               'prep': decisiones de resolución (image_prep.prepare_input),
+               'blank_pages': páginas en blanco detectadas en lo procesado | None,
+               'pages': páginas del documento, 'output_bytes': tamaño del PDF publicado}
+    """
+    src = Path(src)
+    workdir = Path(workdir)
+    work_pdf = workdir / 'ocr.pdf'
+    options = ocrmypdf_options(lang, profile)
+    produces_pdf = OUTPUT_PROFILES[profile]['pdf']
+    # El motor forma parte de la firma: tesserocr y el CLI no dan el mismo resultado
+    policy = {'prep': prep_settings(profile), 'blank': blank_settings(), 'engine': engine}
+    settings = settings_key(options, policy)
+    prep_info = {}
+    blank_info = {}
+    timer = timer or StageTimer()
+    with timer.stage('read'):
+        hashes = incremental.page_hashes(src)
+
+    def ocrmypdf(input_pdf, output_pdf, sidecar=None, first_page=1):
+        """OCR de input_pdf (páginas first_page.. del documento); devuelve páginas procesadas"""
+        total = len(hashes) - first_page + 1 if hashes else None
+        extra = []
+        # Páginas en blanco: se excluyen del OCR con --pages pero quedan en la salida
+        with timer.stage('prep'):
+            blank = detect_blank_pages(input_pdf, workdir, policy['blank']) if total else None
+        if blank is not None:
+            blank_info.update({'blank': blank, 'total': total, 'first_page': first_page})
+            if len(blank) == total:
+                # Nada que reconocer. Sin PDF de salida basta el texto vacío; con PDF se
+                # sigue el camino normal sin OCR (--tesseract-timeout 0) para que la
+                # salida tenga el mismo formato que el resto (PDF/A en archive)
+                if not output_pdf:
+                    Path(sidecar).write_text(incremental.PAGE_BREAK * total, encoding='utf-8')
+                    return 0
+                extra += ['--tesseract-timeout', '0']
+            elif blank:
+                extra += ['--pages', pages_arg(set(range(1, total + 1)) - set(blank))]
+        # Resolución: remuestreo de imágenes sobre OCR_MAX_DPI y/o --oversample
+        with timer.stage('prep'):
+            input_pdf, prep_extra, info = prepare_input(input_pdf, workdir, profile)
+        prep_info.update(info)
+        extra += prep_extra
+        # Sin PDF de salida ocrmypdf exige '-' como destino y el texto va al sidecar
+        if sidecar:
+            extra += ['--sidecar', str(sidecar)]
+        target = str(output_pdf) if output_pdf else '-'
+        with timer.stage('ocr'):
+            if engine == 'tesserocr':
+                run_ocrmypdf_inprocess([*options, *extra], input_pdf, target, timeout)
+            else:
+                run_ocrmypdf(['ocrmypdf', *options, *extra, *ocrmypdf_jobs_args(), str(input_pdf), target], timeout)
+        return total - len(blank or []) if total else None
+
+    def result(ocr_text, mode, pages_ocr):
+        return {
+            'ocr_pdf_path': str(out_pdf) if produces_pdf else None,
+            'ocr_text': ocr_text,
+            'mode': mode,
+            'pages_ocr': pages_ocr,
+            'profile': profile,
+            'prep': prep_info,
+            'blank_pages': len(blank_info['blank']) if blank_info else None,
+            'pages': len(hashes) if hashes else None,
+            'output_bytes': Path(out_pdf).stat().st_size if produces_pdf and Path(out_pdf).exists() else None,
+        }
+
+    # 1. Caché por contenido + opciones: un acierto evita todo el OCR
+    cache_key = None
+    if cache_enabled():
+        with timer.stage('read'):
+            checksum = content_checksum(conn, node_id, src)
+            cache_key = make_cache_key(checksum, options, policy)
+            ocr_text = cache_lookup(conn, cache_key, work_pdf if produces_pdf else None)
+        if ocr_text is not None:
+            if guard:
+                guard()
+            if produces_pdf:
+                with timer.stage('publish'):
+                    publish(work_pdf, out_pdf)
+            with timer.stage('db'):
+                incremental.save_page_hashes(conn, node_id, hashes, settings)
+            return result(ocr_text, 'cache', 0)
+
+    # 2. OCR incremental si las primeras k páginas no cambiaron (requiere PDF)
+    k = 0
+    if produces_pdf:
+        with timer.stage('read'):
+            previous = incremental.load_previous(conn, node_id)
+            k = incremental.reusable_prefix(previous, hashes, settings)
+    if k:
+        tail_ocr = None
+        tail_text = ''
+        if k < len(hashes):
+            with timer.stage('prep'):
+                tail_src = incremental.split_tail(src, k, workdir / 'tail.pdf')
+            tail_ocr = workdir / 'tail_ocr.pdf'
+            pages_ocr = ocrmypdf(tail_src, tail_ocr, first_page=k + 1)
+            with timer.stage('text'):
+                tail_text = _safe_extract_text(tail_ocr, workdir)
+        else:
+            pages_ocr = 0
+        if tail_text is not None:
+            with timer.stage('text'):
+                incremental.splice_pdf(Path(previous['ocr_pdf_path']), k, tail_ocr, work_pdf)
+                ocr_text = incremental.splice_text(previous['ocr_text'], k, tail_text)
+            mode = 'incremental'
+        else:
+            k = 0  # sin texto de las páginas nuevas no se puede empalmar: OCR completo
+
+    # 3. OCR completo
+    if not k:
+        blank_info.clear()
+        if produces_pdf:
+            pages_ocr = ocrmypdf(src, work_pdf)
+            with timer.stage('text'):
+                ocr_text = _safe_extract_text(work_pdf, workdir)
+        else:
+            sidecar = workdir / 'sidecar.txt'
+            pages_ocr = ocrmypdf(src, None, sidecar)
+            with timer.stage('text'):
+                ocr_text = _SKIPPED_MARK.sub('', sidecar.read_text(encoding='utf-8', errors='ignore'))
+        mode = 'full'
+
+    if guard:
+        guard()
+    with timer.stage('publish'):
+        if cache_key and ocr_text is not None:
+            cache_store(conn, cache_key, checksum, options, work_pdf if produces_pdf else None, ocr_text)
+
+        # Publicación atómica: copia + rename en transparencia_ocr
+        if produces_pdf:
+            publish(work_pdf, out_pdf)
+
+    with timer.stage('db'):
+        # Sin texto no se puede empalmar en el futuro: se invalidan los hashes
+        if ocr_text is not None:
+            incremental.save_page_hashes(conn, node_id, hashes, settings)
+        else:
+            incremental.save_page_hashes(conn, node_id, None, None)
+        if blank_info:
+            save_blank_pages(conn, node_id, blank_info['blank'], blank_info['total'], blank_info['first_page'])
+    return result(ocr_text, mode, pages_ocr)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Pre-flight: perfil por página de un PDF antes del OCR.
+
+Hasta ahora lo único que se sabía de un documento antes del OCR era `pages`.
+Este perfil registra, por página, en pdf_pages:
+  has_text     la página ya tiene capa de texto
+  image_count  imágenes dibujadas en la página
+  image_dpi    resolución de la imagen más densa
+  is_color     alguna imagen en color
+  est_cost     costo estimado de OCR en segundos (modelo abajo)
+y por documento, en pdf_metadata: encrypted, est_ocr_cost y preflight_at.
+
+Se ejecuta al escanear (scan_transparencia.py --preflight), como tarea Celery
+(tasks.preflight_pdf) o con este script: --missing perfila solo los nodos sin
+perfil o modificados desde entonces; sin --missing se vuelven a perfilar todos
+(p.ej. tras ajustar el modelo de costo).
+
+    python preflight.py --root C:\\ruta\\a\\transparencia --missing --limit 1000
+
+Modelo de costo: ocrmypdf rasteriza cada página a la resolución efectiva de
+OCR (DPI de la imagen acotado por image_prep: --oversample por abajo y
+remuestreo por arriba), y el tiempo de Tesseract crece con los megapíxeles.
+  est_cost = BASE_PAGE_S + PER_MPIX_S * megapíxeles * (COLOR_FACTOR si color)
+Las páginas solo con texto (sin imágenes) cuestan BASE_PAGE_S.
+"""
+import argparse
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+import pikepdf
+import pymysql
+
+from blank_pages import has_text_layer
+from image_prep import page_image_stats, prep_settings
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+BASE_PAGE_S = 0.8       # rasterizado + preprocesado por página
+PER_MPIX_S = 0.35       # Tesseract por megapíxel a la resolución de OCR
+COLOR_FACTOR = 1.3      # unpaper/limpieza sobre imágenes en color
+
+
+def _page_cost(page, stats, settings):
+    if not stats['images']:
+        return BASE_PAGE_S
+    dpi = stats['max_dpi']
+    if settings['max_dpi'] and dpi > settings['max_dpi']:
+        dpi = settings['target_dpi']
+    if dpi < settings['min_dpi']:
+        dpi = settings['target_dpi']
+    box = page.mediabox
+    area_in2 = abs(float(box[2]) - float(box[0])) * abs(float(box[3]) - float(box[1])) / (72.0 * 72.0)
+    mpix = area_in2 * dpi * dpi / 1e6
+    cost = BASE_PAGE_S + PER_MPIX_S * mpix
+    return round(cost * (COLOR_FACTOR if stats['color'] else 1.0), 2)
+
+
+def profile_pdf(path: Path):
+    """
+    Perfil del documento.
+
+    Returns:
+        dict: {'encrypted': bool, 'est_cost': float|None,
+               'pages': [{'page_no', 'has_text', 'image_count', 'image_dpi',
+                          'is_color', 'est_cost'}]}
+    """
+    settings = prep_settings()
+    try:
+        pdf = pikepdf.open(path)
+    except pikepdf.PasswordError:
+        # Cifrado con contraseña de usuario: no se puede inspeccionar ni hacer OCR
+        return {'encrypted': True, 'est_cost': None, 'pages': []}
+    with pdf:
+        pages = []
+        for page_no, (page, stats) in enumerate(zip(pdf.pages, page_image_stats(pdf)), 1):
+            pages.append({
+                'page_no': page_no,
+                'has_text': has_text_layer(page),
+                'image_count': stats['images'],
+                'image_dpi': stats['max_dpi'] or None,
+                'is_color': stats['color'],
+                'est_cost': _page_cost(page, stats, settings),
+            })
+        return {
+            'encrypted': pdf.is_encrypted,
+            'est_cost': round(sum(p['est_cost'] for p in pages), 2),
+            'pages': pages,
+        }
+
+
+def save_profile(conn, node_id, profile):
+    """Guarda el perfil en pdf_pages y pdf_metadata"""
+    with conn.cursor() as cur:
+        if profile['pages']:
+            cur.executemany(
+                """INSERT INTO pdf_pages (node_id, page_no, has_text, image_count, image_dpi, is_color, est_cost)
+                   VALUES (%s,%s,%s,%s,%s,%s,%s)
+                   ON DUPLICATE KEY UPDATE has_text=VALUES(has_text), image_count=VALUES(image_count),
+                       image_dpi=VALUES(image_dpi), is_color=VALUES(is_color), est_cost=VALUES(est_cost)""",
+                [(node_id, p['page_no'], int(p['has_text']), p['image_count'], p['image_dpi'],
+                  int(p['is_color']), p['est_cost']) for p in profile['pages']]
+            )
+            cur.execute("DELETE FROM pdf_pages WHERE node_id=%s AND page_no>%s", (node_id, len(profile['pages'])))
+        cur.execute(
+            "UPDATE pdf_metadata SET encrypted=%s, est_ocr_cost=%s, preflight_at=NOW() WHERE node_id=%s",
+            (int(profile['encrypted']), profile['est_cost'], node_id)
+        )
+    conn.commit()
+
+
+def preflight_nodes(conn, root: Path, limit=None, missing_only=True):
+    """
+    Perfila los PDFs de la base: con missing_only solo los que aún no tienen
+    pre-flight (o cambiaron desde entonces), si no todos.
+    """
+    where = "WHERE p.preflight_at IS NULL OR p.preflight_at < n.updated_at" if missing_only else ""
+    with conn.cursor() as cur:
+        query = f"""
+            SELECT n.id as node_id, n.path
+            FROM nodes n
+            JOIN pdf_metadata p ON n.id = p.node_id
+            {where}
+            ORDER BY n.id ASC
+        """
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cur.execute(query)
+        rows = cur.fetchall()
+
+    done = 0
+    for r in rows:
+        path = root / r['path']
+        if not path.exists():
+            continue
+        try:
+            save_profile(conn, r['node_id'], profile_pdf(path))
+            done += 1
+        except Exception as e:
+            conn.rollback()
+            print(f"Error perfilando {path}: {e}")
+    return done
+
+
+def main():
+    p = argparse.ArgumentParser(description='Pre-flight de PDFs: perfil por página y costo estimado de OCR')
+    p.add_argument('--root', default='transparencia', help='ruta a la carpeta transparencia')
+    p.add_argument('--missing', action='store_true', help='perfilar solo nodos sin pre-flight o modificados (sin esta opción: todos)')
+    p.add_argument('--limit', type=int, default=None)
+    p.add_argument('--file', default=None, help='mostrar el perfil de un PDF sin tocar la base')
+    args = p.parse_args()
+
+    if args.file:
+        profile = profile_pdf(Path(args.file))
+        print(f"Cifrado: {profile['encrypted']}  Costo estimado: {profile['est_cost']}s")
+        for pg in profile['pages']:
+            print(f"  p{pg['page_no']:>4}  texto={int(pg['has_text'])}  imgs={pg['image_count']}  "
+                  f"dpi={pg['image_dpi'] or '-'}  color={int(pg['is_color'])}  costo={pg['est_cost']}s")
+        return
+
+    root = Path(args.root).resolve()
+    if not root.exists():
+        print('No se encontró la carpeta', root)
+        return
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        done = preflight_nodes(conn, root, args.limit, missing_only=args.missing)
+        print(f"Perfilados: {done}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,21 +6,29 @@ actualiza la tabla pdf_metadata en la base `ocr`.
 
 Uso:
   python process_sync.py --root C:\ruta\a\transparencia --limit 5
+  python process_sync.py --root C:\ruta\a\transparencia --limit 5 --policy sjf
+  # asyncio: 8 documentos en vuelo hasta vaciar los pendientes (ver async_runner.py)
+  python process_sync.py --root C:\ruta\a\transparencia --async --concurrency 8 --limit 0
 
 Requiere: ocrmypdf, tesseract, pdftotext en PATH y conexión DB en .env
+El OCR se ejecuta en OCR_SCRATCH_DIR y se publica de forma atómica en transparencia_ocr/.
 """
 import os
-import subprocess
 import argparse
-import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 import pymysql
 import json
-try:
-    from opensearchpy import OpenSearch
-except Exception:
-    OpenSearch = None
+from ocr_pipeline import scratch_workdir, cleanup_orphans, ocr_document, resolve_profile, OUTPUT_PROFILES
+from scheduling import POLICIES, default_policy, pending_query, record_policy
+from lease import new_token, claim_node, complete_node, heartbeat, lease_guard, LeaseLost
+from timings import StageTimer, save_run
+from profiling import profiled
+from cpu_budget import compute_budget, recommend_slots
+import profiling
+import metrics
+import search_index
+import local_search
 
 load_dotenv()
 
@@ -34,90 +42,141 @@ DB_CONF = {
     'cursorclass': pymysql.cursors.DictCursor,
 }
 
-def find_pending(conn, limit=5):
+def find_pending(conn, limit=5, policy=None):
     with conn.cursor() as cur:
-        cur.execute("SELECT n.id as node_id, n.path as path FROM nodes n JOIN pdf_metadata p ON n.id=p.node_id WHERE p.ocr_status='pending' ORDER BY n.path ASC LIMIT %s", (limit,))
+        cur.execute(*pending_query(policy, limit))
         return cur.fetchall()
 
-def mark_processing(conn, node_id):
-    with conn.cursor() as cur:
-        cur.execute("UPDATE pdf_metadata SET ocr_status='processing', ocr_started_at=NOW(), updated_at=NOW() WHERE node_id=%s", (node_id,))
-    conn.commit()
+def mark_processing(conn, node_id, token):
+    """Reclama el nodo (ver lease.py); False si otro proceso lo tiene"""
+    return claim_node(conn, node_id, token)
 
-def mark_failed(conn, node_id, error):
-    with conn.cursor() as cur:
-        cur.execute("UPDATE pdf_metadata SET ocr_status='failed', last_error=%s, updated_at=NOW() WHERE node_id=%s", (str(error), node_id))
-    conn.commit()
+def mark_failed(conn, node_id, error, token):
+    return complete_node(conn, node_id, token, 'failed', {'last_error': str(error)})
 
-def mark_done(conn, node_id, ocr_pdf_path, ocr_text, snippet):
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE pdf_metadata SET ocr_status='done', ocr_pdf_path=%s, ocr_text=%s, snippet=%s, ocr_finished_at=NOW(), updated_at=NOW() WHERE node_id=%s",
-            (ocr_pdf_path, ocr_text, snippet, node_id)
-        )
-    conn.commit()
+def mark_done(conn, node_id, ocr_pdf_path, ocr_text, snippet, token, profile=None):
+    return complete_node(conn, node_id, token, 'done', {
+        'ocr_pdf_path': ocr_pdf_path, 'ocr_text': ocr_text, 'snippet': snippet, 'ocr_profile': profile,
+    })
 
-def do_ocr(root, rel_path, work_dir, lang='spa'):
+@profiled('do_ocr', node_arg=(5, 'node_id'), path_fn=lambda root, rel_path, *a, **k: rel_path)
+def do_ocr(root, rel_path, work_dir, lang, conn, node_id, engine='tesseract', profile='archive', timer=None,
+           guard=None):
     src = Path(root) / Path(rel_path)
     if not src.exists():
         raise FileNotFoundError(src)
     # mirror structure under transparencia_ocr sibling to root
     root_parent = Path(root).parent
     target_base = root_parent / 'transparencia_ocr'
-    target_path = target_base / Path(rel_path)
-    target_path.parent.mkdir(parents=True, exist_ok=True)
-    out_pdf = target_path
-    # ocrmypdf with cleaning (requires unpaper) and background removal
-    cmd = [
-        'ocrmypdf',
-        '--clean',
-        '--remove-background',
-        '--deskew',
-        '-l', lang,
-        str(src),
-        str(out_pdf)
-    ]
-    subprocess.run(cmd, check=True)
-    # extract text
-    txt_file = out_pdf.with_suffix('.txt')
-    subprocess.run(['pdftotext', str(out_pdf), str(txt_file)], check=True)
-    ocr_text = txt_file.read_text(encoding='utf-8', errors='ignore')
+    out_pdf = target_base / Path(rel_path)
+    # cache / incremental / full OCR in the local work_dir, then atomic publish (only if guard passes)
+    result = ocr_document(conn, node_id, src, out_pdf, Path(work_dir), lang, engine=engine, profile=profile,
+                          timer=timer, guard=guard)
+    ocr_text = result['ocr_text']
     snippet = (ocr_text or '')[:1000]
-    return str(out_pdf), ocr_text, snippet
+    return result['ocr_pdf_path'], ocr_text, snippet, result
+
+
+def index_to_opensearch(node_id, path, ocr_text, pages=None, profile=None):
+    """Encola el documento en el lote _bulk del proceso (ver search_index.py); False si no hay OpenSearch"""
+    return search_index.index_document(DB_CONF, node_id, path, ocr_text, pages, profile)
+
+def sync_local_search(args):
+    """
+    Con --sync-local-search, lleva al índice local (OCR_SEARCH_DB, ver
+    local_search.py) lo procesado en esta ejecución. Es opcional porque el
+    índice admite un solo escritor: usarlo solo en el host de búsqueda y sin
+    `local_search.py --sync --follow` corriendo.
+    """
+    if not args.sync_local_search or not local_search.enabled():
+        return
+    try:
+        conn = local_search.connect()
+        try:
+            totals = local_search.sync(conn, DB_CONF)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'Índice local: error de sincronización: {e}')
+        return
+    if totals['updated']:
+        print(f"Índice local: {totals['updated']} documentos actualizados")
 
+def run_async(root, args):
+    """--async: runner asyncio con --concurrency documentos en vuelo (--limit 0 = todos)"""
+    import async_runner
+    if args.engine != 'tesseract':
+        print('--async requiere --engine tesseract (ocrmypdf como proceso hijo)')
+        return
+    budget = compute_budget(1, args.concurrency or recommend_slots()['slots'])
+    # --jobs de ocrmypdf y OMP_THREAD_LIMIT repartidos entre los slots (si no se fijaron a mano)
+    os.environ.setdefault('OCR_JOBS', str(budget['jobs_per_slot']))
+    os.environ.setdefault('OMP_THREAD_LIMIT', str(budget['omp_thread_limit']))
 
-def index_to_opensearch(node_id, path, ocr_text):
-    url = os.environ.get('OPENSEARCH_URL')
-    if not url or OpenSearch is None:
-        return False
+    metrics.init(async_runner.SOURCE)
+    metrics.serve()
+    conn = metrics.connect(**DB_CONF)
     try:
-        client = OpenSearch([url])
-        idx = os.environ.get('OPENSEARCH_INDEX', 'ocr_documents')
-        doc = {
-            'node_id': node_id,
-            'path': path,
-            'text': ocr_text
-        }
-        client.index(index=idx, body=doc, id=str(node_id))
-        return True
-    except Exception:
-        return False
+        record_policy(conn, args.policy, 'process_sync')
+    finally:
+        conn.close()
+
+    def process_one(conn, node_id, rel, workdir, profile, timer, guard=None):
+        return do_ocr(root, rel, workdir, args.lang, conn, node_id, args.engine, profile, timer, guard)
+
+    print(f"Procesando pendientes con {budget['slots']} documentos en vuelo "
+          f"(--jobs {os.environ['OCR_JOBS']} por documento)...")
+    stats = async_runner.run(
+        process_one, budget['slots'], policy=args.policy, limit=args.limit, queue_size=args.queue_size,
+        job_timeout=args.job_timeout, explicit_profile=args.profile,
+        finish=index_to_opensearch,
+    )
+    search_index.close()
+    sync_local_search(args)
+    if not stats['done'] and not stats['failed'] and not stats['skipped']:
+        print('No hay archivos pendientes.')
+        return
+    print(f"Listo: {stats['done']} OK, {stats['failed']} fallidos, {stats['skipped']} omitidos; "
+          f"{stats['pages']} páginas en {stats.get('seconds', 0)}s ({stats.get('pages_per_s', 0)} páginas/s)")
 
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--root', default=str(Path('..').resolve() / 'transparencia'), help='ruta a carpeta transparencia')
     p.add_argument('--limit', type=int, default=5)
     p.add_argument('--lang', default=os.environ.get('OCR_LANG', 'spa'))
+    p.add_argument('--engine', choices=['tesseract', 'tesserocr'], default=os.environ.get('OCR_ENGINE', 'tesseract'), help='motor OCR: CLI de tesseract o tesserocr persistente')
+    p.add_argument('--profile', choices=sorted(OUTPUT_PROFILES), default=None, help='perfil de salida (default: OCR_PROFILE_RULES/OCR_PROFILE o archive)')
+    p.add_argument('--policy', choices=sorted(POLICIES), default=default_policy(), help='orden de los pendientes: path, sjf, ljf, fair (default: OCR_SCHEDULE o path)')
+    p.add_argument('--clean-mirror-orphans', action='store_true', help='eliminar también copias parciales en transparencia_ocr/ (recorre todo el árbol)')
+    p.add_argument('--async', dest='async_mode', action='store_true', help='procesar con el runner asyncio: varios documentos en vuelo en este proceso (async_runner.py)')
+    p.add_argument('--concurrency', type=int, default=None, help='documentos simultáneos con --async (default: cpu_budget.recommend_slots)')
+    p.add_argument('--queue-size', type=int, default=None, help='filas pendientes en memoria con --async (default: 2 x concurrency)')
+    p.add_argument('--job-timeout', type=int, default=None, help='plazo por documento con --async en segundos (default: OCR_HARD_TIMEOUT o 900)')
+    p.add_argument('--sync-local-search', action='store_true', help='sincronizar OCR_SEARCH_DB al terminar (solo en el host de búsqueda y sin local_search.py --follow; un solo escritor)')
+    profiling.add_arguments(p)
     args = p.parse_args()
+    profiling.configure(args)
 
     root = Path(args.root).resolve()
     if not root.exists():
         print('Root no existe:', root)
         return
 
-    conn = pymysql.connect(**DB_CONF)
+    mirror_root = root.parent / 'transparencia_ocr' if args.clean_mirror_orphans else None
+    removed = cleanup_orphans(mirror_root)
+    if removed:
+        print(f'Limpieza de huérfanos: {removed} eliminados')
+
+    if args.async_mode:
+        run_async(root, args)
+        return
+
+    metrics.init('sync')
+    metrics.serve()
+    conn = metrics.connect(**DB_CONF)
     try:
-        rows = find_pending(conn, args.limit)
+        rows = find_pending(conn, args.limit, args.policy)
+        record_policy(conn, args.policy, 'process_sync')
         if not rows:
             print('No hay archivos pendientes.')
             return
@@ -125,18 +184,42 @@ def main():
         for r in rows:
             node_id = r['node_id']
             rel = r['path']
+            token = new_token()
+            timer = StageTimer()
+            profile = None
             try:
-                mark_processing(conn, node_id)
-                with tempfile.TemporaryDirectory() as td:
-                    ocr_pdf_path, ocr_text, snippet = do_ocr(root, rel, td, args.lang)
-                mark_done(conn, node_id, ocr_pdf_path, ocr_text, snippet)
-                indexed = index_to_opensearch(node_id, rel, ocr_text)
-                print(f'OK node={node_id} path={rel} indexed={indexed}')
+                if not mark_processing(conn, node_id, token):
+                    metrics.task_skipped('sync')
+                    print(f'SKIP node={node_id} path={rel} (reclamado por otro proceso)')
+                    continue
+                metrics.task_started('sync')
+                with heartbeat(DB_CONF, node_id, token) as hb, scratch_workdir(node_id) as td:
+                    profile = resolve_profile(rel, args.profile)
+                    ocr_pdf_path, ocr_text, snippet, result = do_ocr(
+                        root, rel, td, args.lang, conn, node_id, args.engine, profile, timer,
+                        lease_guard(conn, node_id, token, lambda: hb.lost))
+                with timer.stage('db'):
+                    accepted = mark_done(conn, node_id, ocr_pdf_path, ocr_text, snippet, token, profile)
+                if not accepted:
+                    metrics.task_skipped('sync')
+                    print(f'SKIP node={node_id} path={rel} (lease perdido, resultado descartado)')
+                    continue
+                save_run(conn, node_id, 'sync', timer, 'done', result)
+                metrics.record_run('sync', 'done', timer, result)
+                queued = index_to_opensearch(node_id, rel, ocr_text, result.get('pages'), profile)
+                print(f'OK node={node_id} path={rel} index={"encolado" if queued else "no"}')
+            except LeaseLost:
+                metrics.task_skipped('sync')
+                print(f'SKIP node={node_id} path={rel} (lease perdido, resultado descartado)')
             except Exception as e:
-                mark_failed(conn, node_id, str(e))
+                if mark_failed(conn, node_id, str(e), token):
+                    save_run(conn, node_id, 'sync', timer, 'failed', {'profile': profile})
+                    metrics.record_run('sync', 'failed', timer, error=type(e).__name__)
                 print(f'FAILED node={node_id} path={rel} error={e}')
     finally:
         conn.close()
+        search_index.close()
+        sync_local_search(args)
 
 if __name__ == '__main__':
     main()
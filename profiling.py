@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Perfilado opcional (cProfile o pyinstrument) de tareas y escaneos.
+
+Cuando un PDF o una carpeta es anormalmente lento, timings.py dice en qué
+etapa se va el tiempo pero no dónde dentro de Python (conteo de páginas con
+pikepdf, hashes, llamadas a MariaDB, manejo del resultado). Con este módulo
+se envuelven en un perfilador:
+
+  process_pdf      (tasks.py)              una tarea de Celery
+  do_ocr           (process_sync.py)       un documento del procesador síncrono
+  upsert_node_pdf  (scan_transparencia.py) un archivo del scanner
+  scan             (scan_transparencia.py) el escaneo completo (--profile-scan)
+
+Además se registran los procesos hijos (ocrmypdf, pdftotext, pdftoppm...) con
+su duración real, que el perfilador solo ve como una llamada a
+subprocess.run, y el CPU que consumieron.
+
+Por cada ejecución perfilada se escriben en OCR_PROFILING_DIR:
+  <tipo>_<nodo o ruta>_<fecha>_<pid>.prof          pstats (cProfile)
+  <tipo>_<nodo o ruta>_<fecha>_<pid>.html          (pyinstrument)
+  <tipo>_<nodo o ruta>_<fecha>_<pid>.children.json procesos hijos
+
+Configuración por variables de entorno (o --profiling-* en los scripts):
+  OCR_PROFILING_DIR     directorio de salida; sin él no se perfila nada
+  OCR_PROFILING_NODES   ids de nodo a perfilar, separados por coma
+  OCR_PROFILING_PATHS   prefijos de ruta relativa (carpetas o archivos)
+  OCR_PROFILING_RATE    fracción de ejecuciones a perfilar (0-1); default 1
+                        si no hay NODES ni PATHS, 0 si los hay
+  OCR_PROFILING_ENGINE  cprofile (default) o pyinstrument (muestreo, pip
+                        install pyinstrument)
+
+Análisis:
+    python -m pstats perfiles/process_pdf_1234_20240101-120000_4242.prof
+    python profiling.py perfiles/process_pdf_1234_20240101-120000_4242.prof
+"""
+import argparse
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import pyinstrument
+except Exception:
+    pyinstrument = None
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+ENGINES = ('cprofile', 'pyinstrument')
+
+_real_run = subprocess.run
+_local = threading.local()
+
+
+def settings():
+    """Configuración vigente, o None si el perfilado está desactivado"""
+    out_dir = os.environ.get('OCR_PROFILING_DIR')
+    if not out_dir:
+        return None
+    nodes = {int(n) for n in re.split(r'[,\s]+', os.environ.get('OCR_PROFILING_NODES', '')) if n.strip()}
+    paths = [p.strip().strip('/') for p in os.environ.get('OCR_PROFILING_PATHS', '').split(',') if p.strip()]
+    default_rate = '0' if nodes or paths else '1'
+    engine = os.environ.get('OCR_PROFILING_ENGINE', 'cprofile')
+    if engine not in ENGINES:
+        raise ValueError(f"OCR_PROFILING_ENGINE desconocido: {engine}")
+    return {
+        'dir': Path(out_dir),
+        'nodes': nodes,
+        'paths': paths,
+        'rate': float(os.environ.get('OCR_PROFILING_RATE', default_rate)),
+        'engine': engine,
+    }
+
+
+def should_profile(node_id=None, rel_path=None):
+    """Decide si perfilar esta ejecución (nodo listado, ruta bajo un prefijo o muestreo)"""
+    s = settings()
+    if not s:
+        return False
+    if node_id is not None and int(node_id) in s['nodes']:
+        return True
+    if rel_path and any(rel_path == p or rel_path.startswith(p + '/') for p in s['paths']):
+        return True
+    return s['rate'] > 0 and random.random() < s['rate']
+
+
+def _traced_run(*args, **kwargs):
+    """subprocess.run que anota comando, duración y código de salida en el perfil activo"""
+    children = getattr(_local, 'children', None)
+    if children is None:
+        return _real_run(*args, **kwargs)
+    cmd = args[0] if args else kwargs.get('args')
+    argv = [str(a) for a in cmd] if isinstance(cmd, (list, tuple)) else [str(cmd)]
+    t0 = time.perf_counter()
+    returncode = None
+    try:
+        result = _real_run(*args, **kwargs)
+        returncode = result.returncode
+        return result
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+        raise
+    finally:
+        children.append({
+            'cmd': Path(argv[0]).name,
+            'args': ' '.join(argv[1:])[:500],
+            'seconds': round(time.perf_counter() - t0, 4),
+            'returncode': returncode,
+        })
+
+
+def _children_cpu():
+    if resource is None:
+        return None
+    r = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return r.ru_utime + r.ru_stime
+
+
+def _slug(key):
+    return re.sub(r'[^A-Za-z0-9._-]+', '-', str(key)).strip('-')[:80] or 'x'
+
+
+@contextmanager
+def profile(kind, key):
+    """Perfila el bloque y escribe los archivos en OCR_PROFILING_DIR"""
+    s = settings()
+    if not s or getattr(_local, 'children', None) is not None:
+        # Desactivado, o ya dentro de un perfil (p. ej. upsert_node_pdf durante scan)
+        yield
+        return
+    s['dir'].mkdir(parents=True, exist_ok=True)
+    base = s['dir'] / f"{kind}_{_slug(key)}_{datetime.now():%Y%m%d-%H%M%S}_{os.getpid()}"
+
+    if s['engine'] == 'pyinstrument':
+        if pyinstrument is None:
+            raise RuntimeError('OCR_PROFILING_ENGINE=pyinstrument requiere pip install pyinstrument')
+        profiler = pyinstrument.Profiler()
+    else:
+        profiler = cProfile.Profile()
+
+    children = []
+    _local.children = children
+    subprocess.run = _traced_run
+    cpu0 = _children_cpu()
+    t0 = time.perf_counter()
+    profiler.start() if s['engine'] == 'pyinstrument' else profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.stop() if s['engine'] == 'pyinstrument' else profiler.disable()
+        wall = time.perf_counter() - t0
+        _local.children = None
+        subprocess.run = _real_run
+        cpu1 = _children_cpu()
+        try:
+            if s['engine'] == 'pyinstrument':
+                base.with_suffix('.html').write_text(profiler.output_html(), encoding='utf-8')
+            else:
+                profiler.dump_stats(str(base.with_suffix('.prof')))
+            child_wall = sum(c['seconds'] for c in children)
+            Path(f"{base}.children.json").write_text(json.dumps({
+                'kind': kind,
+                'key': str(key),
+                'wall_seconds': round(wall, 4),
+                'children_wall_seconds': round(child_wall, 4),
+                'python_seconds': round(wall - child_wall, 4),
+                'children_cpu_seconds': round(cpu1 - cpu0, 4) if cpu0 is not None else None,
+                'children': children,
+            }, indent=2, ensure_ascii=False), encoding='utf-8')
+        except OSError as e:
+            print(f"Perfilado: no se pudo escribir {base}: {e}")
+
+
+def profile_if(kind, node_id=None, rel_path=None):
+    """profile() si should_profile() lo decide, si no un contexto vacío"""
+    if should_profile(node_id, rel_path):
+        return profile(kind, node_id if node_id is not None else rel_path)
+    return nullcontext()
+
+
+def _arg(args, kwargs, position, name):
+    return args[position] if len(args) > position else kwargs.get(name)
+
+
+def profiled(kind, node_arg=None, path_fn=None):
+    """
+    Decorador: perfila la llamada según should_profile().
+
+    node_arg es (posición, nombre) del argumento con el id de nodo; path_fn
+    recibe los mismos argumentos que la función y devuelve la ruta relativa
+    del PDF que se compara con OCR_PROFILING_PATHS.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not os.environ.get('OCR_PROFILING_DIR'):
+                return func(*args, **kwargs)
+            node_id = _arg(args, kwargs, *node_arg) if node_arg else None
+            rel_path = None
+            if path_fn:
+                try:
+                    rel_path = str(path_fn(*args, **kwargs))
+                except Exception:
+                    pass
+            with profile_if(kind, node_id, rel_path):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_arguments(parser):
+    """Opciones --profiling-* para los scripts (equivalentes a las variables OCR_PROFILING_*)"""
+    g = parser.add_argument_group('perfilado (ver profiling.py)')
+    g.add_argument('--profiling-dir', default=None, help='directorio de perfiles (activa el perfilado)')
+    g.add_argument('--profiling-nodes', default=None, help='ids de nodo a perfilar, separados por coma')
+    g.add_argument('--profiling-paths', default=None, help='prefijos de ruta a perfilar, separados por coma')
+    g.add_argument('--profiling-rate', type=float, default=None, help='fracción de ejecuciones a perfilar (0-1)')
+    g.add_argument('--profiling-engine', choices=ENGINES, default=None, help='cprofile o pyinstrument')
+
+
+def configure(args):
+    """Traslada las opciones --profiling-* al entorno (lo heredan los procesos hijos)"""
+    for name in ('dir', 'nodes', 'paths', 'rate', 'engine'):
+        value = getattr(args, f'profiling_{name}', None)
+        if value is not None:
+            os.environ[f'OCR_PROFILING_{name.upper()}'] = str(value)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Resumen de un perfil .prof y sus procesos hijos')
+    p.add_argument('profile', help='archivo .prof')
+    p.add_argument('--sort', default='cumulative', help='orden de pstats (default: cumulative)')
+    p.add_argument('--top', type=int, default=30, help='funciones a mostrar (default: 30)')
+    args = p.parse_args()
+
+    path = Path(args.profile)
+    children = Path(str(path.with_suffix('')) + '.children.json')
+    if children.exists():
+        info = json.loads(children.read_text(encoding='utf-8'))
+        print(f"{info['kind']} {info['key']}: {info['wall_seconds']:.2f}s total, "
+              f"{info['python_seconds']:.2f}s en Python, {info['children_wall_seconds']:.2f}s en procesos hijos")
+        for c in sorted(info['children'], key=lambda c: -c['seconds']):
+            print(f"  {c['seconds']:>9.3f}s  {c['cmd']:12} rc={c['returncode']}  {c['args'][:80]}")
+        print()
+    pstats.Stats(str(path)).strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ Uso:
     # Re-intentar todos los fallidos
     python reset_failed.py --retry-failed
     
-    # Liberar atorados en processing
+    # Liberar atorados en processing (worker sin heartbeat, ver lease.py)
     python reset_failed.py --free-stuck
     
     # Hacer ambas cosas
@@ -20,6 +20,9 @@ import os
 from dotenv import load_dotenv
 import pymysql
 
+from lease import reap_stale, stale_count
+from status_counts import read_counts
+
 load_dotenv()
 
 DB_CONF = {
@@ -38,24 +41,15 @@ def show_stats(conn):
     print("  ESTADÍSTICAS ACTUALES")
     print("="*70)
     
-    with conn.cursor() as cur:
-        cur.execute("SELECT ocr_status, COUNT(*) as cnt FROM pdf_metadata GROUP BY ocr_status")
-        rows = cur.fetchall()
-        print("\n📊 Por estado:")
-        for r in rows:
-            print(f"   {r['ocr_status']:12}: {r['cnt']:6} registros")
+    stats, _ = read_counts(conn)
+    print("\n📊 Por estado:")
+    for status, cnt in stats.items():
+        print(f"   {status:12}: {cnt:6} registros")
     
-    # Atorados en processing
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT COUNT(*) as cnt 
-            FROM pdf_metadata 
-            WHERE ocr_status='processing' 
-            AND TIMESTAMPDIFF(MINUTE, ocr_started_at, NOW()) > 30
-        """)
-        stuck = cur.fetchone()['cnt']
-        if stuck > 0:
-            print(f"\n⚠️  {stuck} registros atorados en 'processing' (>30 min)")
+    # Atorados en processing: su worker dejó de enviar heartbeat
+    stuck = stale_count(conn)
+    if stuck > 0:
+        print(f"\n⚠️  {stuck} registros atorados en 'processing' (sin heartbeat)")
 
 def retry_failed(conn):
     """Reintentar todos los registros fallidos"""
@@ -79,39 +73,27 @@ def retry_failed(conn):
         print(f"✅ {count} registros cambiados a 'pending'")
 
 def free_stuck(conn, minutes=30):
-    """Liberar registros atorados en processing"""
-    with conn.cursor() as cur:
-        cur.execute(f"""
-            SELECT COUNT(*) as cnt 
-            FROM pdf_metadata 
-            WHERE ocr_status='processing' 
-            AND TIMESTAMPDIFF(MINUTE, ocr_started_at, NOW()) > {minutes}
-        """)
-        count = cur.fetchone()['cnt']
-        
-        if count == 0:
-            print(f"\n✅ No hay registros atorados en 'processing' (>{minutes} min)")
-            return
-        
-        print(f"\n🔓 Liberando {count} registros atorados (>{minutes} min)...")
-        cur.execute(f"""
-            UPDATE pdf_metadata 
-            SET ocr_status='pending',
-                updated_at=NOW()
-            WHERE ocr_status='processing' 
-            AND TIMESTAMPDIFF(MINUTE, ocr_started_at, NOW()) > {minutes}
-        """)
-        conn.commit()
-        print(f"✅ {count} registros cambiados a 'pending'")
+    """
+    Liberar registros cuyo worker dejó de enviar heartbeat (ver lease.py).
+    minutes solo aplica a filas sin lease (procesadas con código anterior).
+    """
+    count = stale_count(conn, minutes)
+    if count == 0:
+        print("\n✅ No hay registros en 'processing' sin heartbeat")
+        return
+    
+    print(f"\n🔓 Liberando {count} registros sin heartbeat...")
+    reaped = reap_stale(conn, legacy_minutes=minutes)
+    print(f"✅ {len(reaped)} registros cambiados a 'pending'")
 
 def main():
     parser = argparse.ArgumentParser(description='Gestionar registros con problemas')
     parser.add_argument('--retry-failed', action='store_true', 
                         help='Re-intentar todos los registros fallidos')
     parser.add_argument('--free-stuck', action='store_true', 
-                        help='Liberar registros atorados en processing')
+                        help='Liberar registros en processing cuyo worker dejó de enviar heartbeat')
     parser.add_argument('--stuck-minutes', type=int, default=30,
-                        help='Minutos para considerar un registro como atorado (default: 30)')
+                        help='Minutos para considerar atorado un registro sin lease (código anterior, default: 30)')
     parser.add_argument('--stats', action='store_true',
                         help='Solo mostrar estadísticas')
     args = parser.parse_args()
@@ -138,10 +120,8 @@ def main():
         
         print("\n" + "="*70)
         print("✅ Listo para procesar:")
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) as cnt FROM pdf_metadata WHERE ocr_status='pending'")
-            pending = cur.fetchone()['cnt']
-            print(f"   {pending} PDFs pendientes de procesar")
+        pending = read_counts(conn)[0].get('pending', 0)
+        print(f"   {pending} PDFs pendientes de procesar")
         print("="*70 + "\n")
         
     finally:
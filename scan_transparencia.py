@@ -8,6 +8,11 @@ Configuración por variables de entorno (ver README):
 
 Uso:
   python scan_transparencia.py --root /ruta/a/transparencia
+  python scan_transparencia.py --root /ruta/a/transparencia --preflight
+
+  # perfilar el escaneo completo, o solo los archivos de una carpeta (ver profiling.py)
+  python scan_transparencia.py --root /ruta/a/transparencia --profiling-dir perfiles --profile-scan
+  python scan_transparencia.py --root /ruta/a/transparencia --profiling-dir perfiles --profiling-paths 2019/obras
 """
 import argparse
 import hashlib
@@ -19,6 +24,13 @@ from dotenv import load_dotenv
 import pymysql
 import pikepdf
 
+from preflight import profile_pdf, save_profile
+from schema_sql import apply_schema
+from status_counts import read_counts
+from profiling import profiled, profile
+import profiling
+import metrics
+
 load_dotenv()
 
 DB_CONF = {
@@ -50,15 +62,11 @@ def get_pdf_pages(path: Path):
 
 def ensure_tables(conn):
     # Intenta ejecutar el SQL de esquemas si existe
+    # (sentencias sin comentarios, ver schema_sql.py)
     schema_file = Path(__file__).with_name('mariadb_schema.sql')
     if schema_file.exists():
-        with open(schema_file, 'r', encoding='utf-8') as fh:
-            sql = fh.read()
         with conn.cursor() as cur:
-            for stmt in sql.split(';'):
-                s = stmt.strip()
-                if s:
-                    cur.execute(s)
+            apply_schema(cur, schema_file)
         conn.commit()
 
 
@@ -103,7 +111,8 @@ def assign_tree_index(conn):
             idx += 1
     conn.commit()
 
-def upsert_node_pdf(conn, root: Path, file_path: Path):
+@profiled('upsert_node_pdf', path_fn=lambda conn, root, file_path, *a, **k: file_path.relative_to(root).as_posix())
+def upsert_node_pdf(conn, root: Path, file_path: Path, preflight: bool = False):
     rel = file_path.relative_to(root).as_posix()
     name = file_path.name
     stat = file_path.stat()
@@ -118,7 +127,8 @@ def upsert_node_pdf(conn, root: Path, file_path: Path):
         if row:
             node_id = row['id']
             old_checksum = row.get('checksum')
-            if old_checksum != checksum:
+            changed = old_checksum != checksum
+            if changed:
                 cur.execute(
                     "UPDATE nodes SET size=%s, mtime=%s, checksum=%s, updated_at=NOW() WHERE id=%s",
                     (size, mtime, checksum, node_id)
@@ -141,10 +151,19 @@ def upsert_node_pdf(conn, root: Path, file_path: Path):
                 "INSERT INTO pdf_metadata (node_id, pages, text_found, ocr_status) VALUES (%s,%s,0,'pending')",
                 (node_id, pages)
             )
+            changed = True
     conn.commit()
 
-def scan(root: Path, limit: int = None):
-    conn = pymysql.connect(**DB_CONF)
+    if preflight and changed:
+        try:
+            save_profile(conn, node_id, profile_pdf(file_path))
+        except Exception as e:
+            conn.rollback()
+            print(f"Pre-flight falló para {file_path}: {e}")
+
+def scan(root: Path, limit: int = None, preflight: bool = False):
+    metrics.init('scan')
+    conn = metrics.connect(**DB_CONF)
     try:
         ensure_tables(conn)
         processed = 0
@@ -152,10 +171,14 @@ def scan(root: Path, limit: int = None):
             if limit and processed >= limit:
                 break
             try:
-                upsert_node_pdf(conn, root, p)
+                upsert_node_pdf(conn, root, p, preflight)
                 processed += 1
+                metrics.inc('ocr_scan_files_total', result='ok')
             except Exception as e:
+                metrics.inc('ocr_scan_files_total', result='error')
                 print(f"Error procesando {p}: {e}")
+        if metrics.enabled():
+            metrics.set_backlog(read_counts(conn)[0])
         print(f"Procesados: {processed}")
     finally:
         conn.close()
@@ -164,12 +187,22 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument('--root', default='transparencia', help='ruta a la carpeta transparencia')
     p.add_argument('--limit', type=int, default=None, help='limitar cantidad de archivos a procesar (para pruebas)')
+    p.add_argument('--preflight', action='store_true',
+                   help='perfilar páginas nuevas o modificadas (texto, imágenes, DPI, costo estimado; ver preflight.py)')
+    p.add_argument('--profile-scan', action='store_true',
+                   help='perfilar el escaneo completo en un solo archivo (requiere --profiling-dir u OCR_PROFILING_DIR)')
+    profiling.add_arguments(p)
     args = p.parse_args()
+    profiling.configure(args)
     root = Path(args.root).resolve()
     if not root.exists():
         print('No se encontró la carpeta', root)
         return
-    scan(root, args.limit)
+    if args.profile_scan:
+        with profile('scan', root.name):
+            scan(root, args.limit, args.preflight)
+    else:
+        scan(root, args.limit, args.preflight)
 
 if __name__ == '__main__':
     main()
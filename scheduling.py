@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Políticas de orden para seleccionar PDFs pendientes.
+
+Celery consume la cola en el orden en que se encola, así que el orden de la
+consulta de pendientes (enqueue_pdfs.py, tasks.enqueue_pending_pdfs,
+process_sync.py) decide qué se procesa primero:
+
+  path   orden alfabético por ruta (comportamiento original)
+  sjf    trabajos más cortos primero: progreso visible rápido
+  ljf    trabajos más largos primero: minimiza el tiempo total con varios
+         workers (los documentos grandes no quedan para el final)
+  fair   round-robin entre carpetas de primer nivel (años): una carpeta con
+         archivos enormes no bloquea a las demás
+
+El costo de un documento es pdf_metadata.est_ocr_cost (pre-flight, segundos);
+sin pre-flight se estima como páginas * PAGE_COST_S.
+
+La política por defecto se toma de OCR_SCHEDULE (default: path). La última
+usada se guarda en ocr_state para que monitor_progress.py la muestre.
+"""
+import os
+
+PAGE_COST_S = 3.0   # costo medio por página cuando no hay pre-flight
+
+COST_EXPR = f"COALESCE(p.est_ocr_cost, p.pages * {PAGE_COST_S}, 0)"
+TOP_FOLDER_EXPR = "SUBSTRING_INDEX(n.path, '/', 1)"
+
+POLICIES = {
+    'path': 'n.path ASC',
+    'sjf': f'{COST_EXPR} ASC, n.path ASC',
+    'ljf': f'{COST_EXPR} DESC, n.path ASC',
+    'fair': 'fair_rank ASC, top_folder ASC',
+}
+
+POLICY_LABELS = {
+    'path': 'orden por ruta',
+    'sjf': 'más cortos primero',
+    'ljf': 'más largos primero',
+    'fair': 'round-robin por carpeta',
+}
+
+
+def default_policy():
+    policy = os.environ.get('OCR_SCHEDULE', 'path')
+    return policy if policy in POLICIES else 'path'
+
+
+def pending_query(policy=None, limit=None):
+    """
+    Consulta de nodos pendientes (node_id, path, est_cost) en el orden de la política.
+
+    Returns:
+        tuple: (sql, params)
+    """
+    policy = policy or default_policy()
+    if policy not in POLICIES:
+        raise ValueError(f"Política desconocida: {policy} (opciones: {', '.join(POLICIES)})")
+    extra = ''
+    if policy == 'fair':
+        extra = (f", {TOP_FOLDER_EXPR} as top_folder,"
+                 f" ROW_NUMBER() OVER (PARTITION BY {TOP_FOLDER_EXPR} ORDER BY n.path) as fair_rank")
+    sql = f"""
+        SELECT n.id as node_id, n.path, {COST_EXPR} as est_cost{extra}
+        FROM nodes n
+        JOIN pdf_metadata p ON n.id = p.node_id
+        WHERE p.ocr_status='pending'
+        ORDER BY {POLICIES[policy]}
+    """
+    params = None
+    if limit:
+        sql += " LIMIT %s"
+        params = (int(limit),)
+    return sql, params
+
+
+def record_policy(conn, policy, source):
+    """Registra la política usada (la muestra monitor_progress.py); no falla si no hay tabla"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO ocr_state (name, value) VALUES ('schedule_policy', %s)
+                   ON DUPLICATE KEY UPDATE value=VALUES(value), updated_at=NOW()""",
+                (f"{policy}:{source}",)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+
+def active_policy(conn):
+    """
+    Última política registrada.
+
+    Returns:
+        dict|None: {'policy', 'label', 'source', 'since'}
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT value, updated_at FROM ocr_state WHERE name='schedule_policy'")
+            row = cur.fetchone()
+    except Exception:
+        return None  # tabla aún no creada
+    if not row or not row['value']:
+        return None
+    policy, _, source = row['value'].partition(':')
+    return {'policy': policy, 'label': POLICY_LABELS.get(policy, policy), 'source': source,
+            'since': row['updated_at']}
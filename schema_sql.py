@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Aplicación de mariadb_schema.sql sentencia por sentencia.
+
+pymysql ejecuta una sentencia por llamada, así que el esquema se divide en
+';'. Un split ingenuo rompe una sentencia cuando un comentario contiene ';'
+y deja trozos que son solo comentarios (MariaDB responde 1065 "Query was
+empty"). split_statements descarta los comentarios (-- y /* */) y respeta
+los literales entre comillas; lo usan scan_transparencia.ensure_tables (en
+cada escaneo), scripts/create_db_and_apply_schema.py y bench/run_bench.py.
+"""
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).resolve().parent / 'mariadb_schema.sql'
+
+
+def split_statements(sql):
+    """
+    Divide un script SQL en sentencias sin comentarios.
+
+    Returns:
+        list: sentencias no vacías, sin el ';' final
+    """
+    statements = []
+    buf = []
+    quote = None
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if quote:
+            buf.append(ch)
+            if ch == '\\' and quote != '`' and i + 1 < n:
+                buf.append(sql[i + 1])
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in ("'", '"', '`'):
+            quote = ch
+            buf.append(ch)
+        elif sql.startswith('--', i) and (i + 2 == n or sql[i + 2].isspace()):
+            end = sql.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            buf.append(' ')
+            continue
+        elif ch == ';':
+            stmt = ''.join(buf).strip()
+            if stmt:
+                statements.append(stmt)
+            buf = []
+        else:
+            buf.append(ch)
+        i += 1
+    stmt = ''.join(buf).strip()
+    if stmt:
+        statements.append(stmt)
+    return statements
+
+
+def apply_schema(cur, path=SCHEMA_PATH, on_error=None):
+    """
+    Ejecuta el esquema en la base seleccionada del cursor.
+
+    Con on_error=None el primer error se propaga; si no, se llama
+    on_error(sentencia, excepción) y se sigue con la siguiente.
+
+    Returns:
+        int: sentencias ejecutadas sin error
+    """
+    sql = Path(path).read_text(encoding='utf-8')
+    ok = 0
+    for stmt in split_statements(sql):
+        try:
+            cur.execute(stmt)
+            ok += 1
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(stmt, e)
+    return ok
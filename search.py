@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Capa de consulta sobre el texto OCR, con el mismo contrato para cualquier
+backend:
+
+  opensearch  índice de search_index.py (OPENSEARCH_URL)
+  local       índice SQLite FTS5 de local_search.py (OCR_SEARCH_DB)
+  mariadb     LIKE sobre pdf_metadata.ocr_text (sin índice de texto; lento,
+              solo como respaldo: coincide con subcadenas y ordena por node_id)
+
+OCR_SEARCH_BACKEND elige uno; con 'auto' (default) se usa el primero
+configurado en ese orden.
+
+Consultas: términos (todos obligatorios), "frases" y prefijos*, limitadas
+opcionalmente a un subárbol de carpetas de nodes (folder='2009/obras').
+
+Paginación por keyset: cada respuesta trae next_cursor, un token opaco con
+la clave de orden del último resultado (relevancia, node_id). La página
+siguiente se pide con cursor=next_cursor y no usa OFFSET: cuesta lo mismo en
+la página 1 que en la 500. Con orden por node_id (mariadb) las páginas no se
+repiten ni se saltan aunque entren documentos nuevos; con orden por
+relevancia (_score de OpenSearch, bm25 de FTS5) la puntuación depende de las
+estadísticas del índice, así que si el índice cambia entre páginas un
+resultado puede repetirse u omitirse. No se fija un punto en el tiempo: para
+los tableros basta, y la caché de resultados ya da páginas coherentes
+mientras la versión no cambie.
+
+Cada resultado trae snippet (fragmento con los términos entre [ ]) y
+page_hits (páginas, desde 1, donde aparece algún término; el texto de
+pdftotext separa páginas con \\f).
+
+Caché LRU de resultados por proceso: las consultas repetidas de los tableros
+no llegan al backend. Una entrada se invalida cuando cambia la versión del
+backend (nuevos done/indexados en MariaDB, generación del índice local),
+que se consulta como mucho cada OCR_SEARCH_CACHE_CHECK_S segundos, o al
+llamar invalidate().
+
+Configuración por variables de entorno:
+  OCR_SEARCH_BACKEND          auto|opensearch|local|mariadb (default: auto)
+  OCR_SEARCH_CACHE            entradas de la caché; 0 la desactiva (default: 256)
+  OCR_SEARCH_CACHE_TTL        vida máxima de una entrada en segundos (default: 300)
+  OCR_SEARCH_CACHE_CHECK_S    intervalo mínimo entre consultas de versión (default: 2)
+
+Uso:
+    python search.py "licitación pública" --folder 2009/obras
+    python search.py '"acta de entrega" puente*' --cursor <next_cursor>
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+import pymysql
+
+from incremental import PAGE_BREAK
+from local_search import query_terms
+import local_search
+import search_index
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+BACKENDS = ('opensearch', 'local', 'mariadb')
+SNIPPET_CHARS = 200
+MAX_PAGE_HITS = 50
+
+
+def settings():
+    return {
+        'backend': os.environ.get('OCR_SEARCH_BACKEND', 'auto'),
+        'cache_size': int(os.environ.get('OCR_SEARCH_CACHE', 256)),
+        'cache_ttl': float(os.environ.get('OCR_SEARCH_CACHE_TTL', 300)),
+        'check_s': float(os.environ.get('OCR_SEARCH_CACHE_CHECK_S', 2)),
+    }
+
+
+def default_backend():
+    backend = settings()['backend']
+    if backend != 'auto':
+        if backend not in BACKENDS:
+            raise ValueError(f"OCR_SEARCH_BACKEND desconocido: {backend} (opciones: auto, {', '.join(BACKENDS)})")
+        return backend
+    if search_index.enabled():
+        return 'opensearch'
+    if local_search.enabled():
+        return 'local'
+    return 'mariadb'
+
+
+# --- Texto: snippets y páginas ------------------------------------------------
+
+def _fold(text):
+    """Minúsculas sin acentos, con la misma longitud (las posiciones sirven en el original)"""
+    return ''.join((unicodedata.normalize('NFKD', c)[:1].lower()[:1] or c) for c in text)
+
+
+def _term_patterns(terms):
+    patterns = []
+    for term, prefix in terms:
+        words = [re.escape(w) for w in _fold(term).split()]
+        patterns.append(re.compile(r'\b' + r'\s+'.join(words) + ('' if prefix else r'\b')))
+    return patterns
+
+
+def make_snippet(text, terms, width=SNIPPET_CHARS):
+    """Fragmento alrededor de la primera coincidencia, con los términos entre [ ]"""
+    if not text:
+        return ''
+    folded = _fold(text)
+    patterns = _term_patterns(terms)
+    first = [m for m in (p.search(folded) for p in patterns) if m]
+    start = max(0, min(m.start() for m in first) - width // 3) if first else 0
+    end = min(len(text), start + width)
+    spans = sorted({(m.start(), m.end()) for p in patterns for m in p.finditer(folded, start, end)})
+    out, pos = [], start
+    for s, e in spans:
+        if s < pos:
+            continue
+        out.append(text[pos:s] + '[' + text[s:e] + ']')
+        pos = e
+    out.append(text[pos:end])
+    snippet = ' '.join(''.join(out).split())
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+
+def page_hits(text, terms, limit=MAX_PAGE_HITS):
+    """Páginas (desde 1) donde aparece algún término"""
+    if not text or not terms:
+        return []
+    patterns = _term_patterns(terms)
+    pages = []
+    for number, page in enumerate(text.split(PAGE_BREAK), 1):
+        folded = _fold(page)
+        if any(p.search(folded) for p in patterns):
+            pages.append(number)
+            if len(pages) >= limit:
+                break
+    return pages
+
+
+# --- Cursores ------------------------------------------------------------------
+
+def _query_key(terms, folder):
+    raw = json.dumps([terms, (folder or '').replace('\\', '/').strip('/')], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(backend, qkey, sort_key):
+    raw = json.dumps({'b': backend, 'q': qkey, 'k': sort_key}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, backend, qkey):
+    """Clave de orden del cursor; ValueError si es de otra consulta o backend"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except Exception:
+        raise ValueError('cursor inválido')
+    if data.get('b') != backend or data.get('q') != qkey:
+        raise ValueError('el cursor no corresponde a esta consulta')
+    return data['k']
+
+
+# --- Caché ---------------------------------------------------------------------
+
+class ResultCache:
+    """LRU de resultados; cada entrada recuerda la versión del backend con que se calculó"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # clave -> (versión, instante, resultado)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version or time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, version, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = ResultCache(settings()['cache_size'], settings()['cache_ttl'])
+_versions = {}          # backend -> (instante, versión)
+_versions_lock = threading.Lock()
+
+
+def invalidate():
+    """Descarta la caché de resultados del proceso (p. ej. tras escribir en el índice)"""
+    _cache.clear()
+    with _versions_lock:
+        _versions.clear()
+
+
+# --- Backends ------------------------------------------------------------------
+
+class Searcher:
+    """
+    Ejecuta consultas contra un backend con conexiones propias (una instancia
+    por hilo: pymysql y sqlite3 no se comparten entre hilos). La caché de
+    resultados es común a todo el proceso.
+    """
+
+    def __init__(self, backend=None, db_conf=None, local_db=None):
+        self.backend = backend or default_backend()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Backend desconocido: {self.backend}")
+        self.db_conf = db_conf or DB_CONF
+        self.local_db = local_db
+        self._mysql = None
+        self._sqlite = None
+
+    def _my(self):
+        if self._mysql is None or not self._mysql.open:
+            self._mysql = pymysql.connect(**self.db_conf)
+        return self._mysql
+
+    def _lite(self):
+        if self._sqlite is None:
+            self._sqlite = local_search.connect(self.local_db)
+        return self._sqlite
+
+    def close(self):
+        if self._mysql is not None:
+            self._mysql.close()
+        if self._sqlite is not None:
+            self._sqlite.close()
+        self._mysql = self._sqlite = None
+
+    def version(self):
+        """Versión de los datos del backend (cambia cuando un documento entra, cambia o sale)"""
+        if self.backend == 'local':
+            return local_search.generation(self._lite())
+        conn = self._my()
+        # Cada subconsulta se resuelve con un índice (idx_pdf_finished, idx_pdf_indexed)
+        # o con la tabla de contadores: nada recorre pdf_metadata
+        finished = "(SELECT MAX(ocr_finished_at) FROM pdf_metadata) AS finished"
+        indexed = "(SELECT MAX(indexed_at) FROM pdf_metadata WHERE ocr_status='done') AS indexed"
+        done = "(SELECT COALESCE(SUM(cnt), 0) FROM ocr_status_counts WHERE ocr_status='done') AS done"
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT {finished}, {indexed}, {done}")
+                row = cur.fetchone()
+        except pymysql.err.ProgrammingError:
+            with conn.cursor() as cur:   # contadores aún no creados
+                cur.execute(f"SELECT {finished}, {indexed}, 0 AS done")
+                row = cur.fetchone()
+        conn.commit()
+        return f"{row['finished']}|{row['indexed']}|{row['done']}"
+
+    def _cached_version(self):
+        check_s = settings()['check_s']
+        now = time.monotonic()
+        with _versions_lock:
+            seen = _versions.get(self.backend)
+            if seen and now - seen[0] < check_s:
+                return seen[1]
+        value = self.version()
+        with _versions_lock:
+            _versions[self.backend] = (now, value)
+        return value
+
+    def search(self, query, folder=None, limit=20, cursor=None, pages=True):
+        """
+        Returns:
+            dict: {'backend', 'hits': [{'node_id', 'path', 'pages', 'score', 'snippet', 'page_hits'}],
+                   'next_cursor': str|None, 'cached': bool, 'ms'}
+        """
+        t0 = time.perf_counter()
+        terms = query_terms(query)
+        folder = (folder or '').replace('\\', '/').strip('/') or None
+        qkey = _query_key(terms, folder)
+        after = decode_cursor(cursor, self.backend, qkey) if cursor else None
+        if not terms:
+            return {'backend': self.backend, 'hits': [], 'next_cursor': None, 'cached': False, 'ms': 0.0}
+
+        key = (self.backend, qkey, limit, cursor, pages)
+        version = self._cached_version() if _cache.size > 0 else None
+        result = _cache.get(key, version) if version is not None else None
+        if result is not None:
+            return dict(result, cached=True, ms=round((time.perf_counter() - t0) * 1000, 1))
+
+        run = {'opensearch': self._opensearch, 'local': self._local, 'mariadb': self._mariadb}[self.backend]
+        hits, next_key = run(query, terms, folder, limit, after, pages)
+        result = {
+            'backend': self.backend,
+            'hits': hits,
+            'next_cursor': encode_cursor(self.backend, qkey, next_key) if next_key is not None else None,
+            'cached': False,
+        }
+        if version is not None:
+            _cache.put(key, version, result)
+        return dict(result, ms=round((time.perf_counter() - t0) * 1000, 1))
+
+    def _local(self, query, terms, folder, limit, after, pages):
+        result = local_search.search(self._lite(), query, folder, limit, after=after, with_text=pages)
+        hits = []
+        for h in result['hits']:
+            text = h.pop('text', None)
+            h['snippet'] = ' '.join(h['snippet'].split())
+            h['page_hits'] = page_hits(text, terms) if pages else None
+            h['sort'] = [h['score'], h['node_id']]
+            h['score'] = round(-h['score'], 4)     # bm25: menor es mejor
+            hits.append(h)
+        next_key = hits[-1].pop('sort') if hits and result['has_more'] else None
+        for h in hits:
+            h.pop('sort', None)
+        return hits, next_key
+
+    def _opensearch(self, query, terms, folder, limit, after, pages):
+        parts = []
+        for term, prefix in terms:
+            clean = re.sub(r'[+|\-"*()~\\]', ' ', term).strip()
+            if clean:
+                parts.append(f'{clean}*' if prefix and ' ' not in clean else f'"{clean}"')
+        body = {
+            'size': limit + 1,
+            'query': {'bool': {
+                'must': [{'simple_query_string': {'query': ' '.join(parts), 'fields': ['text'],
+                                                  'default_operator': 'and'}}],
+                'filter': [{'term': {'path.tree': folder}}] if folder else [],
+            }},
+            'sort': [{'_score': 'desc'}, {'node_id': 'asc'}],
+            'highlight': {'fields': {'text': {'fragment_size': SNIPPET_CHARS, 'number_of_fragments': 1}},
+                          'pre_tags': ['['], 'post_tags': [']']},
+            '_source': ['node_id', 'path', 'pages'] + (['text'] if pages else []),
+            'track_total_hits': False,
+        }
+        if after is not None:
+            body['search_after'] = after
+        response = search_index.get_client().search(index=search_index.settings()['index'], body=body)
+        raw = response['hits']['hits']
+        hits = []
+        for h in raw[:limit]:
+            src = h['_source']
+            fragments = (h.get('highlight') or {}).get('text') or []
+            hits.append({
+                'node_id': src['node_id'],
+                'path': src['path'],
+                'pages': src.get('pages'),
+                'score': round(h['_score'] or 0.0, 4),
+                'snippet': ' '.join(fragments[0].split()) if fragments else make_snippet(src.get('text'), terms),
+                'page_hits': page_hits(src.get('text'), terms) if pages else None,
+            })
+        next_key = raw[limit - 1]['sort'] if len(raw) > limit else None
+        return hits, next_key
+
+    def _mariadb(self, query, terms, folder, limit, after, pages):
+        def like(value):
+            return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+        where = ["p.ocr_status='done'"]
+        params = []
+        for term, _prefix in terms:
+            where.append("p.ocr_text LIKE %s")
+            params.append('%' + like(term) + '%')
+        if folder:
+            where.append("n.path LIKE %s")
+            params.append(like(folder) + '/%')
+        if after is not None:
+            where.append("p.node_id > %s")
+            params.append(after[1])
+        conn = self._my()
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT p.node_id, n.path, p.pages, p.ocr_text
+                    FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+                    WHERE {' AND '.join(where)}
+                    ORDER BY p.node_id
+                    LIMIT %s""",
+                params + [limit + 1]
+            )
+            rows = cur.fetchall()
+        conn.commit()
+        hits = [{
+            'node_id': r['node_id'],
+            'path': r['path'],
+            'pages': r['pages'],
+            'score': None,
+            'snippet': make_snippet(r['ocr_text'], terms),
+            'page_hits': page_hits(r['ocr_text'], terms) if pages else None,
+        } for r in rows[:limit]]
+        next_key = [None, hits[-1]['node_id']] if len(rows) > limit else None
+        return hits, next_key
+
+
+_local = threading.local()
+
+
+def search(query, folder=None, limit=20, cursor=None, pages=True, backend=None):
+    """Consulta con el Searcher del hilo actual (ver Searcher.search)"""
+    backend = backend or default_backend()
+    searchers = getattr(_local, 'searchers', None)
+    if searchers is None:
+        searchers = _local.searchers = {}
+    if backend not in searchers:
+        searchers[backend] = Searcher(backend)
+    return searchers[backend].search(query, folder, limit, cursor, pages)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Búsqueda en el texto OCR (OpenSearch, índice local o MariaDB)')
+    p.add_argument('query', help='términos, "frases" y prefijos*')
+    p.add_argument('--folder', default=None, help='limitar a un subárbol de carpetas, p. ej. 2009/obras')
+    p.add_argument('--limit', type=int, default=20, help='resultados por página (default: 20)')
+    p.add_argument('--cursor', default=None, help='next_cursor de la página anterior')
+    p.add_argument('--backend', choices=BACKENDS, default=None, help='default: OCR_SEARCH_BACKEND o auto')
+    p.add_argument('--no-pages', action='store_true', help='no calcular page_hits')
+    p.add_argument('--json', action='store_true', help='salida JSON')
+    args = p.parse_args()
+
+    result = search(args.query, args.folder, args.limit, args.cursor, not args.no_pages, args.backend)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    for h in result['hits']:
+        score = f"{h['score']:8.2f}" if h['score'] is not None else ' ' * 8
+        pages = f"  págs. {','.join(map(str, h['page_hits']))}" if h.get('page_hits') else ''
+        print(f"{score}  node={h['node_id']}  {h['path']}{pages}")
+        print(f"          {h['snippet']}")
+    print(f"\n{len(result['hits'])} resultados ({result['backend']}) en {result['ms']} ms")
+    if result['next_cursor']:
+        print(f"Siguiente página: --cursor {result['next_cursor']}")
+
+
+if __name__ == '__main__':
+    main()
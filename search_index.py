@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Indexación del texto OCR en OpenSearch por lotes (_bulk) con un cliente
+persistente por proceso.
+
+Antes cada documento creaba un cliente nuevo y enviaba un client.index()
+propio, y cualquier error se perdía. Aquí:
+
+  - un cliente OpenSearch por proceso (pool de conexiones HTTP reutilizado;
+    se recrea tras un fork, p. ej. en los hijos prefork de Celery)
+  - BulkIndexer acumula documentos y los envía con _bulk al llegar a
+    OCR_INDEX_BULK_DOCS documentos u OCR_INDEX_BULK_MB, o cada
+    OCR_INDEX_FLUSH_S segundos desde un hilo de fondo
+  - los rechazos por contrapresión (429, 502-504, timeouts) se reintentan con
+    espera exponencial, solo para los documentos rechazados
+  - el estado queda por nodo en pdf_metadata: indexed_at (NULL o anterior a
+    ocr_finished_at = falta indexar), index_error e index_attempts. Lo que
+    falla se reintenta después con index_pending() (tarea periódica
+    tasks.index_pending_documents o python search_index.py --pending)
+
+Configuración por variables de entorno:
+  OPENSEARCH_URL            sin ella no se indexa nada
+  OPENSEARCH_INDEX          índice (default: ocr_documents)
+  OCR_INDEX_BULK_DOCS       documentos por lote (default: 200)
+  OCR_INDEX_BULK_MB         tamaño máximo de un lote en MB (default: 10)
+  OCR_INDEX_FLUSH_S         espera máxima de un lote incompleto (default: 5)
+  OCR_INDEX_RETRIES         reintentos ante contrapresión (default: 5)
+  OCR_INDEX_POOL            conexiones HTTP del cliente (default: 4)
+  OCR_INDEX_MAX_ATTEMPTS    intentos por nodo antes de dejar de reintentarlo
+                            (default: 5; se reinicia al indexar con éxito)
+
+Uso:
+    python search_index.py --create            # crear el índice con su mapping
+    python search_index.py --pending --limit 5000
+"""
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+import pymysql
+
+import metrics
+
+try:
+    from opensearchpy import OpenSearch
+    from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError, TransportError
+except Exception:
+    OpenSearch = None
+    OpenSearchConnectionError = TransportError = None
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+# Estados HTTP que indican contrapresión o caída transitoria: se reintentan
+RETRY_STATUS = {429, 502, 503, 504}
+MAX_BACKOFF_S = 30
+
+# path.tree tokeniza la ruta por carpetas (2009, 2009/obras, 2009/obras/1234.pdf)
+# para filtrar por subárbol con un term
+INDEX_BODY = {
+    'settings': {
+        'analysis': {
+            'tokenizer': {'path_tree': {'type': 'path_hierarchy', 'delimiter': '/'}},
+            'analyzer': {'path_tree': {'type': 'custom', 'tokenizer': 'path_tree'}},
+        },
+    },
+    'mappings': {
+        'properties': {
+            'node_id': {'type': 'long'},
+            'path': {
+                'type': 'keyword',
+                'fields': {'tree': {'type': 'text', 'analyzer': 'path_tree', 'search_analyzer': 'keyword'}},
+            },
+            'text': {'type': 'text', 'analyzer': 'spanish'},
+            'pages': {'type': 'integer'},
+            'profile': {'type': 'keyword'},
+            'ocr_finished_at': {'type': 'date', 'format': 'yyyy-MM-dd HH:mm:ss||strict_date_optional_time'},
+        },
+    },
+}
+
+
+def settings():
+    return {
+        'url': os.environ.get('OPENSEARCH_URL'),
+        'index': os.environ.get('OPENSEARCH_INDEX', 'ocr_documents'),
+        'bulk_docs': int(os.environ.get('OCR_INDEX_BULK_DOCS', 200)),
+        'bulk_bytes': int(float(os.environ.get('OCR_INDEX_BULK_MB', 10)) * 2**20),
+        'flush_s': float(os.environ.get('OCR_INDEX_FLUSH_S', 5)),
+        'retries': int(os.environ.get('OCR_INDEX_RETRIES', 5)),
+        'pool': int(os.environ.get('OCR_INDEX_POOL', 4)),
+        'max_attempts': int(os.environ.get('OCR_INDEX_MAX_ATTEMPTS', 5)),
+    }
+
+
+def enabled():
+    return bool(os.environ.get('OPENSEARCH_URL')) and OpenSearch is not None
+
+
+_client = {'pid': None, 'client': None}
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Cliente OpenSearch del proceso (None si la indexación está desactivada)"""
+    if not enabled():
+        return None
+    with _client_lock:
+        if _client['pid'] != os.getpid():
+            s = settings()
+            # Los reintentos los maneja send_bulk (por documento y con espera)
+            _client['client'] = OpenSearch([s['url']], pool_maxsize=s['pool'], timeout=60, max_retries=0)
+            _client['pid'] = os.getpid()
+        return _client['client']
+
+
+def ensure_index(client=None, index=None):
+    """Crea el índice con INDEX_BODY si no existe; True si lo creó"""
+    client = client or get_client()
+    index = index or settings()['index']
+    if client.indices.exists(index=index):
+        return False
+    client.indices.create(index=index, body=INDEX_BODY)
+    return True
+
+
+_ensured = {}   # índice -> pid del proceso que ya comprobó que existe
+
+
+def ensure_index_once(index=None):
+    """
+    ensure_index una vez por proceso e índice, antes del primer _bulk: sin él
+    OpenSearch crearía el índice con mapping dinámico (sin path.tree y con el
+    filtro por subárbol de search.py dando resultados erróneos)
+    """
+    index = index or settings()['index']
+    if _ensured.get(index) != os.getpid():
+        ensure_index(index=index)
+        _ensured[index] = os.getpid()
+
+
+def _date(value):
+    if value is None:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def document(node_id, path, text, pages=None, profile=None, ocr_finished_at=None):
+    """Documento del índice para un nodo (el _id es node_id)"""
+    return {
+        'node_id': int(node_id),
+        'path': str(path).replace('\\', '/'),
+        'text': text or '',
+        'pages': pages,
+        'profile': profile,
+        'ocr_finished_at': _date(ocr_finished_at),
+    }
+
+
+def _backoff(attempt):
+    return min(MAX_BACKOFF_S, 0.5 * 2 ** attempt)
+
+
+def _retriable(error):
+    if OpenSearchConnectionError is not None and isinstance(error, OpenSearchConnectionError):
+        return True
+    return TransportError is not None and isinstance(error, TransportError) and error.status_code in RETRY_STATUS
+
+
+def send_bulk(docs, client=None, index=None, retries=None):
+    """
+    Envía docs con _bulk; reintenta con espera los rechazados por contrapresión.
+
+    Returns:
+        tuple: (ids indexados, {node_id: error} de los que fallaron)
+    """
+    s = settings()
+    client = client or get_client()
+    index = index or s['index']
+    retries = s['retries'] if retries is None else retries
+    pending = {d['node_id']: d for d in docs}
+    ok, failed = [], {}
+    attempt = 0
+    while pending:
+        lines = []
+        for node_id, doc in pending.items():
+            lines.append(json.dumps({'index': {'_index': index, '_id': str(node_id)}}))
+            lines.append(json.dumps(doc, ensure_ascii=False, default=str))
+        try:
+            response = client.bulk(body='\n'.join(lines) + '\n')
+        except Exception as e:
+            if attempt < retries and _retriable(e):
+                metrics.inc('ocr_index_retries_total', len(pending))
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            failed.update({node_id: f"{type(e).__name__}: {e}"[:500] for node_id in pending})
+            break
+        retry = {}
+        for item in response.get('items', []):
+            result = item.get('index', {})
+            node_id = int(result.get('_id'))
+            status = result.get('status', 500)
+            if 200 <= status < 300:
+                ok.append(node_id)
+            elif status in RETRY_STATUS and attempt < retries:
+                retry[node_id] = pending[node_id]
+            else:
+                failed[node_id] = json.dumps(result.get('error') or status, ensure_ascii=False)[:500]
+        pending = retry
+        if pending:
+            metrics.inc('ocr_index_retries_total', len(pending))
+            time.sleep(_backoff(attempt))
+            attempt += 1
+    metrics.inc('ocr_index_documents_total', len(ok), status='indexed')
+    if failed:
+        metrics.inc('ocr_index_documents_total', len(failed), status='failed')
+    return ok, failed
+
+
+def mark_indexed(conn, node_ids):
+    if not node_ids:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""UPDATE pdf_metadata SET indexed_at=NOW(), index_error=NULL, index_attempts=0
+                WHERE node_id IN ({','.join(['%s'] * len(node_ids))})""",
+            list(node_ids)
+        )
+    conn.commit()
+
+
+def mark_index_failed(conn, errors):
+    """errors: {node_id: mensaje}; el nodo queda para index_pending()"""
+    if not errors:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            "UPDATE pdf_metadata SET index_error=%s, index_attempts=index_attempts+1 WHERE node_id=%s",
+            [(error, node_id) for node_id, error in errors.items()]
+        )
+    conn.commit()
+
+
+def _record(db_conf, ok, failed, conn=None):
+    """Persiste el resultado de un lote; con conn=None abre una conexión propia"""
+    own = conn is None
+    conn = conn or pymysql.connect(**db_conf)
+    try:
+        mark_indexed(conn, ok)
+        mark_index_failed(conn, failed)
+    finally:
+        if own:
+            conn.close()
+
+
+class BulkIndexer:
+    """
+    Buffer de documentos para _bulk, seguro entre hilos.
+
+    add() encola; el lote se envía al llenarse (en el hilo que llama, lo que
+    frena al productor si OpenSearch no da abasto) o por el hilo de fondo
+    cada flush_s segundos. close() envía lo pendiente.
+    """
+
+    def __init__(self, db_conf, **overrides):
+        s = dict(settings(), **overrides)
+        self.db_conf = db_conf
+        self.index = s['index']
+        self.bulk_docs = s['bulk_docs']
+        self.bulk_bytes = s['bulk_bytes']
+        self.flush_s = s['flush_s']
+        self._docs = []
+        self._bytes = 0
+        self._lock = threading.Lock()       # buffer
+        self._send_lock = threading.Lock()  # un _bulk a la vez, en orden
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, doc):
+        size = len(json.dumps(doc, ensure_ascii=False, default=str).encode('utf-8'))
+        with self._lock:
+            self._docs.append(doc)
+            self._bytes += size
+            full = len(self._docs) >= self.bulk_docs or self._bytes >= self.bulk_bytes
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bulk-indexer', daemon=True)
+                self._thread.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Envía el buffer; devuelve (indexados, fallidos)"""
+        with self._send_lock:
+            with self._lock:
+                docs, self._docs, self._bytes = self._docs, [], 0
+            if not docs:
+                return 0, 0
+            ensure_index_once(self.index)
+            ok, failed = send_bulk(docs, index=self.index)
+            try:
+                _record(self.db_conf, ok, failed)
+            except Exception as e:
+                # OpenSearch ya tiene los documentos; quedan sin indexed_at y
+                # index_pending() los vuelve a enviar (idempotente por _id)
+                print(f"Indexación: no se pudo registrar el estado de {len(docs)} nodos: {e}")
+            return len(ok), len(failed)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Indexación: error enviando lote: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+_indexer = {'pid': None, 'indexer': None}
+
+
+def indexer(db_conf):
+    """BulkIndexer del proceso (None si la indexación está desactivada)"""
+    if not enabled():
+        return None
+    with _client_lock:
+        if _indexer['pid'] != os.getpid():
+            _indexer['indexer'] = BulkIndexer(db_conf)
+            _indexer['pid'] = os.getpid()
+            atexit.register(close)
+        return _indexer['indexer']
+
+
+def index_document(db_conf, node_id, path, text, pages=None, profile=None):
+    """Encola el documento en el BulkIndexer del proceso; False si la indexación está desactivada"""
+    bulk = indexer(db_conf)
+    if bulk is None:
+        return False
+    try:
+        bulk.add(document(node_id, path, text, pages, profile))
+    except Exception as e:
+        # No debe fallar el OCR: el nodo queda sin indexed_at para index_pending()
+        print(f"Indexación: error enviando lote con node={node_id}: {e}")
+        return False
+    return True
+
+
+def close():
+    """Envía lo pendiente del BulkIndexer del proceso (fin de script o de proceso hijo)"""
+    bulk = _indexer['indexer'] if _indexer['pid'] == os.getpid() else None
+    if bulk is not None:
+        try:
+            bulk.close()
+        except Exception as e:
+            print(f"Indexación: error al cerrar: {e}")
+
+
+def pending_query(limit=None, max_attempts=None, after_id=0):
+    """Nodos 'done' sin indexar o con texto más nuevo que el indexado, por keyset desde after_id"""
+    max_attempts = max_attempts or settings()['max_attempts']
+    sql = """
+        SELECT p.node_id, n.path, p.ocr_text, p.pages, p.ocr_profile, p.ocr_finished_at
+        FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+        WHERE p.ocr_status='done' AND (p.indexed_at IS NULL OR p.indexed_at < p.ocr_finished_at)
+          AND p.index_attempts < %s AND p.node_id > %s
+        ORDER BY p.node_id
+    """
+    params = [max_attempts, after_id]
+    if limit:
+        sql += " LIMIT %s"
+        params.append(int(limit))
+    return sql, params
+
+
+def row_document(row):
+    return document(row['node_id'], row['path'], row['ocr_text'], row.get('pages'), row.get('ocr_profile'),
+                    row.get('ocr_finished_at'))
+
+
+def batches(docs, max_docs=None, max_bytes=None):
+    """Parte docs en lotes _bulk de hasta max_docs documentos y max_bytes de texto"""
+    s = settings()
+    max_docs = max_docs or s['bulk_docs']
+    max_bytes = max_bytes or s['bulk_bytes']
+    batch, size = [], 0
+    for doc in docs:
+        doc_bytes = len(doc['text'].encode('utf-8'))
+        if batch and (len(batch) >= max_docs or size + doc_bytes > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(doc)
+        size += doc_bytes
+    if batch:
+        yield batch
+
+
+def index_pending(db_conf, limit=None, log=None):
+    """
+    Indexa los nodos pendientes (nunca indexados o fallidos) por lotes.
+
+    Lee por keyset de a OCR_INDEX_BULK_DOCS filas, así en memoria hay a lo sumo
+    una página de textos OCR y no el total pendiente.
+
+    Returns:
+        dict: {'indexed': int, 'failed': int}
+    """
+    if not enabled():
+        return {'indexed': 0, 'failed': 0}
+    s = settings()
+    ensure_index_once(s['index'])
+    conn = pymysql.connect(**db_conf)
+    totals = {'indexed': 0, 'failed': 0}
+    last_id, seen = 0, 0
+    try:
+        while not limit or seen < limit:
+            page = s['bulk_docs'] if not limit else min(s['bulk_docs'], limit - seen)
+            with conn.cursor() as cur:
+                cur.execute(*pending_query(page, s['max_attempts'], last_id))
+                rows = cur.fetchall()
+            conn.commit()
+            if not rows:
+                break
+            last_id = rows[-1]['node_id']
+            seen += len(rows)
+            for batch in batches(row_document(r) for r in rows):
+                ok, failed = send_bulk(batch)
+                _record(db_conf, ok, failed, conn)
+                totals['indexed'] += len(ok)
+                totals['failed'] += len(failed)
+            if log:
+                log(f"  node_id {last_id}: {totals['indexed']} indexados, {totals['failed']} fallidos")
+    finally:
+        conn.close()
+    return totals
+
+
+def main():
+    p = argparse.ArgumentParser(description='Indexación del texto OCR en OpenSearch')
+    p.add_argument('--create', action='store_true', help='crear el índice con su mapping si no existe')
+    p.add_argument('--pending', action='store_true', help='indexar los nodos done sin indexar o fallidos')
+    p.add_argument('--limit', type=int, default=None, help='máximo de nodos con --pending')
+    args = p.parse_args()
+
+    if not enabled():
+        print('OPENSEARCH_URL no definido o opensearch-py no instalado (pip install opensearch-py)')
+        return
+    index = settings()['index']
+    if args.create or args.pending:
+        created = ensure_index()
+        print(f"Índice {index}: {'creado' if created else 'ya existe'}")
+    if args.pending:
+        totals = index_pending(DB_CONF, args.limit, log=print)
+        print(f"Listo: {totals['indexed']} indexados, {totals['failed']} fallidos")
+
+
+if __name__ == '__main__':
+    main()
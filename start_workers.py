@@ -8,36 +8,141 @@ Uso básico:
 Uso avanzado:
     python start_workers.py --workers 4 --concurrency 2 --loglevel info
 
+Reaper de leases vencidos (Celery beat embebido en el primer worker; en Windows
+usar un proceso aparte: celery -A tasks beat):
+    python start_workers.py --workers 4 --beat
+
+Métricas Prometheus (ver metrics.py): worker i en 127.0.0.1:<puerto base + i>/metrics
+    python start_workers.py --workers 4 --metrics-port 9400
+
+Presupuesto de CPU (ver cpu_budget.py):
+    python start_workers.py --workers 4 --concurrency 2 --cores 16 --affinity
+
+Autoscale por cola y memoria medida (hasta 8 procesos por worker, mínimo 1; ver admission.py):
+    python start_workers.py --workers 1 --autoscale 8,1
+
+Workers y --jobs medidos en este host (python check_system.py --calibrate, ver capacity.py):
+    python start_workers.py --from-profile
+
 El script puede:
 - Iniciar múltiples workers en paralelo
 - Configurar concurrencia por worker
 - Gestionar logs
+- Repartir los cores entre slots (--jobs de ocrmypdf, OMP_THREAD_LIMIT, afinidad)
 """
 import argparse
 import os
+import socket
 import sys
 import subprocess
 from pathlib import Path
 
+from cpu_budget import compute_budget, budget_env
+from capacity import load_profile, profile_path
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+
+def _affinity_preexec(cpus):
+    """preexec_fn que fija la afinidad del worker (solo POSIX con sched_setaffinity)"""
+    if not cpus or not hasattr(os, 'sched_setaffinity'):
+        return None
+    return lambda: os.sched_setaffinity(0, cpus)
+
+
+def _apply_affinity(proc, cpus):
+    """Fija la afinidad tras lanzar el proceso cuando no hay sched_setaffinity (Windows)"""
+    if not cpus or hasattr(os, 'sched_setaffinity') or psutil is None:
+        return
+    try:
+        psutil.Process(proc.pid).cpu_affinity(cpus)
+    except Exception as e:
+        print(f"  ⚠ No se pudo fijar afinidad para pid {proc.pid}: {e}")
+
 def main():
     parser = argparse.ArgumentParser(description='Iniciar workers de Celery para OCR')
-    parser.add_argument('--workers', type=int, default=1, help='Número de workers a iniciar (default: 1)')
-    parser.add_argument('--concurrency', type=int, default=1, help='Tareas concurrentes por worker (default: 1)')
+    parser.add_argument('--workers', type=int, default=None, help='Número de workers a iniciar (default: 1)')
+    parser.add_argument('--concurrency', type=int, default=None, help='Tareas concurrentes por worker (default: 1)')
     parser.add_argument('--loglevel', default='info', choices=['debug', 'info', 'warning', 'error'], help='Nivel de log')
     parser.add_argument('--queue', default='ocr', help='Nombre de la cola (default: ocr)')
+    parser.add_argument('--cores', type=int, default=None, help='Cores totales a repartir (default: todos)')
+    parser.add_argument('--reserve-cores', type=int, default=1, help='Cores reservados para el sistema (default: 1)')
+    parser.add_argument('--affinity', action='store_true', help='Fijar afinidad de CPU por worker')
+    parser.add_argument('--profile', choices=['archive', 'fast', 'text-only'], default=None,
+                        help='Perfil de salida por defecto de los workers de esta cola (OCR_PROFILE)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Puerto base del endpoint de métricas (uno por worker, en 127.0.0.1)')
+    parser.add_argument('--beat', action='store_true',
+                        help='Ejecutar Celery beat (reaper de leases) embebido en el primer worker')
+    parser.add_argument('--autoscale', default=None, metavar='MAX[,MIN]',
+                        help='Autoscale de Celery por worker, limitado por la memoria medida (reemplaza --concurrency)')
+    parser.add_argument('--from-profile', nargs='?', const=str(profile_path()), default=None, metavar='PERFIL',
+                        help='Usar workers y --jobs del perfil calibrado (default: capacity_profile.json); '
+                             '--workers/--concurrency explícitos tienen prioridad')
     args = parser.parse_args()
 
+    capacity = None
+    if args.from_profile:
+        capacity = load_profile(args.from_profile)
+        if not capacity:
+            print(f"❌ Error: No se encontró un perfil válido en {args.from_profile}")
+            print("   Generarlo con: python check_system.py --calibrate --root <transparencia>")
+            sys.exit(1)
+        rec = capacity['recommended']
+        if args.workers is None and args.concurrency is None:
+            args.workers, args.concurrency = rec['workers'], rec['concurrency']
+    args.workers = args.workers or 1
+    args.concurrency = args.concurrency or 1
+    if args.autoscale:
+        parts = [int(x) for x in args.autoscale.split(',')]
+        autoscale_max, autoscale_min = parts[0], (parts[1] if len(parts) > 1 else 1)
+        if autoscale_min > autoscale_max:
+            print("❌ Error: --autoscale MAX,MIN con MIN > MAX")
+            sys.exit(1)
+        # El presupuesto de CPU se calcula para el máximo de procesos
+        args.concurrency = autoscale_max
+        concurrency_args = ['--autoscale', f"{autoscale_max},{autoscale_min}"]
+    else:
+        concurrency_args = ['--concurrency', str(args.concurrency)]
+
+    budget = compute_budget(args.workers, args.concurrency, args.cores, args.reserve_cores, args.affinity)
+    if capacity and args.workers * args.concurrency == rec['workers'] * rec['concurrency']:
+        # Mismo número de slots que el medido: usar los --jobs que dieron el máximo
+        budget['jobs_per_slot'] = rec['jobs_per_slot']
+        budget['omp_thread_limit'] = rec['omp_thread_limit']
+
     print(f"""
 ╔═══════════════════════════════════════════════════════════╗
 ║         Iniciando Workers de Celery para OCR              ║
 ╠═══════════════════════════════════════════════════════════╣
 ║  Workers:       {args.workers:<5}                                      ║
-║  Concurrency:   {args.concurrency:<5} (tareas por worker)               ║
+║  Concurrency:   {args.concurrency:<5} {'(tareas por worker' + (', máx.)' if args.autoscale else ')'):<34}║
 ║  Log level:     {args.loglevel:<10}                               ║
 ║  Queue:         {args.queue:<10}                               ║
+║  Cores OCR:     {budget['cores']:<5} ({budget['slots']} slots)                        ║
+║  Jobs/slot:     {budget['jobs_per_slot']:<5} (ocrmypdf --jobs)                   ║
+║  OMP threads:   {budget['omp_thread_limit']:<5} (OMP_THREAD_LIMIT)                  ║
 ╚═══════════════════════════════════════════════════════════╝
     """)
 
+    if capacity:
+        print(f"📏 Perfil calibrado de {capacity['host']} ({capacity['created_at']}): "
+              f"{rec['pages_per_s']:.2f} páginas/s con {rec['workers']} slots x --jobs {rec['jobs_per_slot']}")
+        if capacity['host'] != socket.gethostname():
+            print(f"⚠️  El perfil se midió en otro host ({capacity['host']}); recalibrar en este.")
+        print()
+
+    if budget['oversubscribed']:
+        print(f"⚠️  {budget['slots']} slots para {budget['cores']} cores: habrá más procesos OCR que cores.")
+        print("   Reduce --workers/--concurrency para evitar cambios de contexto excesivos.\n")
+
+    worker_env = budget_env(budget)
+    if args.profile:
+        worker_env['OCR_PROFILE'] = args.profile
+
     # Verificar que existe tasks.py
     tasks_file = Path(__file__).parent / 'tasks.py'
     if not tasks_file.exists():
@@ -56,13 +161,21 @@ def main():
             '-A', 'tasks',
             'worker',
             '--loglevel', args.loglevel,
-            '--concurrency', str(args.concurrency),
+            *concurrency_args,
             '--prefetch-multiplier', '1',
             '-Q', args.queue,
         ]
+        if args.beat:
+            cmd.append('-B')
+        cpus = budget['affinity'][0] if budget['affinity'] else None
+        if args.metrics_port:
+            worker_env['OCR_METRICS_PORT'] = str(args.metrics_port)
         
         try:
-            subprocess.run(cmd, cwd=Path(__file__).parent)
+            proc = subprocess.Popen(cmd, cwd=Path(__file__).parent, env=worker_env,
+                                    preexec_fn=_affinity_preexec(cpus))
+            _apply_affinity(proc, cpus)
+            proc.wait()
         except KeyboardInterrupt:
             print("\n\n👋 Worker detenido por el usuario")
     else:
@@ -79,15 +192,26 @@ def main():
                 '-A', 'tasks',
                 'worker',
                 '--loglevel', args.loglevel,
-                '--concurrency', str(args.concurrency),
+                *concurrency_args,
                 '--prefetch-multiplier', '1',
-                '-n', worker_name,
+                '-n', f"{worker_name}@%h",  # nombre@host: ocr_runs.worker identifica el host
                 '-Q', args.queue,
                 '--logfile', str(log_file),
             ]
+            if args.beat and i == 0:
+                cmd.append('-B')
             
-            print(f"  ▶ Iniciando {worker_name} (log: {log_file})")
-            proc = subprocess.Popen(cmd, cwd=Path(__file__).parent)
+            cpus = budget['affinity'][i] if budget['affinity'] else None
+            affinity_msg = f", cores: {','.join(map(str, cpus))}" if cpus else ""
+            env = dict(worker_env)
+            if args.metrics_port:
+                env['OCR_METRICS_PORT'] = str(args.metrics_port + i)
+                env['OCR_METRICS_GROUP'] = worker_name
+                affinity_msg += f", métricas: :{args.metrics_port + i}"
+            print(f"  ▶ Iniciando {worker_name} (log: {log_file}{affinity_msg})")
+            proc = subprocess.Popen(cmd, cwd=Path(__file__).parent, env=env,
+                                    preexec_fn=_affinity_preexec(cpus))
+            _apply_affinity(proc, cpus)
             processes.append((worker_name, proc))
         
         print(f"\n✅ {args.workers} workers iniciados!")
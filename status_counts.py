@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Contadores materializados de pdf_metadata por estado y carpeta de primer nivel
+(documentos y páginas).
+
+Los monitores (monitor_progress.py, check_status.py, reset_failed.py,
+analyze_status.py) hacían `SELECT ocr_status, COUNT(*) ... GROUP BY` sobre
+pdf_metadata en cada refresco. Los triggers de mariadb_schema.sql mantienen
+ocr_status_counts en la misma transacción que cada cambio de estado, así que
+leer los totales es leer unas pocas filas.
+
+Los triggers no se disparan con ON DELETE CASCADE (borrado de nodes), por eso
+existe la reconstrucción completa, que también hay que ejecutar una vez tras
+crear la tabla en una base existente:
+
+    python status_counts.py --rebuild
+
+La tarea periódica tasks.resync_status_counts (Celery beat) hace lo mismo
+cada OCR_COUNTS_RESYNC segundos (default: 3600). La reconstrucción no borra ni
+bloquea: lee en una instantánea y aplica solo la diferencia (rebuild_counts).
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+import pymysql
+
+load_dotenv()
+
+DB_CONF = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASS', ''),
+    'database': os.environ.get('DB_NAME', 'ocr'),
+    'autocommit': False,
+    'cursorclass': pymysql.cursors.DictCursor,
+}
+
+# Misma expresión que los triggers: '' para archivos en la raíz
+TOP_FOLDER_SQL = "IF(LOCATE('/', n.path) > 0, SUBSTRING_INDEX(n.path, '/', 1), '')"
+
+
+def _scan_counts(conn, by_folder=False):
+    """Conteo directo sobre pdf_metadata (respaldo si no hay contadores)"""
+    with conn.cursor() as cur:
+        if by_folder:
+            cur.execute(f"""
+                SELECT {TOP_FOLDER_SQL} as top_folder, p.ocr_status, COUNT(*) as cnt
+                FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+                GROUP BY top_folder, p.ocr_status
+            """)
+        else:
+            cur.execute("SELECT '' as top_folder, ocr_status, COUNT(*) as cnt FROM pdf_metadata GROUP BY ocr_status")
+        return cur.fetchall()
+
+
+def read_counts(conn, by_folder=False, fallback=True):
+    """
+    Totales por estado leídos de ocr_status_counts.
+
+    Si la tabla está vacía o no existe se cuenta sobre pdf_metadata; en los
+    caminos calientes (métricas tras cada tarea, versión de búsqueda) se pasa
+    fallback=False para no recorrer la tabla completa y devolver vacío.
+
+    Returns:
+        tuple: (stats, total) con stats = {estado: cantidad}, o con
+               by_folder=True {carpeta: {estado: cantidad}}
+    """
+    try:
+        with conn.cursor() as cur:
+            if by_folder:
+                cur.execute("SELECT top_folder, ocr_status, cnt FROM ocr_status_counts WHERE cnt <> 0")
+            else:
+                cur.execute(
+                    "SELECT '' as top_folder, ocr_status, SUM(cnt) as cnt FROM ocr_status_counts "
+                    "GROUP BY ocr_status HAVING SUM(cnt) <> 0"
+                )
+            rows = cur.fetchall()
+    except pymysql.err.ProgrammingError:
+        rows = []  # tabla aún no creada
+    if not rows and fallback:
+        rows = _scan_counts(conn, by_folder)
+
+    total = sum(int(r['cnt']) for r in rows)
+    if not by_folder:
+        return {r['ocr_status']: int(r['cnt']) for r in rows}, total
+    folders = {}
+    for r in rows:
+        folders.setdefault(r['top_folder'], {})[r['ocr_status']] = int(r['cnt'])
+    return folders, total
+
+
+def read_pages(conn):
+    """
+    Páginas por estado (para estimar el trabajo restante).
+
+    Returns:
+        dict: {estado: páginas}
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ocr_status, SUM(pages) as pages FROM ocr_status_counts GROUP BY ocr_status")
+            rows = cur.fetchall()
+    except pymysql.err.ProgrammingError:
+        rows = []
+    if not rows:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ocr_status, SUM(COALESCE(pages, 0)) as pages FROM pdf_metadata GROUP BY ocr_status")
+            rows = cur.fetchall()
+    return {r['ocr_status']: int(r['pages'] or 0) for r in rows}
+
+
+def rebuild_counts(conn):
+    """
+    Corrige la deriva de ocr_status_counts respecto a pdf_metadata sin bloquear
+    a los workers.
+
+    Los conteos reales y los contadores se leen en una misma instantánea
+    consistente (lectura sin bloqueos de InnoDB); la diferencia se aplica
+    después como incremento con un upsert pequeño, de modo que los cambios que
+    los triggers registraron tras la instantánea se conservan. Un DELETE +
+    INSERT ... SELECT sobre el join tomaba bloqueos compartidos en
+    pdf_metadata y frenaba los UPDATE de los workers.
+
+    Returns:
+        int: filas de contadores corregidas
+    """
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        cur.execute(f"""
+            SELECT {TOP_FOLDER_SQL} as top_folder, COALESCE(p.ocr_status, '') as ocr_status,
+                   COUNT(*) as cnt, COALESCE(SUM(p.pages), 0) as pages
+            FROM pdf_metadata p JOIN nodes n ON n.id = p.node_id
+            GROUP BY 1, 2
+        """)
+        actual = cur.fetchall()
+        cur.execute("SELECT top_folder, ocr_status, cnt, pages FROM ocr_status_counts")
+        stored = cur.fetchall()
+    conn.commit()
+
+    drift = {}
+    for sign, rows in ((1, actual), (-1, stored)):
+        for r in rows:
+            d = drift.setdefault((r['top_folder'], r['ocr_status']), [0, 0])
+            d[0] += sign * int(r['cnt'])
+            d[1] += sign * int(r['pages'] or 0)
+    fixes = [(folder, status, cnt, pages) for (folder, status), (cnt, pages) in drift.items() if cnt or pages]
+    if fixes:
+        with conn.cursor() as cur:
+            cur.executemany(
+                """INSERT INTO ocr_status_counts (top_folder, ocr_status, cnt, pages) VALUES (%s,%s,%s,%s)
+                   ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt), pages = pages + VALUES(pages)""",
+                fixes
+            )
+        conn.commit()
+    return len(fixes)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Contadores de estado OCR materializados')
+    p.add_argument('--rebuild', action='store_true', help='recalcular los contadores desde pdf_metadata')
+    p.add_argument('--by-folder', action='store_true', help='mostrar por carpeta de primer nivel')
+    args = p.parse_args()
+
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        if args.rebuild:
+            fixed = rebuild_counts(conn)
+            print(f'Contadores reconstruidos ({fixed} filas corregidas)')
+        stats, total = read_counts(conn, args.by_folder)
+        if args.by_folder:
+            for folder in sorted(stats):
+                counts = ', '.join(f"{k}={v}" for k, v in sorted(stats[folder].items()))
+                print(f"{folder or '(raíz)':30} {counts}")
+        else:
+            for status, cnt in sorted(stats.items()):
+                print(f"{status:12}: {cnt}")
+        print(f"Total: {total}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
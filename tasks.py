@@ -4,19 +4,42 @@ Requires system dependencies: tesseract, ghostscript, poppler-utils (pdftotext).
 
 Configuración mediante variables de entorno (ver README):
   REDIS_URL, DB_* env vars
+  OCR_ENGINE=tesseract|tesserocr (motor persistente, ver tesserocr_engine.py)
+  OCR_PROFILE=archive|fast|text-only, OCR_PROFILE_RULES (perfil por carpeta)
+  OCR_PROFILING_DIR, OCR_PROFILING_NODES/PATHS/RATE (cProfile por tarea, ver profiling.py)
+  OCR_ADMISSION, OCR_MEM_RESERVE_MB, OCR_LARGE_QUEUE (admisión por memoria, ver admission.py)
+  OPENSEARCH_URL, OCR_INDEX_* (indexación por lotes en OpenSearch, ver search_index.py)
+  El índice local SQLite FTS5 (local_search.py) no se alimenta desde aquí: tiene un
+  único escritor, `local_search.py --sync --follow` en el host que sirve las búsquedas
   
 Optimizado para procesamiento masivo paralelo con almacenamiento 
-persistente en transparencia_ocr/ (estructura espejo).
+persistente en transparencia_ocr/ (estructura espejo). El OCR se ejecuta en
+OCR_SCRATCH_DIR y se publica con copia + rename atómico (ver ocr_pipeline.py).
 """
 import os
 import subprocess
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 import pymysql
 
+from ocr_pipeline import (mirror_target, relative_path, scratch_workdir, cleanup_orphans, ocr_document,
+                          resolve_profile)
+from preflight import profile_pdf, save_profile
+from scheduling import default_policy, pending_query, record_policy
+from lease import new_token, claim_node, complete_node, heartbeat, reap_stale, lease_guard, LeaseLost
+from status_counts import rebuild_counts
+from timings import StageTimer, save_run
+from profiling import profiled
+import admission
+import search_index
+from status_counts import read_counts
+import metrics
+
 load_dotenv()
 
 from celery import Celery
+from celery.signals import worker_ready, worker_process_init, worker_process_shutdown
 
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
 app = Celery('ocr_tasks', broker=REDIS_URL, backend=REDIS_URL)
@@ -32,6 +55,25 @@ app.conf.update(
     task_soft_time_limit=int(os.environ.get('OCR_SOFT_TIMEOUT', 600)),
     task_time_limit=int(os.environ.get('OCR_HARD_TIMEOUT', 900)),
     result_expires=3600,
+    # Con --autoscale, el techo de procesos también depende de la memoria medida
+    worker_autoscaler='admission:MemoryAutoscaler',
+    # Reaper de leases vencidos (requiere beat: celery -A tasks beat, o worker con -B)
+    beat_schedule={
+        'reap-stale-leases': {
+            'task': 'tasks.reap_stale_leases',
+            'schedule': float(os.environ.get('OCR_REAPER_INTERVAL', 15)),
+        },
+        # Reintenta la indexación de nodos done sin indexar (sin OPENSEARCH_URL no hace nada)
+        'index-pending-documents': {
+            'task': 'tasks.index_pending_documents',
+            'schedule': float(os.environ.get('OCR_INDEX_RETRY_INTERVAL', 300)),
+        },
+        # Corrige la deriva de ocr_status_counts (borrados en cascada de nodes)
+        'resync-status-counts': {
+            'task': 'tasks.resync_status_counts',
+            'schedule': float(os.environ.get('OCR_COUNTS_RESYNC', 3600)),
+        },
+    },
 )
 
 DB_CONF = {
@@ -45,8 +87,48 @@ DB_CONF = {
 }
 
 
+@worker_ready.connect
+def _cleanup_scratch_on_startup(**kwargs):
+    """Al arrancar el worker, elimina directorios de trabajo de procesos muertos"""
+    removed = cleanup_orphans()
+    if removed:
+        print(f"Limpieza de scratch: {removed} directorios huérfanos eliminados")
+    # Endpoint de métricas del worker: une los archivos de los procesos hijos
+    metrics.serve()
+
+
+@worker_process_init.connect
+def _init_process_metrics(**kwargs):
+    metrics.init('worker')
+
+
+@worker_process_shutdown.connect
+def _flush_process_state(**kwargs):
+    """
+    Antes de que salga el proceso hijo: envía el lote de indexación pendiente y
+    vuelca las métricas (los hijos prefork salen sin ejecutar atexit)
+    """
+    try:
+        search_index.close()
+    finally:
+        metrics.flush()
+
+
+def _record_run(conn, node_id, timer, status, result=None, error=None, worker=None):
+    """Persiste los tiempos de la ejecución (ocr_runs) y actualiza las métricas"""
+    save_run(conn, node_id, 'celery', timer, status, result, worker)
+    metrics.record_run('celery', status, timer, result, error)
+    if metrics.enabled():
+        try:
+            metrics.set_backlog(read_counts(conn, fallback=False)[0])
+        except Exception:
+            pass
+
+
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60})
-def process_pdf(self, node_id, pdf_path, root_path=None):
+@profiled('process_pdf', node_arg=(1, 'node_id'),
+          path_fn=lambda self, node_id, pdf_path, *a, **k: relative_path(Path(pdf_path)))
+def process_pdf(self, node_id, pdf_path, root_path=None, profile=None, enqueued_at=None, deferrals=0):
     """
     Realiza OCR sobre el PDF en pdf_path y actualiza MariaDB.
     
@@ -54,20 +136,47 @@ def process_pdf(self, node_id, pdf_path, root_path=None):
         node_id: id en la tabla nodes
         pdf_path: ruta absoluta al PDF a procesar
         root_path: ruta raíz de transparencia (opcional, se detecta automáticamente)
+        profile: perfil de salida ('archive'|'fast'|'text-only'); si no se indica
+                 se aplican OCR_PROFILE_RULES por carpeta y OCR_PROFILE del worker
+        enqueued_at: time.time() del encolado, para medir la espera en cola
+        deferrals: veces que la admisión por memoria aplazó el documento
     
     Returns:
-        dict: {'status': 'done'|'failed', 'node_id': int, 'ocr_pdf_path': str}
+        dict: {'status': 'done'|'failed'|'skipped'|'deferred'|'rerouted', 'node_id': int, 'ocr_pdf_path': str|None,
+               'mode': 'cache'|'incremental'|'full', 'profile': str}
     """
-    conn = pymysql.connect(**DB_CONF)
+    timer = StageTimer()
+    if enqueued_at:
+        timer.add('queue', max(0.0, time.time() - enqueued_at) * 1000)
+    conn = metrics.connect(**DB_CONF)
+    token = new_token(self.request.id)
     
     try:
-        # Marcar como processing
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE pdf_metadata SET ocr_status='processing', ocr_started_at=NOW(), updated_at=NOW() WHERE node_id=%s", 
-                (node_id,)
+        # Admisión por memoria: si el documento no cabe ahora, volver a encolarlo
+        # con retraso o desviarlo a la cola de documentos grandes (ver admission.py)
+        queue = (self.request.delivery_info or {}).get('routing_key')
+        slot = admission.admit(conn, node_id, deferrals, queue)
+        if slot.action != 'run':
+            metrics.inc('ocr_admission_total', action=slot.action)
+            s = admission.settings()
+            # Aplazado: vuelve a la misma cola (routing_key) para no caer en la cola por defecto
+            options = ({'queue': s['large_queue']} if slot.action == 'reroute'
+                       else {'countdown': s['retry_s'], 'queue': queue})
+            process_pdf.apply_async(
+                args=(node_id, pdf_path),
+                kwargs={'root_path': root_path, 'profile': profile, 'enqueued_at': enqueued_at,
+                        'deferrals': deferrals + (slot.action == 'defer')},
+                **options
             )
-            conn.commit()
+            status = 'deferred' if slot.action == 'defer' else 'rerouted'
+            return {'status': status, 'node_id': node_id, 'reason': slot.reason}
+        metrics.inc('ocr_admission_total', action='run')
+
+        # Reclamar el nodo (processing + lease); si otro worker lo tiene, salir
+        if not claim_node(conn, node_id, token):
+            metrics.task_skipped('celery')
+            return {'status': 'skipped', 'node_id': node_id, 'reason': 'nodo reclamado por otro proceso'}
+        metrics.task_started('celery')
 
         # Preparar rutas de salida siguiendo la lógica de process_sync.py
         src = Path(pdf_path)
@@ -75,143 +184,177 @@ def process_pdf(self, node_id, pdf_path, root_path=None):
             raise FileNotFoundError(f"PDF no encontrado: {pdf_path}")
 
         # Detectar estructura y crear ruta espejo en transparencia_ocr
-        parts = src.parts
-        if 'transparencia' in parts:
-            idx = parts.index('transparencia')
-            root_parent = Path(*parts[:idx]) if parts[:idx] else Path(src.anchor)
-            rel = Path(*parts[idx+1:])  # ruta relativa dentro de transparencia
-            target_base = root_parent / 'transparencia_ocr'
-            target_path = target_base / rel
-        else:
-            # Fallback si no se encuentra 'transparencia' en el path
-            raise ValueError(f"No se encontró 'transparencia' en la ruta: {pdf_path}")
-        
-        # Crear directorio de destino
-        target_path.parent.mkdir(parents=True, exist_ok=True)
-        out_pdf = target_path
-
-        # Ejecutar ocrmypdf con las mismas opciones que process_sync.py
-        cmd = [
-            'ocrmypdf',
-            '--clean',
-            '--remove-background',
-            '--deskew',
-            '-l', os.environ.get('OCR_LANG', 'spa'),
-            str(src),
-            str(out_pdf)
-        ]
-        
-        try:
-            subprocess.run(
-                cmd, 
-                check=True, 
-                timeout=int(os.environ.get('OCR_TIMEOUT', 600)),
-                capture_output=True,
-                text=True
-            )
-        except subprocess.TimeoutExpired as e:
-            error_msg = f"Timeout procesando PDF (>{os.environ.get('OCR_TIMEOUT', 600)}s)"
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE pdf_metadata SET ocr_status='failed', last_error=%s, updated_at=NOW() WHERE node_id=%s",
-                    (error_msg, node_id)
-                )
-                conn.commit()
-            return {'status': 'failed', 'node_id': node_id, 'error': error_msg}
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Error ocrmypdf: {e.stderr if e.stderr else str(e)}"
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE pdf_metadata SET ocr_status='failed', last_error=%s, updated_at=NOW() WHERE node_id=%s",
-                    (error_msg[:500], node_id)  # Limitar longitud del error
-                )
-                conn.commit()
-            return {'status': 'failed', 'node_id': node_id, 'error': error_msg}
+        out_pdf = mirror_target(src)
+        profile = resolve_profile(relative_path(src), profile)
 
-        # Extraer texto con pdftotext
-        txt_file = out_pdf.with_suffix('.txt')
-        try:
-            subprocess.run(['pdftotext', str(out_pdf), str(txt_file)], check=True)
-            ocr_text = txt_file.read_text(encoding='utf-8', errors='ignore')
-            # Limpiar archivo temporal de texto
-            txt_file.unlink(missing_ok=True)
-        except Exception as e:
-            # Si falla pdftotext, continuar sin texto (mejor tener el PDF que nada)
-            ocr_text = None
+        # OCR en directorio local (scratch); solo el PDF final cruza a transparencia_ocr.
+        # ocr_document aplica caché, OCR incremental u OCR completo (ver ocr_pipeline.py).
+        # El heartbeat renueva el lease mientras dura el OCR y nada se publica si se perdió
+        # (ver lease.py). mem mide el pico de RSS del proceso y sus hijos y actualiza la reserva
+        with heartbeat(DB_CONF, node_id, token) as hb, admission.measure(node_id, slot.est_mb) as mem, \
+                scratch_workdir(node_id) as workdir:
+            try:
+                result = ocr_document(
+                    conn, node_id, src, out_pdf, workdir,
+                    lang=os.environ.get('OCR_LANG', 'spa'),
+                    timeout=int(os.environ.get('OCR_TIMEOUT', 600)),
+                    engine=os.environ.get('OCR_ENGINE', 'tesseract'),
+                    profile=profile,
+                    timer=timer,
+                    guard=lease_guard(conn, node_id, token, lambda: hb.lost),
+                )
+            except LeaseLost:
+                metrics.task_skipped('celery')
+                return {'status': 'skipped', 'node_id': node_id, 'reason': 'lease perdido; resultado descartado'}
+            except subprocess.TimeoutExpired as e:
+                error_msg = f"Timeout procesando PDF (>{os.environ.get('OCR_TIMEOUT', 600)}s)"
+                complete_node(conn, node_id, token, 'failed', {'last_error': error_msg})
+                _record_run(conn, node_id, timer, 'failed', {'profile': profile}, 'TimeoutExpired', self.request.hostname)
+                return {'status': 'failed', 'node_id': node_id, 'error': error_msg}
+            except subprocess.CalledProcessError as e:
+                error_msg = f"Error ocrmypdf: {e.stderr if e.stderr else str(e)}"
+                # Limitar longitud del error
+                complete_node(conn, node_id, token, 'failed', {'last_error': error_msg[:500]})
+                _record_run(conn, node_id, timer, 'failed', {'profile': profile}, 'CalledProcessError', self.request.hostname)
+                return {'status': 'failed', 'node_id': node_id, 'error': error_msg}
 
+        result['est_mem_mb'] = slot.est_mb
+        result['peak_rss_mb'] = mem.peak_mb
+        ocr_text = result['ocr_text']
         snippet = (ocr_text or '')[:1000]
 
-        # Actualizar DB con resultado exitoso
-        with conn.cursor() as cur:
-            cur.execute(
-                """UPDATE pdf_metadata 
-                   SET ocr_status='done', 
-                       ocr_pdf_path=%s, 
-                       ocr_text=%s, 
-                       snippet=%s, 
-                       ocr_finished_at=NOW(), 
-                       updated_at=NOW() 
-                   WHERE node_id=%s""",
-                (str(out_pdf), ocr_text, snippet, node_id)
-            )
-            conn.commit()
+        # Actualizar DB con resultado exitoso (solo si el lease sigue siendo nuestro)
+        with timer.stage('db'):
+            accepted = complete_node(conn, node_id, token, 'done', {
+                'ocr_pdf_path': result['ocr_pdf_path'],
+                'ocr_text': ocr_text,
+                'snippet': snippet,
+                'ocr_profile': profile,
+            })
+        if not accepted:
+            metrics.task_skipped('celery')
+            return {'status': 'skipped', 'node_id': node_id, 'reason': 'lease perdido; resultado descartado'}
+        _record_run(conn, node_id, timer, 'done', result, worker=self.request.hostname)
+        # Se encola en el lote _bulk del proceso; si falla queda para index_pending_documents
+        search_index.index_document(DB_CONF, node_id, relative_path(src), ocr_text, result.get('pages'), profile)
 
         return {
             'status': 'done', 
             'node_id': node_id, 
-            'ocr_pdf_path': str(out_pdf),
-            'text_length': len(ocr_text) if ocr_text else 0
+            'ocr_pdf_path': result['ocr_pdf_path'],
+            'text_length': len(ocr_text) if ocr_text else 0,
+            'mode': result['mode'],
+            'pages_ocr': result['pages_ocr'],
+            'profile': profile,
+            'blank_pages': result['blank_pages'],
+            'timings_ms': timer.ms,
         }
 
     except Exception as e:
         # Capturar cualquier otro error no manejado
         error_msg = f"Error inesperado: {str(e)}"
         try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE pdf_metadata SET ocr_status='failed', last_error=%s, updated_at=NOW() WHERE node_id=%s",
-                    (error_msg[:500], node_id)
-                )
-                conn.commit()
+            if complete_node(conn, node_id, token, 'failed', {'last_error': error_msg[:500]}):
+                _record_run(conn, node_id, timer, 'failed', {'profile': profile}, type(e).__name__, self.request.hostname)
         except:
             pass  # Si falla la actualización, al menos lanzar el error original
         
         raise  # Re-lanzar para que Celery maneje el retry
     
     finally:
+        admission.release()
         conn.close()
 
 
 @app.task
-def enqueue_pending_pdfs(limit=None, batch_size=100):
+def preflight_pdf(node_id, pdf_path):
+    """
+    Perfila el PDF (texto, imágenes, DPI, color, cifrado, costo estimado por
+    página) y lo guarda en pdf_pages / pdf_metadata. Ver preflight.py.
+
+    Returns:
+        dict: {'node_id': int, 'pages': int, 'encrypted': bool, 'est_cost': float|None}
+    """
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        profile = profile_pdf(Path(pdf_path))
+        save_profile(conn, node_id, profile)
+        return {
+            'node_id': node_id,
+            'pages': len(profile['pages']),
+            'encrypted': profile['encrypted'],
+            'est_cost': profile['est_cost'],
+        }
+    finally:
+        conn.close()
+
+
+@app.task
+def reap_stale_leases():
+    """
+    Devuelve a la cola los nodos cuyo worker dejó de enviar heartbeat.
+
+    Returns:
+        dict: {'reaped': int, 'requeued': int}
+    """
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        reaped = reap_stale(conn)
+    finally:
+        conn.close()
+    root = os.environ.get('TRANSPARENCIA_ROOT', 'C:\\xampp_php8\\htdocs\\OCR\\transparencia')
+    requeued = 0
+    for row in reaped:
+        pdf_path = Path(root) / row['path']
+        if pdf_path.exists():
+            process_pdf.delay(row['node_id'], str(pdf_path), enqueued_at=time.time())
+            requeued += 1
+    return {'reaped': len(reaped), 'requeued': requeued}
+
+
+@app.task
+def index_pending_documents(limit=5000):
+    """
+    Indexa en OpenSearch los nodos done sin indexar o cuya indexación falló.
+
+    Returns:
+        dict: {'indexed': int, 'failed': int}
+    """
+    return search_index.index_pending(DB_CONF, limit)
+
+
+@app.task
+def resync_status_counts():
+    """Recalcula los contadores de estado materializados (ver status_counts.py)"""
+    conn = pymysql.connect(**DB_CONF)
+    try:
+        rebuild_counts(conn)
+    finally:
+        conn.close()
+
+
+@app.task
+def enqueue_pending_pdfs(limit=None, batch_size=100, policy=None):
     """
     Encola PDFs pendientes para procesamiento.
     
     Args:
         limit: número máximo de PDFs a encolar (None = todos)
         batch_size: tamaño del lote para consulta a DB
+        policy: orden de encolado ('path'|'sjf'|'ljf'|'fair', ver scheduling.py)
     
     Returns:
         dict: estadísticas de PDFs encolados
     """
+    policy = policy or default_policy()
     conn = pymysql.connect(**DB_CONF)
     try:
         with conn.cursor() as cur:
             # Obtener root path de transparencia desde las variables de entorno
             root = os.environ.get('TRANSPARENCIA_ROOT', 'C:\\xampp_php8\\htdocs\\OCR\\transparencia')
             
-            # Consultar PDFs pendientes
-            query = """
-                SELECT n.id as node_id, n.path 
-                FROM nodes n 
-                JOIN pdf_metadata p ON n.id = p.node_id 
-                WHERE p.ocr_status='pending' 
-                ORDER BY n.path ASC
-            """
-            if limit:
-                query += f" LIMIT {limit}"
-            
-            cur.execute(query)
+            # Consultar PDFs pendientes en el orden de la política
+            cur.execute(*pending_query(policy, limit))
             rows = cur.fetchall()
             
             enqueued = 0
@@ -222,13 +365,15 @@ def enqueue_pending_pdfs(limit=None, batch_size=100):
                 
                 if pdf_path.exists():
                     # Encolar tarea
-                    process_pdf.delay(node_id, str(pdf_path))
+                    process_pdf.delay(node_id, str(pdf_path), enqueued_at=time.time())
                     enqueued += 1
             
+            record_policy(conn, policy, 'celery')
             return {
                 'total_pending': len(rows),
                 'enqueued': enqueued,
-                'skipped': len(rows) - enqueued
+                'skipped': len(rows) - enqueued,
+                'policy': policy
             }
     finally:
         conn.close()
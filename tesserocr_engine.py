@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Plugin de motor OCR para ocrmypdf que mantiene Tesseract "caliente" en memoria.
+
+El motor estándar de ocrmypdf lanza un proceso `tesseract` por página, y cada
+proceso vuelve a cargar el modelo de idioma (spa.traineddata). Este plugin usa
+tesserocr (API C de Tesseract) y mantiene un pool de instancias de
+PyTessBaseAPI por proceso y por (idioma, oem, psm): cada página toma una
+instancia libre (o crea una si todas están en uso) y la devuelve al terminar.
+ocrmypdf crea un ThreadPoolExecutor nuevo en cada ejecución, así que el pool
+no puede ser por hilo: las instancias se reutilizan entre páginas y documentos
+aunque cambien los hilos. El pool crece hasta el número de páginas
+simultáneas (--jobs) y no más.
+
+Se selecciona con OCR_ENGINE=tesserocr (tasks.py) o `--engine tesserocr`
+(process_sync.py); en ese modo ocr_pipeline llama a ocrmypdf en el propio
+proceso (API, use_threads=True) para que el pool sobreviva entre documentos.
+
+La salida es la misma que con el CLI: hOCR con la cabecera de Tesseract y el
+texto de GetUTF8Text. Detección de orientación/inclinación y las opciones que
+la API no cubre (configs, user words/patterns, umbralización no estándar) se
+delegan al motor estándar. Si tesserocr no está instalado, el plugin se
+comporta igual que el motor estándar.
+
+Dependencia opcional: pip install tesserocr
+"""
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from ocrmypdf import hookimpl
+from ocrmypdf.builtin_plugins.tesseract_ocr import TesseractOcrEngine
+from PIL import Image
+
+try:
+    import tesserocr
+except Exception:
+    tesserocr = None
+
+_pools = {}                 # (lang, oem, psm) -> queue.SimpleQueue de instancias libres
+_pools_lock = threading.Lock()
+
+HOCR_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='tesseract {version}' />
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+"""
+HOCR_FOOTER = """ </body>
+</html>
+"""
+
+
+def _pool(key):
+    with _pools_lock:
+        return _pools.setdefault(key, queue.SimpleQueue())
+
+
+@contextmanager
+def _get_api(lang, oem, psm):
+    """Toma una instancia de PyTessBaseAPI libre del pool de (lang, oem, psm) y la devuelve al salir"""
+    pool = _pool((lang, oem, psm))
+    try:
+        api = pool.get_nowait()
+    except queue.Empty:
+        api = tesserocr.PyTessBaseAPI(
+            lang=lang,
+            oem=tesserocr.OEM(oem) if oem is not None else tesserocr.OEM.DEFAULT,
+            psm=tesserocr.PSM(psm) if psm is not None else tesserocr.PSM.AUTO,
+        )
+    try:
+        yield api
+    finally:
+        api.Clear()
+        pool.put(api)
+
+
+def _api_supports(options):
+    """True si las opciones se pueden atender con la API sin cambiar el resultado"""
+    if tesserocr is None:
+        return False
+    if getattr(options, 'tesseract_config', None):
+        return False
+    if getattr(options, 'user_words', None) or getattr(options, 'user_patterns', None):
+        return False
+    thresholding = getattr(options, 'tesseract_thresholding', None)
+    if thresholding not in (None, 0, 'auto'):
+        return False
+    return getattr(options, 'tesseract_timeout', None) != 0
+
+
+def _needs_downsample(input_file, options):
+    """
+    True si ocrmypdf debe reducir la imagen antes de Tesseract
+    (--tesseract-downsample-above, perfil archive en image_prep.py): ese
+    manejo y la escala del hOCR resultante los hace el motor estándar
+    """
+    if not getattr(options, 'tesseract_downsample_large_images', False):
+        return False
+    limit = getattr(options, 'tesseract_downsample_above', None)
+    if not limit:
+        return False
+    try:
+        with Image.open(input_file) as img:
+            return max(img.size) > int(limit)
+    except Exception:
+        return True
+
+
+class TesserocrOcrEngine(TesseractOcrEngine):
+    """Motor Tesseract con instancias persistentes vía tesserocr"""
+
+    @staticmethod
+    def generate_hocr(input_file, output_hocr, output_text, options):
+        if not _api_supports(options) or _needs_downsample(input_file, options):
+            return TesseractOcrEngine.generate_hocr(input_file, output_hocr, output_text, options)
+
+        timeout_ms = int((getattr(options, 'tesseract_timeout', 0) or 0) * 1000)
+        with _get_api(
+            '+'.join(options.languages),
+            getattr(options, 'tesseract_oem', None),
+            getattr(options, 'tesseract_pagesegmode', None),
+        ) as api:
+            api.SetImageFile(str(input_file))
+            recognized = api.Recognize(timeout_ms)
+            if recognized:
+                hocr = api.GetHOCRText(0)
+                text = api.GetUTF8Text()
+        if not recognized:
+            # Timeout u error: el motor estándar aplica su manejo habitual
+            return TesseractOcrEngine.generate_hocr(input_file, output_hocr, output_text, options)
+
+        Path(output_hocr).write_text(
+            HOCR_HEADER.format(version=tesserocr.tesseract_version().split()[1]) + hocr + HOCR_FOOTER,
+            encoding='utf-8'
+        )
+        Path(output_text).write_text(text, encoding='utf-8')
+
+    @staticmethod
+    def generate_pdf(input_file, output_pdf, output_text, options):
+        # El renderer sandwich necesita el PDF de Tesseract: ocr_pipeline fuerza
+        # --pdf-renderer hocr con este motor, pero por si acaso se delega.
+        return TesseractOcrEngine.generate_pdf(input_file, output_pdf, output_text, options)
+
+
+@hookimpl
+def get_ocr_engine():
+    return TesserocrOcrEngine()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tiempos por etapa de cada ejecución de OCR, guardados en ocr_runs.
+
+Etapas (milisegundos):
+  queue    espera en la cola de Celery (desde el encolado hasta el inicio)
+  read     lectura del PDF: hashes por página, checksum y consulta de caché
+  prep     detección de páginas en blanco, remuestreo de imágenes, corte de
+           páginas para OCR incremental
+  ocr      ocrmypdf (rasterizado, unpaper, Tesseract, Ghostscript/PDF-A)
+  text     extracción de texto (pdftotext o sidecar) y empalme incremental
+  publish  copia a transparencia_ocr y almacenamiento en la caché
+  db       escrituras en MariaDB (hashes, páginas en blanco, resultado)
+
+analyze_status.py muestra p50/p95/p99 por etapa y por página.
+"""
+import socket
+import time
+from contextlib import contextmanager
+
+STAGES = ('queue', 'read', 'prep', 'ocr', 'text', 'publish', 'db')
+
+
+class StageTimer:
+    """Acumula milisegundos por etapa"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ms = {}
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000)
+
+    def add(self, name, ms):
+        self.ms[name] = self.ms.get(name, 0) + int(ms)
+
+    def total_ms(self):
+        return int((time.perf_counter() - self.started) * 1000)
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+def save_run(conn, node_id, source, timer, status, result=None, worker=None):
+    """
+    Registra la ejecución en ocr_runs. Nunca propaga errores: la medición no
+    debe hacer fallar el OCR.
+    """
+    result = result or {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO ocr_runs (node_id, source, worker, status, mode, profile, pages, pages_ocr,
+                       output_bytes, est_mem_mb, peak_rss_mb, queue_ms, read_ms, prep_ms, ocr_ms, text_ms,
+                       publish_ms, db_ms, total_ms)
+                   VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
+                (node_id, source, (worker or socket.gethostname())[:100], status, result.get('mode'),
+                 result.get('profile'), result.get('pages'), result.get('pages_ocr'), result.get('output_bytes'),
+                 _int(result.get('est_mem_mb')), _int(result.get('peak_rss_mb')),
+                 *[timer.ms.get(s) for s in STAGES], timer.total_ms())
+            )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        return False
+
+
+def _percentile(values, q):
+    """Percentil por interpolación lineal (values ordenados)"""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def stage_report(conn, limit=10000):
+    """
+    Percentiles p50/p95/p99 de las últimas `limit` ejecuciones exitosas.
+
+    Returns:
+        list: por etapa (más 'total'), {'stage', 'runs', 'p50', 'p95', 'p99',
+              'page_p50', 'page_p95', 'page_p99'} en ms; los valores por página
+              usan pages_ocr (o pages si no hubo OCR parcial)
+    """
+    cols = ', '.join(f"{s}_ms" for s in STAGES)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""SELECT pages, pages_ocr, {cols}, total_ms FROM ocr_runs
+                WHERE status='done' ORDER BY id DESC LIMIT %s""",
+            (int(limit),)
+        )
+        rows = cur.fetchall()
+
+    report = []
+    for stage in (*STAGES, 'total'):
+        values = sorted(r[f"{stage}_ms"] for r in rows if r[f"{stage}_ms"] is not None)
+        per_page = sorted(
+            r[f"{stage}_ms"] / (r['pages_ocr'] or r['pages'])
+            for r in rows if r[f"{stage}_ms"] is not None and (r['pages_ocr'] or r['pages'])
+        )
+        if not values:
+            continue
+        entry = {'stage': stage, 'runs': len(values)}
+        for q in (50, 95, 99):
+            entry[f"p{q}"] = _percentile(values, q / 100)
+            entry[f"page_p{q}"] = _percentile(per_page, q / 100)
+        report.append(entry)
+    return report